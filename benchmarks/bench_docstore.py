@@ -0,0 +1,138 @@
+"""
+Benchmark of the compressed recipe store of the search index
+
+Builds the index of a recipe file twice, with the previous layout (stored
+copies of the text fields and raw_data as a JSON string) and with the
+current one (non-stored text fields and raw_data compressed by the
+DocStore), and compares their size on disk, the stored bytes a hit pages
+in, and the time to load and decode hits. Run from the repository root:
+
+    python -m benchmarks.bench_docstore data/recipe_selected_v3.json [--hits N]
+"""
+
+import argparse
+import json
+import os
+import pickle
+import random
+import tempfile
+import time
+import zlib
+from typing import Dict, List
+from whoosh.fields import ID, KEYWORD, STORED, TEXT, Schema
+from src.search_engine.indexer import RecipeIndexer
+
+
+class LegacyIndexer(RecipeIndexer):
+    """RecipeIndexer with the stored fields it had before the DocStore"""
+
+    def __init__(self, index_dir: str):
+        super().__init__(index_dir)
+        analyzer = self.chinese_analyzer
+        self.schema = Schema(
+            recipe_id=ID(stored=True, unique=True),
+            content_hash=ID(stored=True, sortable=True),
+            title=TEXT(analyzer=analyzer, stored=True),
+            ingredients_text=TEXT(analyzer=analyzer, stored=True),
+            steps_text=TEXT(analyzer=analyzer, stored=True),
+            tips_text=TEXT(analyzer=analyzer, stored=True),
+            categories_text=TEXT(analyzer=analyzer, stored=True),
+            categories=KEYWORD(stored=True, commas=True, lowercase=False, vector=True),
+            image_url=STORED,
+            top_ingredients=STORED,
+            raw_data=STORED,
+        )
+
+    def _document(self, recipe: Dict) -> Dict:
+        document = super()._document(recipe)
+        document["raw_data"] = json.dumps(recipe, ensure_ascii=False)
+        return document
+
+    def _recipe(self, raw_data) -> Dict:
+        return json.loads(raw_data)
+
+
+def directory_size(path: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def stored_bytes(indexer: RecipeIndexer) -> float:
+    """Average on-disk size of the stored fields of a document"""
+    reader = indexer.searcher().reader()
+    # Whoosh keeps the stored fields of a document as a zlib compressed pickle
+    sizes = [
+        len(zlib.compress(pickle.dumps(reader.stored_fields(docnum), 2), 3))
+        for docnum in reader.all_doc_ids()
+    ]
+    return sum(sizes) / len(sizes)
+
+
+def time_hits(indexer: RecipeIndexer, docnums: List[int], decode: bool) -> float:
+    """Seconds to load the stored fields of docnums, and decode the recipes"""
+    searcher = indexer.searcher()
+    start = time.perf_counter()
+    for docnum in docnums:
+        fields = searcher.stored_fields(docnum)
+        if decode:
+            indexer._recipe(fields["raw_data"])
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("recipes", help="Recipe JSON or JSON Lines file")
+    parser.add_argument("--hits", type=int, default=20000, help="Hits to decode")
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Timing rounds, the best is kept"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        indexers = {}
+        results = {}
+        for name, cls in (("before", LegacyIndexer), ("after", RecipeIndexer)):
+            indexer = indexers[name] = cls(os.path.join(tmp, name))
+            start = time.perf_counter()
+            count = indexer.build_from_file(args.recipes)
+            results[name] = {
+                "build": time.perf_counter() - start,
+                "disk": directory_size(indexer.index_dir),
+                "stored": stored_bytes(indexer),
+                "load": float("inf"),
+                "full": float("inf"),
+            }
+
+        docnums = random.Random(0).choices(range(count), k=args.hits)
+        # Rounds alternate between the indexes, so that noise hits both alike
+        for _ in range(args.repeat):
+            for name, indexer in indexers.items():
+                for key, decode in (("load", False), ("full", True)):
+                    took = time_hits(indexer, docnums, decode) / args.hits * 1e6
+                    results[name][key] = min(results[name][key], took)
+        for indexer in indexers.values():
+            indexer.close()
+
+    print(f"{count} recipes, {args.hits} hits")
+    print(
+        f"{'':8}{'disk MB':>10}{'stored B/doc':>14}{'load us/hit':>13}"
+        f"{'full us/hit':>13}{'build s':>9}"
+    )
+    for name, r in results.items():
+        print(
+            f"{name:8}{r['disk'] / 1e6:>10.2f}{r['stored']:>14.0f}"
+            f"{r['load']:>13.1f}{r['full']:>13.1f}{r['build']:>9.1f}"
+        )
+    before, after = results["before"], results["after"]
+    print(
+        f"disk {after['disk'] / before['disk']:.2f}x, stored bytes per hit "
+        f"{after['stored'] / before['stored']:.2f}x, full hit "
+        f"{after['full'] / before['full']:.2f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+"""
+Micro-benchmark of the recipe detail page parser
+
+Compares the per-spider parsel implementation that the spiders used to carry
+with the shared extractor in src/spiders/recipe_extractor.py, over saved HTML
+pages. Run from the repository root:
+
+    python -m benchmarks.bench_recipe_extractor [fixtures_dir] [--iterations N]
+"""
+
+import argparse
+import glob
+import os
+import time
+from typing import Callable, Dict, List, Tuple
+from scrapy.http import HtmlResponse
+from src.spiders.recipe_extractor import extract_recipe
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+FIXTURE_URL = "https://m.meishichina.com/recipe/{}/"
+
+
+def legacy_parse_recipe(response) -> Dict:
+    """The parse_recipe that used to be copied into every recipe spider"""
+    recipe_id = response.url.split("/recipe/")[-1].rstrip("/")
+    title = response.xpath("//h1/a/text()").get() or response.xpath("//h1/text()").get()
+
+    ingredients_data = {}
+    for section in response.xpath('//div[@class="rbox"]//h5'):
+        section_name = section.xpath("./text()").get()
+        if not section_name:
+            continue
+        ingredients = []
+        for ingredient in section.xpath("./following-sibling::ul[1]/li"):
+            spans = ingredient.xpath(".//span/text()").getall()
+            if len(spans) >= 2:
+                name, amount = spans[0], spans[1]
+                ingredients.append({"name": name.strip(), "amount": amount.strip()})
+        if ingredients:
+            ingredients_data[section_name] = ingredients
+
+    steps = []
+    for step in response.xpath('//ul[@class="steplist"]/li'):
+        step_text = step.xpath("./div/text()").get().strip()
+        step_text = (
+            ".".join(step_text.split(".")[1:]).strip()
+            if "." in step_text
+            else step_text
+        )
+        image_url = step.xpath("./img/@data-src").get()
+        if step_text:
+            steps.append({"text": step_text, "image": image_url})
+
+    tips = []
+    for tip in response.xpath(
+        '//div[contains(@class, "textbox")][.//h3[contains(text(), "窍门") or contains(text(), "提示")]]//div/text()'
+    ).getall():
+        tip_lines = tip.strip().split("\n")
+        tips.extend([t.strip() for t in tip_lines if t.strip()])
+
+    categories = response.xpath(
+        '//div[contains(@class, "textbox")][contains(text(), "分类：")]//a/text()'
+    ).getall()
+    categories = [cat.strip() for cat in categories if cat.strip()]
+
+    image_url = response.css("div.row.mb20 img::attr(src)").get() or ""
+
+    return {
+        "title": title or "",
+        "recipe_id": recipe_id,
+        "ingredients": ingredients_data or {},
+        "steps": steps or [],
+        "tips": tips or [],
+        "categories": categories or [],
+        "detail_url": response.url,
+        "image_url": image_url,
+    }
+
+
+def load_pages(directory: str) -> List[Tuple[str, bytes]]:
+    """Load (url, body) pairs of every .html file in directory"""
+    pages = []
+    for number, path in enumerate(sorted(glob.glob(os.path.join(directory, "*.html")))):
+        with open(path, "rb") as f:
+            pages.append((FIXTURE_URL.format(number + 1), f.read()))
+    return pages
+
+
+def bench(
+    parse: Callable[[HtmlResponse], Dict],
+    pages: List[Tuple[str, bytes]],
+    iterations: int,
+) -> float:
+    """Return pages/sec of parse, building a fresh response for every page"""
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for url, body in pages:
+            parse(HtmlResponse(url=url, body=body, encoding="utf-8"))
+    return iterations * len(pages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "fixtures", nargs="?", default=FIXTURES_DIR, help="Directory of HTML pages"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=200, help="Passes over all the pages"
+    )
+    args = parser.parse_args()
+
+    pages = load_pages(args.fixtures)
+    if not pages:
+        raise SystemExit(f"No .html pages found in {args.fixtures}")
+
+    for url, body in pages:
+        response = HtmlResponse(url=url, body=body, encoding="utf-8")
+        if legacy_parse_recipe(response) != extract_recipe(response):
+            raise SystemExit(f"Parsers disagree on {url}")
+
+    before = bench(legacy_parse_recipe, pages, args.iterations)
+    after = bench(extract_recipe, pages, args.iterations)
+    print(f"{len(pages)} pages x {args.iterations} iterations")
+    print(f"before: {before:8.0f} pages/sec")
+    print(f"after:  {after:8.0f} pages/sec ({after / before:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
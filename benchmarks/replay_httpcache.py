@@ -0,0 +1,233 @@
+"""
+Offline benchmark and regression check of the spider callbacks
+
+Replays the responses saved by the HTTP cache middleware, in either
+SQLiteCacheStorage's file or FilesystemCacheStorage's directories, through a spider's
+recipe and recipe list callbacks, without touching the network, and reports
+per-callback latency percentiles, items/sec and memory. The items and
+follow-up requests of every page can be written to a golden JSON Lines file
+and later diffed against it, so that parser changes cannot silently alter
+the output. Run from the repository root:
+
+    python -m benchmarks.replay_httpcache meishi_selected_spider --write-golden golden.jsonl
+    python -m benchmarks.replay_httpcache meishi_selected_spider --golden golden.jsonl
+"""
+
+import argparse
+import json
+import re
+import resource
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+import scrapy
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.spiderloader import SpiderLoader
+from scrapy.utils.project import data_path, get_project_settings
+from src.httpcache import decode_body, iter_cache
+
+RECIPE_URL = re.compile(r".*/recipe/\d+/?$")
+LIST_URL = re.compile(
+    r".*/recipe/(?:all/(?P<page_type>[^/]+)|category/(?P<category>[^/]+))"
+    r"/(?P<page>\d+)/?$"
+)
+
+
+class Replayer:
+    """Route cached responses to the callback the spider would have used"""
+
+    def __init__(self, spider: scrapy.Spider):
+        self.spider = spider
+
+    def route(self, url: str) -> Tuple[Optional[str], Dict]:
+        """Return the callback name and request meta for a URL"""
+        if "/category/" not in url and RECIPE_URL.match(url):
+            return "parse_recipe", {}
+        match = LIST_URL.match(url)
+        if not match:
+            return None, {}
+        page = int(match.group("page"))
+        category = match.group("category")
+        if hasattr(self.spider, "parse_recipe_list"):
+            meta = {
+                "page_type": match.group("page_type") or "category",
+                "category": category,
+                "current_page": page,
+            }
+            return "parse_recipe_list", meta
+        if hasattr(self.spider, "parse_category_page") and category:
+            category_url = url[: url.rstrip("/").rfind("/")]
+            meta = {"category_url": category_url, "current_page": page}
+            return "parse_category_page", meta
+        return None, {}
+
+    def response(self, metadata: Dict, headers: Dict, body: bytes, meta: Dict):
+        headers = Headers(headers)
+        # Filesystem caches and older SQLite caches store bodies before
+        # HttpCompressionMiddleware decodes them
+        encodings = headers.pop(b"Content-Encoding", None)
+        if encodings:
+            body = decode_body(body, encodings)
+        url = metadata["response_url"]
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        return respcls(
+            url=url,
+            status=metadata["status"],
+            headers=headers,
+            body=body,
+            request=scrapy.Request(metadata["url"], meta=meta),
+        )
+
+
+def percentile(ordered: List[float], pct: float) -> float:
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def replay(replayer: Replayer, entries, iterations: int = 1):
+    """
+    Run every routable cached response through its callback
+
+    Returns the per-callback latencies, the per-page results of the first
+    iteration keyed by URL, the number of items produced and the time spent
+    in callbacks.
+    """
+    entries = [
+        (metadata, headers, body, *replayer.route(metadata["url"]))
+        for metadata, headers, body in entries
+    ]
+    latencies = defaultdict(list)
+    results = {}
+    items = 0
+    elapsed = 0.0
+    for iteration in range(iterations):
+        for metadata, headers, body, callback, meta in entries:
+            if callback is None:
+                continue
+            response = replayer.response(metadata, headers, body, dict(meta))
+            start = time.perf_counter()
+            output = list(getattr(replayer.spider, callback)(response) or [])
+            took = time.perf_counter() - start
+            latencies[callback].append(took)
+            elapsed += took
+
+            page_items = [o for o in output if not isinstance(o, scrapy.Request)]
+            items += len(page_items)
+            if iteration == 0:
+                results[metadata["url"]] = {
+                    "url": metadata["url"],
+                    "callback": callback,
+                    "items": page_items,
+                    "requests": [
+                        o.url for o in output if isinstance(o, scrapy.Request)
+                    ],
+                }
+    return latencies, results, items, elapsed
+
+
+def _normalize(result: Dict) -> Dict:
+    # Round-trip through JSON so tuples, lists and key order compare equal
+    return json.loads(json.dumps(result, ensure_ascii=False, sort_keys=True))
+
+
+def diff_golden(results: Dict[str, Dict], golden_path: str) -> List[str]:
+    """Return a description of every page whose output differs from golden"""
+    golden = {}
+    with open(golden_path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                golden[record["url"]] = record
+
+    differences = []
+    for url in sorted(golden.keys() - results.keys()):
+        differences.append(f"missing: {url}")
+    for url in sorted(results.keys() - golden.keys()):
+        differences.append(f"new: {url}")
+    for url in sorted(results.keys() & golden.keys()):
+        current, expected = _normalize(results[url]), _normalize(golden[url])
+        if current == expected:
+            continue
+        fields = set()
+        for key in ("callback", "requests"):
+            if current[key] != expected[key]:
+                fields.add(key)
+        if len(current["items"]) != len(expected["items"]):
+            fields.add("items")
+        for item, golden_item in zip(current["items"], expected["items"]):
+            for key in item.keys() | golden_item.keys():
+                if item.get(key) != golden_item.get(key):
+                    fields.add(key)
+        differences.append(f"changed: {url} ({', '.join(sorted(fields))})")
+    return differences
+
+
+def write_golden(results: Dict[str, Dict], golden_path: str):
+    with open(golden_path, "w", encoding="utf-8") as f:
+        for url in sorted(results):
+            f.write(json.dumps(results[url], ensure_ascii=False) + "\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("spider", help="Name of the spider whose cache to replay")
+    parser.add_argument(
+        "--cache-dir", help="HTTP cache directory (default: from the settings)"
+    )
+    parser.add_argument(
+        "--iterations", type=int, default=1, help="Passes over the cached pages"
+    )
+    parser.add_argument("--golden", help="Golden JSON Lines file to diff against")
+    parser.add_argument("--write-golden", help="Write the results to this file")
+    args = parser.parse_args()
+
+    settings = get_project_settings()
+    spider_cls = SpiderLoader.from_settings(settings).load(args.spider)
+    replayer = Replayer(spider_cls())
+
+    cache_dir = args.cache_dir or data_path(settings["HTTPCACHE_DIR"])
+    entries = list(
+        iter_cache(cache_dir, args.spider, settings.getbool("HTTPCACHE_GZIP"))
+    )
+    if not entries:
+        raise SystemExit(f"No cached responses of {args.spider} in {cache_dir}")
+
+    rss_before = max_rss_mb()
+    latencies, results, items, elapsed = replay(replayer, entries, args.iterations)
+    rss_after = max_rss_mb()
+
+    print(f"{len(entries)} cached responses, {len(results)} replayed")
+    print(f"{'callback':<22}{'calls':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for callback, timings in sorted(latencies.items()):
+        timings.sort()
+        print(
+            f"{callback:<22}{len(timings):>8}"
+            + "".join(
+                f"{percentile(timings, pct) * 1000:>9.2f}" for pct in (50, 90, 99)
+            )
+        )
+    print(f"{items} items, {items / max(elapsed, 1e-9):.0f} items/sec")
+    print(f"peak RSS {rss_after:.1f} MB ({rss_after - rss_before:+.1f} MB replaying)")
+
+    if args.write_golden:
+        write_golden(results, args.write_golden)
+        print(f"Wrote {len(results)} pages to {args.write_golden}")
+    if args.golden:
+        differences = diff_golden(results, args.golden)
+        for difference in differences:
+            print(difference)
+        if differences:
+            raise SystemExit(f"{len(differences)} pages differ from {args.golden}")
+        print(f"Output matches {args.golden}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import argparse
+import time
+from search_engine.indexer import MERGE_POLICIES, RecipeIndexer
+from search_engine.recipe_stream import iter_recipes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the recipe search index")
+    parser.add_argument(
+        "--data",
+        default="data/recipe_selected_v3_samples.json",
+        help="Recipe JSON or JSON Lines file to index",
+    )
+    parser.add_argument(
+        "--mode",
+        choices=["rebuild", "upsert"],
+        default="rebuild",
+        help="Rebuild the whole index, or only add and update the given recipes",
+    )
+    parser.add_argument(
+        "--merge",
+        choices=sorted(MERGE_POLICIES),
+        default="small",
+        help="Segment merge policy of an upsert",
+    )
+    parser.add_argument(
+        "--index-dir", default="recipe_index", help="Directory of the Whoosh index"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Rebuild even if the index matches the data fingerprint",
+    )
+    parser.add_argument(
+        "--procs",
+        type=int,
+        default=1,
+        help="Number of processes tokenizing recipes in parallel",
+    )
+    parser.add_argument(
+        "--limitmb",
+        type=int,
+        default=128,
+        help="Memory limit in MB of each index writer in a parallel build",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=5000,
+        help="Recipes per batch handed to a worker in a parallel build",
+    )
+    args = parser.parse_args()
+
+    indexer = RecipeIndexer(args.index_dir)
+    if args.mode == "upsert":
+        start = time.time()
+        stats = indexer.index_recipes(
+            iter_recipes(args.data), mode="upsert", merge_policy=args.merge
+        )
+        print(
+            f"Added {stats['added']}, updated {stats['updated']} and skipped "
+            f"{stats['skipped']} recipes from {args.data} "
+            f"in {time.time() - start:.1f}s"
+        )
+        return
+
+    if not args.force and indexer.is_up_to_date(args.data):
+        print(f"Index in {args.index_dir} is up to date with {args.data}")
+        return
+
+    def report(indexed: int, rate: float):
+        print(f"Indexed {indexed} recipes ({rate:.0f} docs/sec)")
+
+    start = time.time()
+    if args.procs > 1:
+        count = indexer.build_from_file(
+            args.data,
+            procs=args.procs,
+            limitmb=args.limitmb,
+            batch_size=args.batch_size,
+            progress=report,
+        )
+    else:
+        count = indexer.build_from_file(args.data)
+    elapsed = time.time() - start
+    print(
+        f"Indexed {count} recipes from {args.data} into {args.index_dir} "
+        f"in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f} docs/sec)"
+    )
+
+
+if __name__ == "__main__":
+    main()
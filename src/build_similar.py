@@ -0,0 +1,32 @@
+import argparse
+import time
+from search_engine.indexer import RecipeIndexer
+from search_engine.similar import DEFAULT_NEIGHBOURS
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Precompute the similar recipes of every recipe in the index"
+    )
+    parser.add_argument(
+        "--index-dir", default="recipe_index", help="Directory of the Whoosh index"
+    )
+    parser.add_argument(
+        "--k",
+        type=int,
+        default=DEFAULT_NEIGHBOURS,
+        help="Number of similar recipes kept per recipe",
+    )
+    args = parser.parse_args()
+
+    indexer = RecipeIndexer(args.index_dir)
+    start = time.time()
+    count = indexer.build_similar(k=args.k)
+    print(
+        f"Computed the {args.k} most similar recipes of {count} recipes "
+        f"in {args.index_dir} in {time.time() - start:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
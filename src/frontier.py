@@ -0,0 +1,259 @@
+"""
+Crawl frontier shared by several spider processes through one SQLite file
+
+SQLiteDupeFilter and SQLiteScheduler replace Scrapy's in-memory dupefilter
+and scheduler. With FRONTIER_DB set, every process of a crawl opens the
+same file: a request seen by any of them is never scheduled again, and the
+pending requests survive a crash or restart. Without it they work in memory
+for a single process, like Scrapy's defaults.
+
+Each process works on the requests of its own shard, the spider's shard
+attribute. A request is leased to the process while it is downloaded and
+removed once done; the requests still leased by a previous run of the shard
+are handed out again when it restarts.
+"""
+
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest
+from scrapy.utils.misc import load_object
+from scrapy.utils.request import request_from_dict
+import json
+import pickle
+import zlib
+
+from src.sqlite_util import connect
+
+# Sent by FrontierMiddleware for requests that ended without reaching the
+# downloader, e.g. when a downloader middleware ignored them
+request_abandoned = object()
+
+_DUPEFILTER_SCHEMA = """
+CREATE TABLE IF NOT EXISTS seen (fingerprint BLOB PRIMARY KEY) WITHOUT ROWID
+"""
+
+_QUEUE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    shard INTEGER NOT NULL,
+    priority INTEGER NOT NULL,
+    leased INTEGER NOT NULL DEFAULT 0,
+    request BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS queue_next ON queue (shard, leased, priority, id);
+"""
+
+_STATE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS state (
+    name TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (name, shard)
+);
+CREATE TABLE IF NOT EXISTS state_items (
+    name TEXT NOT NULL,
+    shard INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    PRIMARY KEY (name, shard, item)
+) WITHOUT ROWID;
+"""
+
+
+def in_shard(key, shard, num_shards):
+    """Whether a key, e.g. a category, belongs to a shard of the crawl"""
+    return zlib.crc32(key.encode("utf-8")) % int(num_shards) == int(shard)
+
+
+class SQLiteDupeFilter:
+    """Request fingerprints seen by any process of the crawl"""
+
+    def __init__(self, path=None, fingerprinter=None):
+        self.path = path
+        self.fingerprinter = fingerprinter
+        self.db = connect(path)
+        self.db.execute(_DUPEFILTER_SCHEMA)
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(
+            crawler.settings.get("FRONTIER_DB"),
+            fingerprinter=crawler.request_fingerprinter,
+        )
+
+    def request_seen(self, request):
+        fingerprint = self.fingerprinter.fingerprint(request)
+        cursor = self.db.execute(
+            "INSERT OR IGNORE INTO seen (fingerprint) VALUES (?)", (fingerprint,)
+        )
+        return cursor.rowcount == 0
+
+    def open(self):
+        pass
+
+    def close(self, reason):
+        self.db.close()
+
+    def log(self, request, spider):
+        pass
+
+
+class SQLiteScheduler:
+    """Priority queue of pending requests, leased to one process at a time"""
+
+    def __init__(self, crawler, dupefilter, path=None):
+        self.crawler = crawler
+        self.df = dupefilter
+        self.path = path
+        self.stats = crawler.stats
+        self.spider = None
+        self.db = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        dupefilter_cls = load_object(crawler.settings["DUPEFILTER_CLASS"])
+        scheduler = cls(
+            crawler,
+            dupefilter_cls.from_crawler(crawler),
+            crawler.settings.get("FRONTIER_DB"),
+        )
+        # Every way a leased request can end
+        for signal in (
+            signals.response_received,
+            signals.request_left_downloader,
+            signals.request_dropped,
+            request_abandoned,
+        ):
+            crawler.signals.connect(scheduler.request_done, signal)
+        return scheduler
+
+    def open(self, spider):
+        self.spider = spider
+        self.shard = int(getattr(spider, "shard", 0))
+        self.db = connect(self.path)
+        self.db.executescript(_QUEUE_SCHEMA)
+        # Requests leased by a previous run of this shard never finished
+        resumed = self.db.execute(
+            "UPDATE queue SET leased = 0 WHERE shard = ? AND leased = 1",
+            (self.shard,),
+        ).rowcount
+        pending = len(self)
+        if pending:
+            spider.logger.info(
+                f"Resuming shard {self.shard} with {pending} pending requests "
+                f"({resumed} interrupted) from {self.path}"
+            )
+        return self.df.open()
+
+    def close(self, reason):
+        self.db.close()
+        return self.df.close(reason)
+
+    def has_pending_requests(self):
+        return (
+            self.db.execute(
+                "SELECT 1 FROM queue WHERE shard = ? AND leased = 0 LIMIT 1",
+                (self.shard,),
+            ).fetchone()
+            is not None
+        )
+
+    def enqueue_request(self, request):
+        if not request.dont_filter and self.df.request_seen(request):
+            self.stats.inc_value("dupefilter/filtered")
+            return False
+        data = pickle.dumps(request.to_dict(spider=self.spider), protocol=4)
+        self.db.execute(
+            "INSERT INTO queue (shard, priority, request) VALUES (?, ?, ?)",
+            (self.shard, request.priority, data),
+        )
+        self.stats.inc_value("scheduler/enqueued/sqlite")
+        return True
+
+    def next_request(self):
+        # Highest priority first, newest first within a priority like
+        # Scrapy's default LIFO queues, which keeps the frontier small
+        row = self.db.execute(
+            "UPDATE queue SET leased = 1 WHERE id = ("
+            "SELECT id FROM queue WHERE shard = ? AND leased = 0 "
+            "ORDER BY priority DESC, id DESC LIMIT 1) "
+            "RETURNING id, request",
+            (self.shard,),
+        ).fetchone()
+        if row is None:
+            return None
+        request = request_from_dict(pickle.loads(row[1]), spider=self.spider)
+        request.meta["frontier_id"] = row[0]
+        self.stats.inc_value("scheduler/dequeued/sqlite")
+        return request
+
+    def request_done(self, request, **kwargs):
+        frontier_id = request.meta.get("frontier_id")
+        if frontier_id is not None and self.db is not None:
+            self.db.execute("DELETE FROM queue WHERE id = ?", (frontier_id,))
+
+    def __len__(self):
+        return self.db.execute(
+            "SELECT COUNT(*) FROM queue WHERE shard = ? AND leased = 0",
+            (self.shard,),
+        ).fetchone()[0]
+
+
+class FrontierState:
+    """
+    State of a spider's shard kept in the frontier file, e.g. the progress
+    of its crawl planner, so that it resumes with the requests. Values are
+    saved whole as JSON, sets of items only by the items they gain.
+    """
+
+    def __init__(self, path, shard=0):
+        self.shard = int(shard)
+        self.db = connect(path)
+        self.db.executescript(_STATE_SCHEMA)
+
+    def load(self, name):
+        row = self.db.execute(
+            "SELECT value FROM state WHERE name = ? AND shard = ?",
+            (name, self.shard),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, name, value):
+        self.db.execute(
+            "INSERT OR REPLACE INTO state (name, shard, value) VALUES (?, ?, ?)",
+            (name, self.shard, json.dumps(value, ensure_ascii=False)),
+        )
+
+    def load_items(self, name):
+        rows = self.db.execute(
+            "SELECT item FROM state_items WHERE name = ? AND shard = ?",
+            (name, self.shard),
+        )
+        return {row[0] for row in rows}
+
+    def add_items(self, name, items):
+        self.db.executemany(
+            "INSERT OR IGNORE INTO state_items (name, shard, item) VALUES (?, ?, ?)",
+            [(name, self.shard, item) for item in items],
+        )
+
+    def close(self):
+        self.db.close()
+
+
+class FrontierMiddleware:
+    """
+    Release the lease of requests that a downloader middleware ignored,
+    since they never reach the downloader. Keep it first, so that it sees
+    the exceptions that no other middleware handled.
+    """
+
+    def __init__(self, crawler):
+        self.crawler = crawler
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def process_exception(self, request, exception, spider=None):
+        if isinstance(exception, IgnoreRequest):
+            self.crawler.signals.send_catch_log(request_abandoned, request=request)
+        return None
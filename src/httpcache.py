@@ -0,0 +1,478 @@
+"""
+HTTP cache storage keeping every response of a spider in one SQLite file
+
+SQLiteCacheStorage replaces Scrapy's FilesystemCacheStorage, which writes
+several small uncompressed files per response. Responses are keyed by
+request fingerprint, and their bodies are compressed with zstd when the
+zstandard package is installed, or with zlib otherwise.
+
+HttpCacheMiddleware stores responses before HttpCompressionMiddleware
+decodes them, so a gzip, deflate or brotli body is decoded here and stored
+without its Content-Encoding, and compressed again by the cache's codec.
+Images, and bodies that do not decode, are stored as they are.
+
+HTTPCACHE_EXPIRATION_RULES lists (regex, seconds) pairs: the first regex
+found in a request's URL sets how long its response stays fresh, 0 meaning
+forever. URLs matching no rule use HTTPCACHE_EXPIRATION_SECS.
+
+The cache file can be inspected, compacted and converted from the command
+line, from the repository root:
+
+    python -m src.httpcache stats .scrapy/httpcache/meishi_selected_spider.sqlite3
+    python -m src.httpcache compact .scrapy/httpcache/meishi_selected_spider.sqlite3
+    python -m src.httpcache import .scrapy/httpcache meishi_selected_spider
+    python -m src.httpcache export .scrapy/httpcache/meishi_selected_spider.sqlite3 out/
+"""
+
+from scrapy.http import Headers
+from scrapy.responsetypes import responsetypes
+from scrapy.utils.gz import gunzip
+from scrapy.utils.project import data_path, get_project_settings
+from w3lib.http import headers_dict_to_raw, headers_raw_to_dict
+import argparse
+import gzip
+import logging
+import os
+import pickle
+import re
+import sqlite3
+import time
+import zlib
+
+from src import sqlite_util
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    fingerprint TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    method TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    response_url TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    codec TEXT NOT NULL,
+    headers BLOB NOT NULL,
+    body BLOB NOT NULL
+)
+"""
+
+_COLUMNS = (
+    "fingerprint, url, method, status, response_url, timestamp, codec, headers, body"
+)
+
+CODECS = ("zstd", "zlib", "none")
+
+# Content types whose bodies are compressed already
+MEDIA_TYPES = (b"image/", b"audio/", b"video/")
+
+
+def default_codec():
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def compress(data, codec):
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if codec == "zlib":
+        return zlib.compress(data, 6)
+    return data
+
+
+def decompress(data, codec):
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("zstandard is needed to read this HTTP cache")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    return data
+
+
+def decode_body(body, encodings):
+    """
+    Undo the Content-Encoding values of a body, the last applied first.
+    Raises ValueError for an encoding it cannot decode.
+    """
+    codings = [c.strip().lower() for value in encodings for c in value.split(b",")]
+    for coding in reversed(codings):
+        if coding in (b"gzip", b"x-gzip"):
+            body = gunzip(body)
+        elif coding == b"deflate":
+            try:
+                body = zlib.decompress(body)
+            except zlib.error:
+                # Some servers send raw deflate streams without the zlib header
+                body = zlib.decompress(body, -zlib.MAX_WBITS)
+        elif coding == b"br" and brotli is not None:
+            body = brotli.decompress(body)
+        elif coding not in (b"identity", b""):
+            raise ValueError(f"Cannot decode Content-Encoding {coding!r}")
+    return body
+
+
+def encode_entry(headers, body, codec):
+    """
+    The headers, codec and stored body of a response, see the module docs
+    """
+    headers = Headers(headers)
+    encodings = headers.getlist(b"Content-Encoding")
+    if encodings:
+        try:
+            body = decode_body(body, encodings)
+        except Exception:
+            # Kept as sent, the encoding already compressed it
+            return headers, "none", body
+        del headers[b"Content-Encoding"]
+    content_type = headers.get(b"Content-Type") or b""
+    if content_type.startswith(MEDIA_TYPES):
+        codec = "none"
+    return headers, codec, compress(body, codec)
+
+
+def cache_path(cache_dir, spider_name):
+    """The cache file of a spider in HTTPCACHE_DIR"""
+    return os.path.join(cache_dir, f"{spider_name}.sqlite3")
+
+
+def connect(path, autocommit=False):
+    """
+    Open a cache file, in autocommit mode for crawls, while the offline
+    tools write it in batches they commit themselves
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite_util.connect(path, autocommit)
+    db.execute(_SCHEMA)
+    db.commit()
+    return db
+
+
+class ExpirationRules:
+    """Freshness lifetime of cached responses by URL, see the module docs"""
+
+    def __init__(self, rules, default_secs=0):
+        self.rules = [(re.compile(pattern), int(secs)) for pattern, secs in rules]
+        self.default_secs = default_secs
+
+    @classmethod
+    def from_settings(cls, settings):
+        return cls(
+            settings.getlist("HTTPCACHE_EXPIRATION_RULES"),
+            settings.getint("HTTPCACHE_EXPIRATION_SECS"),
+        )
+
+    def lifetime(self, url):
+        for pattern, secs in self.rules:
+            if pattern.search(url):
+                return secs
+        return self.default_secs
+
+    def expired(self, url, timestamp, now=None):
+        secs = self.lifetime(url)
+        return 0 < secs < (now or time.time()) - timestamp
+
+
+class SQLiteCacheStorage:
+    """HTTPCACHE_STORAGE backend, see the module docs"""
+
+    def __init__(self, settings):
+        self.cachedir = data_path(settings["HTTPCACHE_DIR"], createdir=True)
+        self.rules = ExpirationRules.from_settings(settings)
+        codec = settings.get("HTTPCACHE_COMPRESSION", "auto")
+        self.codec = default_codec() if codec == "auto" else codec
+        if self.codec not in CODECS:
+            raise ValueError(f"Unknown HTTPCACHE_COMPRESSION: {codec}")
+        if self.codec == "zstd" and zstandard is None:
+            raise ValueError("HTTPCACHE_COMPRESSION zstd needs zstandard installed")
+        self.db = None
+
+    def open_spider(self, spider):
+        self.path = cache_path(self.cachedir, spider.name)
+        self.db = connect(self.path, autocommit=True)
+        self._fingerprinter = spider.crawler.request_fingerprinter
+        logger.debug(
+            f"Using SQLite cache storage in {self.path} ({self.codec})",
+            extra={"spider": spider},
+        )
+
+    def close_spider(self, spider):
+        self.db.close()
+
+    def retrieve_response(self, spider, request):
+        row = self.db.execute(
+            "SELECT status, response_url, timestamp, codec, headers, body "
+            "FROM responses WHERE fingerprint = ?",
+            (self._fingerprint(request),),
+        ).fetchone()
+        if row is None:
+            return None
+        status, url, timestamp, codec, headers, body = row
+        if self.rules.expired(request.url, timestamp):
+            return None
+        headers = Headers(headers_raw_to_dict(headers))
+        body = decompress(body, codec)
+        respcls = responsetypes.from_args(headers=headers, url=url, body=body)
+        request.meta["cache_timestamp"] = timestamp
+        return respcls(url=url, headers=headers, status=status, body=body)
+
+    def store_response(self, spider, request, response):
+        headers, codec, body = encode_entry(response.headers, response.body, self.codec)
+        self.db.execute(
+            f"INSERT OR REPLACE INTO responses ({_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                self._fingerprint(request),
+                request.url,
+                request.method,
+                response.status,
+                response.url,
+                time.time(),
+                codec,
+                headers_dict_to_raw(headers),
+                body,
+            ),
+        )
+
+    def _fingerprint(self, request):
+        return self._fingerprinter.fingerprint(request).hex()
+
+
+def iter_sqlite_cache(path):
+    """
+    Yield (metadata, headers, body) of every response in a cache file, in
+    fingerprint order like iter_filesystem_cache
+    """
+    db = sqlite3.connect(path)
+    try:
+        rows = db.execute(f"SELECT {_COLUMNS} FROM responses ORDER BY fingerprint")
+        for (
+            fingerprint,
+            url,
+            method,
+            status,
+            response_url,
+            timestamp,
+            codec,
+            headers,
+            body,
+        ) in rows:
+            metadata = {
+                "url": url,
+                "method": method,
+                "status": status,
+                "response_url": response_url,
+                "timestamp": timestamp,
+                "fingerprint": fingerprint,
+            }
+            yield metadata, headers_raw_to_dict(headers), decompress(body, codec)
+    finally:
+        db.close()
+
+
+def iter_filesystem_cache(cache_dir, spider_name, use_gzip=False):
+    """
+    Yield (metadata, headers, body) of every response that
+    FilesystemCacheStorage saved for a spider, in a stable order
+    """
+    opener = gzip.open if use_gzip else open
+    root = os.path.join(cache_dir, spider_name)
+    for prefix in sorted(os.listdir(root)) if os.path.isdir(root) else []:
+        for key in sorted(os.listdir(os.path.join(root, prefix))):
+            path = os.path.join(root, prefix, key)
+            if not os.path.exists(os.path.join(path, "pickled_meta")):
+                continue
+            with opener(os.path.join(path, "pickled_meta"), "rb") as f:
+                metadata = pickle.load(f)
+            with opener(os.path.join(path, "response_headers"), "rb") as f:
+                headers = headers_raw_to_dict(f.read())
+            with opener(os.path.join(path, "response_body"), "rb") as f:
+                body = f.read()
+            metadata["fingerprint"] = key
+            yield metadata, headers, body
+
+
+def iter_cache(cache_dir, spider_name, use_gzip=False):
+    """Responses of a spider from whichever cache storage holds them"""
+    path = cache_path(cache_dir, spider_name)
+    if os.path.exists(path):
+        return iter_sqlite_cache(path)
+    return iter_filesystem_cache(cache_dir, spider_name, use_gzip)
+
+
+def import_entries(path, entries, codec):
+    db = connect(path)
+    count = 0
+    for metadata, headers, body in entries:
+        headers, stored_codec, body = encode_entry(headers, body, codec)
+        db.execute(
+            f"INSERT OR REPLACE INTO responses ({_COLUMNS}) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                metadata["fingerprint"],
+                metadata["url"],
+                metadata.get("method", "GET"),
+                metadata["status"],
+                metadata["response_url"],
+                metadata["timestamp"],
+                stored_codec,
+                headers_dict_to_raw(headers),
+                body,
+            ),
+        )
+        count += 1
+    db.commit()
+    db.close()
+    return count
+
+
+def export_entries(path, out_dir):
+    """Write a cache file out in FilesystemCacheStorage's layout"""
+    count = 0
+    for metadata, headers, body in iter_sqlite_cache(path):
+        fingerprint = metadata.pop("fingerprint")
+        rpath = os.path.join(out_dir, fingerprint[:2], fingerprint)
+        os.makedirs(rpath, exist_ok=True)
+        with open(os.path.join(rpath, "meta"), "wb") as f:
+            f.write(repr(metadata).encode("utf-8"))
+        with open(os.path.join(rpath, "pickled_meta"), "wb") as f:
+            pickle.dump(metadata, f, protocol=4)
+        # FilesystemCacheStorage expires responses by this file's mtime
+        timestamp = metadata["timestamp"]
+        os.utime(os.path.join(rpath, "pickled_meta"), (timestamp, timestamp))
+        with open(os.path.join(rpath, "response_headers"), "wb") as f:
+            f.write(headers_dict_to_raw(headers))
+        with open(os.path.join(rpath, "response_body"), "wb") as f:
+            f.write(body)
+        # Not kept by SQLiteCacheStorage, but read by FilesystemCacheStorage
+        for name in ("request_headers", "request_body"):
+            open(os.path.join(rpath, name), "wb").close()
+        count += 1
+    return count
+
+
+def compact(path, rules, codec=None):
+    """
+    Drop the expired responses, optionally recompress the others with
+    another codec, and give the freed pages back to the filesystem.
+    Recompressing also decodes the bodies stored with their Content-Encoding
+    by older versions.
+    """
+    db = connect(path)
+    expired = [
+        fingerprint
+        for fingerprint, url, timestamp in db.execute(
+            "SELECT fingerprint, url, timestamp FROM responses"
+        )
+        if rules.expired(url, timestamp)
+    ]
+    db.executemany(
+        "DELETE FROM responses WHERE fingerprint = ?", [(f,) for f in expired]
+    )
+    recompressed = 0
+    if codec:
+        rows = db.execute(
+            "SELECT fingerprint, codec, headers, body FROM responses "
+            "WHERE codec != ? OR instr(lower(headers), 'content-encoding:')",
+            (codec,),
+        ).fetchall()
+        for fingerprint, old_codec, headers, body in rows:
+            headers, new_codec, body = encode_entry(
+                headers_raw_to_dict(headers), decompress(body, old_codec), codec
+            )
+            db.execute(
+                "UPDATE responses SET codec = ?, headers = ?, body = ? "
+                "WHERE fingerprint = ?",
+                (new_codec, headers_dict_to_raw(headers), body, fingerprint),
+            )
+        recompressed = len(rows)
+    db.commit()
+    db.execute("VACUUM")
+    db.close()
+    return len(expired), recompressed
+
+
+def stats(path):
+    db = sqlite3.connect(path)
+    try:
+        by_codec = db.execute(
+            "SELECT codec, COUNT(*), SUM(LENGTH(body)), SUM(LENGTH(headers)) "
+            "FROM responses GROUP BY codec"
+        ).fetchall()
+    finally:
+        db.close()
+    return by_codec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    command = commands.add_parser("stats", help="Count the cached responses")
+    command.add_argument("path", help="Cache file")
+    command = commands.add_parser(
+        "compact", help="Drop expired responses and vacuum the file"
+    )
+    command.add_argument("path", help="Cache file")
+    command.add_argument("--codec", choices=CODECS, help="Recompress the bodies")
+    command = commands.add_parser(
+        "import", help="Convert a FilesystemCacheStorage cache"
+    )
+    command.add_argument("cache_dir", help="Filesystem HTTP cache directory")
+    command.add_argument("spider", help="Name of the spider whose cache to import")
+    command.add_argument("--output", help="Cache file (default: in cache_dir)")
+    command.add_argument("--codec", choices=CODECS, default=default_codec())
+    command = commands.add_parser(
+        "export", help="Write a cache file in FilesystemCacheStorage's layout"
+    )
+    command.add_argument("path", help="Cache file")
+    command.add_argument("out_dir", help="Directory of the spider's responses")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        size = os.path.getsize(args.path)
+        for codec, count, body_bytes, header_bytes in stats(args.path):
+            print(
+                f"{codec}: {count} responses, {body_bytes / 1e6:.2f} MB bodies, "
+                f"{header_bytes / 1e6:.2f} MB headers"
+            )
+        print(f"{args.path}: {size / 1e6:.2f} MB")
+    elif args.command == "compact":
+        settings = get_project_settings()
+        before = os.path.getsize(args.path)
+        expired, recompressed = compact(
+            args.path, ExpirationRules.from_settings(settings), args.codec
+        )
+        after = os.path.getsize(args.path)
+        print(
+            f"Dropped {expired} expired responses, recompressed {recompressed}, "
+            f"{before / 1e6:.2f} MB -> {after / 1e6:.2f} MB"
+        )
+    elif args.command == "import":
+        output = args.output or cache_path(args.cache_dir, args.spider)
+        settings = get_project_settings()
+        count = import_entries(
+            output,
+            iter_filesystem_cache(
+                args.cache_dir, args.spider, settings.getbool("HTTPCACHE_GZIP")
+            ),
+            args.codec,
+        )
+        print(f"Imported {count} responses into {output}")
+    elif args.command == "export":
+        count = export_entries(args.path, args.out_dir)
+        print(f"Exported {count} responses to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+from typing import Dict, Optional
+import time
+
+from src.sqlite_util import connect
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    recipe_id TEXT,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    updated REAL NOT NULL
+)
+"""
+
+
+class ImageManifest:
+    """
+    Persistent record of image downloads, keyed by their path in the images
+    store, so that a backfill can be stopped, resumed and split between
+    processes sharing the file. A download is either "done" or "failed",
+    with the number of attempts and the last error.
+    """
+
+    def __init__(self, path: str = "images_manifest.db"):
+        self.path = path
+        self._db = connect(path)
+        self._db.execute(_SCHEMA)
+
+    def get(self, path: str) -> Optional[Dict]:
+        row = self._db.execute(
+            "SELECT status, attempts, error FROM images WHERE path = ?", (path,)
+        ).fetchone()
+        if row is None:
+            return None
+        return {"status": row[0], "attempts": row[1], "error": row[2]}
+
+    def done(self, path: str, url: str, recipe_id: Optional[str] = None):
+        self._record(path, url, recipe_id, "done", None)
+
+    def failed(self, path: str, url: str, recipe_id: Optional[str], error: str):
+        self._record(path, url, recipe_id, "failed", error)
+
+    def _record(self, path, url, recipe_id, status, error):
+        self._db.execute(
+            "INSERT INTO images (path, url, recipe_id, status, attempts, error, "
+            "updated) VALUES (?, ?, ?, ?, 1, ?, ?) "
+            "ON CONFLICT(path) DO UPDATE SET url = excluded.url, "
+            "status = excluded.status, attempts = attempts + 1, "
+            "error = excluded.error, updated = excluded.updated",
+            (path, url, recipe_id, status, error, time.time()),
+        )
+
+    def counts(self) -> Dict[str, int]:
+        return dict(
+            self._db.execute("SELECT status, COUNT(*) FROM images GROUP BY status")
+        )
+
+    def close(self):
+        self._db.close()
@@ -1,11 +1,81 @@
+import argparse
+import gc
+import os
+import signal
+import socket
 import uvicorn
-from search_engine.api import app
-from fastapi.staticfiles import StaticFiles
 
-# Mount the static files
-app.mount(
-    "/", StaticFiles(directory="src/search_engine/static", html=True), name="static"
-)
+
+def create_app():
+    from search_engine.api import app
+    from fastapi.staticfiles import StaticFiles
+
+    # Mount the static files
+    app.mount(
+        "/", StaticFiles(directory="src/search_engine/static", html=True), name="static"
+    )
+    return app
+
+
+def serve_workers(host: str, port: int, workers: int):
+    """
+    Serve with several forked worker processes sharing one listening socket.
+
+    The app, the index metadata and the jieba dictionary are loaded once in
+    this process before forking, so the workers share them copy-on-write.
+    Workers only read the index, it has to be built beforehand with
+    src/build_index.py.
+    """
+    os.environ["RECIPE_INDEX_MODE"] = "readonly"
+    app = create_app()
+
+    import jieba
+
+    jieba.initialize()
+    # Keep the loaded objects out of the cyclic GC, whose bookkeeping would
+    # otherwise touch (and copy) their pages in every worker
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.set_inheritable(True)
+
+    children = []
+    for _ in range(workers):
+        pid = os.fork()
+        if pid == 0:
+            config = uvicorn.Config(app, host=host, port=port)
+            uvicorn.Server(config).run(sockets=[sock])
+            os._exit(0)
+        children.append(pid)
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    for pid in children:
+        os.waitpid(pid, 0)
+
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="localhost", port=8001)
+    parser = argparse.ArgumentParser(description="Run the recipe search server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes, more than one requires a prebuilt index",
+    )
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        serve_workers(args.host, args.port, args.workers)
+    else:
+        uvicorn.run(create_app(), host=args.host, port=args.port)
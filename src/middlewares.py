@@ -0,0 +1,372 @@
+from scrapy import signals
+from scrapy.exceptions import IgnoreRequest, NotConfigured
+from scrapy.http import TextResponse
+from scrapy.utils.misc import load_object
+from twisted.internet import task
+import hashlib
+import logging
+import re
+import time
+
+from src.seen_store import SeenRecipeStore
+
+logger = logging.getLogger(__name__)
+
+# Recipe detail pages, e.g. https://m.meishichina.com/recipe/123456/
+RECIPE_URL = re.compile(r"/recipe/(\d+)/?$")
+# Paginated recipe lists of a category or of the hot/popular rankings
+LIST_URL = re.compile(r"/recipe/(?:all|category)/[^/]+/+\d+/?$")
+
+
+def recipe_id_from_url(url):
+    if "/category/" in url:
+        return None
+    match = RECIPE_URL.search(url)
+    return match.group(1) if match else None
+
+
+class SeenRecipeMiddleware:
+    """
+    Turn a repeated crawl into an incremental refresh
+
+    Every fetched recipe detail page is recorded in a SeenRecipeStore.
+    Afterwards, a request for a known recipe is dropped if the recipe was
+    checked less than SEEN_RECIPES_RECHECK_SECS ago. Otherwise it bypasses
+    the HTTP cache and is sent as a conditional GET. A 304 response, or a
+    page whose body hash is unchanged, is dropped too, so only new and
+    changed recipes reach the spider.
+
+    List pages stay cached until HTTPCACHE_EXPIRATION_RULES expires them, so
+    new recipes are discovered once that copy is stale. A list page whose
+    recipes are all known gets meta["all_recipes_seen"], and the spiders stop
+    paginating there.
+    """
+
+    def __init__(self, store_path, recheck_secs, stats):
+        self.store_path = store_path
+        self.recheck_secs = recheck_secs
+        self.stats = stats
+        self.store = None
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("SEEN_RECIPES_ENABLED"):
+            raise NotConfigured
+        middleware = cls(
+            store_path=settings.get("SEEN_RECIPES_DB", "seen_recipes.db"),
+            recheck_secs=settings.getfloat("SEEN_RECIPES_RECHECK_SECS", 7 * 86400),
+            stats=crawler.stats,
+        )
+        crawler.signals.connect(middleware.spider_opened, signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signals.spider_closed)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.store = SeenRecipeStore(self.store_path)
+        spider.logger.info(
+            f"Seen recipe store {self.store_path} knows {len(self.store)} recipes"
+        )
+
+    def spider_closed(self, spider):
+        self.store.close()
+
+    def process_request(self, request, spider=None):
+        recipe_id = recipe_id_from_url(request.url)
+        if recipe_id is None:
+            return None
+
+        seen = self.store.get(recipe_id)
+        if seen is None:
+            return None
+        if time.time() - seen["last_checked"] < self.recheck_secs:
+            self.stats.inc_value("seen_recipes/skipped")
+            raise IgnoreRequest(f"Recipe {recipe_id} was checked recently")
+
+        request.meta["dont_cache"] = True
+        request.meta["seen_recipe"] = seen
+        if seen["etag"]:
+            request.headers.setdefault("If-None-Match", seen["etag"])
+        if seen["last_modified"]:
+            request.headers.setdefault("If-Modified-Since", seen["last_modified"])
+        return None
+
+    def process_response(self, request, response, spider=None):
+        recipe_id = recipe_id_from_url(request.url)
+        if recipe_id is None:
+            if LIST_URL.search(request.url) and isinstance(response, TextResponse):
+                self._mark_seen_list(request, response)
+            return response
+
+        seen = request.meta.get("seen_recipe")
+        if response.status == 304 and seen:
+            self.store.touch(recipe_id)
+            self.stats.inc_value("seen_recipes/not_modified")
+            raise IgnoreRequest(f"Recipe {recipe_id} is not modified")
+        if response.status != 200:
+            return response
+
+        content_hash = hashlib.sha1(response.body).hexdigest()
+        if seen and seen["content_hash"] == content_hash:
+            self.store.touch(recipe_id)
+            self.stats.inc_value("seen_recipes/unchanged")
+            raise IgnoreRequest(f"Recipe {recipe_id} is unchanged")
+
+        self.store.record(
+            recipe_id,
+            response.url,
+            etag=_header(response, b"ETag"),
+            last_modified=_header(response, b"Last-Modified"),
+            content_hash=content_hash,
+        )
+        self.stats.inc_value("seen_recipes/changed" if seen else "seen_recipes/new")
+        return response
+
+    def _mark_seen_list(self, request, response):
+        links = response.css('a[href*="/recipe/"]::attr(href)').getall()
+        recipe_ids = {recipe_id_from_url(link) for link in links} - {None}
+        if recipe_ids and len(self.store.known(recipe_ids)) == len(recipe_ids):
+            request.meta["all_recipes_seen"] = True
+            self.stats.inc_value("seen_recipes/lists_all_seen")
+
+
+def _header(response, name):
+    value = response.headers.get(name)
+    return value.decode("latin-1") if value else None
+
+
+# Limits of every class of host, see AdaptiveThrottle
+DEFAULT_BUDGETS = {
+    "html": {
+        "min_concurrency": 1,
+        "max_concurrency": 16,
+        "min_delay": 0.25,
+        "max_delay": 60.0,
+        "target_latency": 2.0,
+    },
+    "image": {
+        "min_concurrency": 2,
+        "max_concurrency": 32,
+        "min_delay": 0.0,
+        "max_delay": 30.0,
+        "target_latency": 3.0,
+    },
+}
+
+# Statuses telling us to slow down
+BACKOFF_STATUSES = {429, 500, 502, 503, 504, 520, 521, 522, 524}
+
+
+class HostState:
+    """What the throttle has observed of one downloader slot"""
+
+    def __init__(self, kind, concurrency, delay):
+        self.kind = kind
+        # Kept as a float so that additive increase can add fractions
+        self.concurrency = float(concurrency)
+        self.delay = delay
+        self.latency = None
+        self.responses = 0
+        self.backoffs = 0
+        self.retries = 0
+        self.failures = 0
+        self.last_backoff = 0.0
+
+
+class AdaptiveThrottle:
+    """
+    Adjust the concurrency and delay of every host with AIMD
+
+    Each successful response whose latency stays under the budget's target
+    raises the host's concurrency by about one request per round trip and
+    shortens its delay; a response that needed retries does not count as a
+    success. A 429 or 5xx response, a latency over twice the target or a
+    download failing with one of RETRY_EXCEPTIONS (timeouts, refused or lost
+    connections) halves the concurrency and doubles the delay (or honours
+    Retry-After), at most once per round trip. Hosts are the downloader's
+    slots: the download slots listed in ADAPTIVE_THROTTLE_IMAGE_SLOTS, like
+    the IMAGES_DOWNLOAD_SLOT of every image request, get the image budget. A
+    slot configured in DOWNLOAD_SLOTS never goes over the concurrency set
+    there.
+
+    It is a downloader middleware, placed after RetryMiddleware so that it
+    sees download exceptions before they are retried, and it follows
+    responses through the response_downloaded signal.
+
+    The current concurrency, delay and latency of every host are published
+    in the crawl stats under adaptive_throttle/ and logged periodically.
+    """
+
+    def __init__(self, crawler):
+        settings = crawler.settings
+        if not settings.getbool("ADAPTIVE_THROTTLE_ENABLED"):
+            raise NotConfigured
+        if settings.getbool("AUTOTHROTTLE_ENABLED"):
+            raise NotConfigured("AutoThrottle already controls download delays")
+        self.crawler = crawler
+        self.image_slots = set(settings.getlist("ADAPTIVE_THROTTLE_IMAGE_SLOTS"))
+        self.slot_limits = {
+            key: config["concurrency"]
+            for key, config in settings.getdict("DOWNLOAD_SLOTS").items()
+            if "concurrency" in config
+        }
+        self.budgets = {
+            kind: {
+                **limits,
+                **settings.getdict("ADAPTIVE_THROTTLE_BUDGETS").get(kind, {}),
+            }
+            for kind, limits in DEFAULT_BUDGETS.items()
+        }
+        self.log_interval = settings.getfloat("ADAPTIVE_THROTTLE_LOG_INTERVAL", 60)
+        self.debug = settings.getbool("ADAPTIVE_THROTTLE_DEBUG")
+        self.exceptions = tuple(
+            load_object(x) if isinstance(x, str) else x
+            for x in settings.getlist("RETRY_EXCEPTIONS")
+        )
+        self.hosts = {}
+        crawler.signals.connect(self.spider_opened, signal=signals.spider_opened)
+        crawler.signals.connect(self.spider_closed, signal=signals.spider_closed)
+        crawler.signals.connect(
+            self.response_downloaded, signal=signals.response_downloaded
+        )
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        return cls(crawler)
+
+    def spider_opened(self, spider):
+        self.log_loop = task.LoopingCall(self.log_stats, spider)
+        if self.log_interval > 0:
+            self.log_loop.start(self.log_interval, now=False)
+
+    def spider_closed(self, spider):
+        if self.log_loop.running:
+            self.log_loop.stop()
+        self.log_stats(spider)
+
+    def kind_of(self, key):
+        return "image" if key in self.image_slots else "html"
+
+    def _host(self, key, slot):
+        host = self.hosts.get(key)
+        if host is None:
+            host = self.hosts[key] = HostState(
+                self.kind_of(key), slot.concurrency, slot.delay
+            )
+        return host
+
+    def response_downloaded(self, response, request, spider):
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        latency = request.meta.get("download_latency")
+        if slot is None or latency is None:
+            return
+
+        host = self._host(key, slot)
+        budget = self.budgets[host.kind]
+        host.responses += 1
+        # Exponentially weighted moving average of the latency
+        host.latency = (
+            latency if host.latency is None else 0.8 * host.latency + 0.2 * latency
+        )
+        retried = request.meta.get("retry_times", 0) > 0
+        if retried:
+            host.retries += 1
+
+        if (
+            response.status in BACKOFF_STATUSES
+            or latency > 2 * budget["target_latency"]
+        ):
+            self._decrease(host, budget, _retry_after(response))
+        elif (
+            response.status < 400
+            and not retried
+            and host.latency <= budget["target_latency"]
+        ):
+            self._increase(host, budget, self.slot_limits.get(key))
+
+        self._apply(key, slot, host)
+        if self.debug:
+            logger.info(
+                f"{key}: status {response.status}, latency {latency * 1000:.0f} ms, "
+                f"concurrency {slot.concurrency}, delay {slot.delay:.2f}s",
+                extra={"spider": spider},
+            )
+
+    def process_exception(self, request, exception, spider=None):
+        """Back off from a host whose download timed out or failed"""
+        if not isinstance(exception, self.exceptions):
+            return None
+        key = request.meta.get("download_slot")
+        slot = self.crawler.engine.downloader.slots.get(key)
+        if slot is None:
+            return None
+
+        host = self._host(key, slot)
+        host.failures += 1
+        self._decrease(host, self.budgets[host.kind])
+        self._apply(key, slot, host)
+        if self.debug:
+            logger.info(
+                f"{key}: {type(exception).__name__}, "
+                f"concurrency {slot.concurrency}, delay {slot.delay:.2f}s",
+                extra={"spider": spider},
+            )
+        return None
+
+    def _increase(self, host, budget, limit=None):
+        # Additive increase: about +1 concurrent request per round trip
+        host.concurrency = min(
+            budget["max_concurrency"],
+            limit or budget["max_concurrency"],
+            host.concurrency + 1 / host.concurrency,
+        )
+        host.delay = max(budget["min_delay"], host.delay * 0.9)
+
+    def _decrease(self, host, budget, retry_after=None):
+        clock = time.monotonic()
+        # Back off at most once per round trip, the responses of requests
+        # sent before the last decrease do not reflect it yet
+        if clock - host.last_backoff < max(host.delay, host.latency or 0):
+            return
+        host.last_backoff = clock
+        host.backoffs += 1
+        host.concurrency = max(budget["min_concurrency"], host.concurrency / 2)
+        delay = max(host.delay * 2, budget["min_delay"], 0.25)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        host.delay = min(budget["max_delay"], delay)
+
+    def _apply(self, key, slot, host):
+        slot.concurrency = int(host.concurrency)
+        slot.delay = host.delay
+        self._publish(key, host)
+
+    def _publish(self, key, host):
+        stats = self.crawler.stats
+        prefix = f"adaptive_throttle/{key}"
+        stats.set_value(f"{prefix}/concurrency", int(host.concurrency))
+        stats.set_value(f"{prefix}/delay", round(host.delay, 3))
+        stats.set_value(f"{prefix}/latency_ms", round((host.latency or 0) * 1000))
+        stats.set_value(f"{prefix}/backoffs", host.backoffs)
+        stats.set_value(f"{prefix}/retries", host.retries)
+        stats.set_value(f"{prefix}/failures", host.failures)
+
+    def log_stats(self, spider):
+        for key, host in sorted(self.hosts.items()):
+            spider.logger.info(
+                f"Throttle {key} ({host.kind}): concurrency "
+                f"{int(host.concurrency)}, delay {host.delay:.2f}s, latency "
+                f"{(host.latency or 0) * 1000:.0f} ms, {host.responses} responses, "
+                f"{host.backoffs} backoffs, {host.retries} retries, "
+                f"{host.failures} failures"
+            )
+
+
+def _retry_after(response):
+    value = response.headers.get(b"Retry-After")
+    try:
+        return float(value) if value else None
+    except ValueError:
+        # An HTTP date, not worth parsing here
+        return None
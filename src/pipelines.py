@@ -1,13 +1,23 @@
 import scrapy
+from itemadapter import ItemAdapter
 from scrapy.pipelines.images import ImagesPipeline
+from scrapy.utils.log import failure_to_exc_info
+from twisted.internet import defer, task, threads
 from urllib.parse import urlparse
+from whoosh.index import LockError
+import logging
 import os
 import uuid
 
+from src.image_manifest import ImageManifest
+from src.search_engine.indexer import RecipeIndexer
+
+logger = logging.getLogger(__name__)
+
 
 class MeishiPipeline:
     def process_item(self, item, spider):
-        print("MeishiPipeline processing item:", item.get("title"))  # Debug print
+        spider.logger.debug(f"MeishiPipeline processing item: {item.get('title')}")
         # Check if we have raw_ingredients (from list page)
         if "raw_ingredients" in item:
             raw_ingredients = item["raw_ingredients"]
@@ -20,7 +30,113 @@ class MeishiPipeline:
         return item
 
 
+class MeishiIndexPipeline:
+    """
+    Commit scraped recipes into the search index in batches, replacing
+    existing recipes by recipe_id, so they are searchable minutes after
+    being crawled. A batch is committed when it is full or when the flush
+    interval elapses, on a thread so the reactor is not blocked.
+    """
+
+    def __init__(self, index_dir, batch_size, flush_interval, merge_policy):
+        self.index_dir = index_dir
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.merge_policy = merge_policy
+        self.buffer = []
+        # Only one commit runs at a time
+        self.lock = defer.DeferredLock()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        return cls(
+            index_dir=settings.get("RECIPE_INDEX_DIR", "recipe_index"),
+            batch_size=settings.getint("RECIPE_INDEX_BATCH_SIZE", 200),
+            flush_interval=settings.getfloat("RECIPE_INDEX_FLUSH_INTERVAL", 60),
+            merge_policy=settings.get("RECIPE_INDEX_MERGE_POLICY", "small"),
+        )
+
+    def open_spider(self, spider):
+        self.indexer = RecipeIndexer(self.index_dir)
+        self.flush_loop = task.LoopingCall(self.flush, spider)
+        self.flush_loop.start(self.flush_interval, now=False)
+
+    def close_spider(self, spider):
+        if self.flush_loop.running:
+            self.flush_loop.stop()
+        # Wait for the last batch and any commit still running
+        return self.flush(spider, force=True)
+
+    def process_item(self, item, spider):
+        adapter = ItemAdapter(item)
+        # Only recipe detail items are indexed
+        if adapter.get("recipe_id") and adapter.get("title"):
+            self.buffer.append(adapter.asdict())
+            if len(self.buffer) >= self.batch_size:
+                self.flush(spider)
+        return item
+
+    def flush(self, spider, force=False):
+        if not self.buffer and not force:
+            return None
+        batch, self.buffer = self.buffer, []
+        d = self.lock.run(threads.deferToThread, self._commit, batch, spider)
+        d.addErrback(self._commit_failed, batch, spider, force)
+        return d
+
+    def _commit(self, batch, spider):
+        if not batch:
+            return
+        stats = self.indexer.index_recipes(
+            batch, mode="upsert", merge_policy=self.merge_policy
+        )
+        spider.logger.info(
+            f"Indexed {len(batch)} recipes into {self.index_dir}: "
+            f"{stats['added']} added, {stats['updated']} updated, "
+            f"{stats['skipped']} unchanged"
+        )
+
+    def _commit_failed(self, failure, batch, spider, force):
+        # Keep the batch, the next flush retries it
+        self.buffer[:0] = batch
+        if failure.check(LockError):
+            # Another process is writing the index
+            spider.logger.warning(f"Index is locked, keeping {len(batch)} recipes")
+        else:
+            spider.logger.error(
+                f"Error indexing {len(batch)} recipes, keeping them to retry",
+                exc_info=failure_to_exc_info(failure),
+            )
+        if force:
+            # The last flush has no retry left, fail closing the spider
+            return failure
+
+
 class MeishiImagePipeline(ImagesPipeline):
+    """
+    Main and, with IMAGES_STEPS_ENABLED, step images of the recipes
+
+    Images already in the store, or that failed IMAGES_MAX_ATTEMPTS times
+    according to the IMAGES_MANIFEST database, are not requested again, so
+    that an interrupted backfill resumes where it stopped. All image
+    requests share the IMAGES_DOWNLOAD_SLOT downloader slot, whose
+    parallelism is set in DOWNLOAD_SLOTS.
+    """
+
+    def open_spider(self, spider):
+        settings = spider.crawler.settings
+        self.stats = spider.crawler.stats
+        self.steps_enabled = settings.getbool("IMAGES_STEPS_ENABLED")
+        self.download_slot = settings.get("IMAGES_DOWNLOAD_SLOT")
+        self.max_attempts = settings.getint("IMAGES_MAX_ATTEMPTS", 3)
+        self.manifest = ImageManifest(settings.get("IMAGES_MANIFEST"))
+        return super().open_spider(spider)
+
+    def close_spider(self, spider):
+        spider.logger.info(f"Image manifest: {self.manifest.counts()}")
+        self.manifest.close()
+
     def get_media_requests(self, item, info):
         headers = {
             "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
@@ -29,41 +145,97 @@ class MeishiImagePipeline(ImagesPipeline):
             "Accept-Language": "en-US,en;q=0.9",
             "Referer": item.get("detail_url", "https://m.meishichina.com/"),
         }
+        requests = []
 
         # Handle main recipe image
         if item.get("image_url"):
-            yield scrapy.Request(
-                item["image_url"],
-                headers=headers,
-                meta={
-                    "recipe_id": item["recipe_id"],
-                    "image_type": "main",
-                },
-                dont_filter=True,
-                errback=self.download_error,
+            requests.append(
+                scrapy.Request(
+                    item["image_url"],
+                    headers=headers,
+                    meta={
+                        "recipe_id": item["recipe_id"],
+                        "image_type": "main",
+                    },
+                    dont_filter=True,
+                    errback=self.download_error,
+                )
             )
 
         # Handle step images
-        # hack disable step images for now
-        if item.get("steps_dummy"):
-            headers["Referer"] = item.get("detail_url", "https://m.meishichina.com/")
-            for idx, step in enumerate(item["steps"]):
+        if self.steps_enabled:
+            for idx, step in enumerate(item.get("steps", [])):
                 if step.get("image"):
-                    yield scrapy.Request(
-                        step["image"],
-                        headers=headers,
-                        meta={
-                            "recipe_id": item["recipe_id"],
-                            "image_type": "step",
-                            "step_index": idx,
-                            "step_text": step.get("text", ""),
-                        },
-                        dont_filter=True,
-                        errback=self.download_error,
+                    requests.append(
+                        scrapy.Request(
+                            step["image"],
+                            headers=headers,
+                            meta={
+                                "recipe_id": item["recipe_id"],
+                                "image_type": "step",
+                                "step_index": idx,
+                                "step_text": step.get("text", ""),
+                            },
+                            dont_filter=True,
+                            errback=self.download_error,
+                        )
                     )
 
+        for request in requests:
+            if self.skip_request(request):
+                continue
+            if self.download_slot:
+                request.meta["download_slot"] = self.download_slot
+            yield request
+
+    def skip_request(self, request):
+        path = self.file_path(request)
+        basedir = getattr(self.store, "basedir", None)
+        if basedir and os.path.exists(os.path.join(basedir, path)):
+            self.stats.inc_value("images/skipped_existing")
+            return True
+        entry = self.manifest.get(path)
+        if (
+            entry
+            and entry["status"] == "failed"
+            and entry["attempts"] >= self.max_attempts
+        ):
+            self.stats.inc_value("images/skipped_failed")
+            return True
+        return False
+
+    def media_downloaded(self, response, request, info, *, item=None):
+        path = self.file_path(request, response=response, info=info, item=item)
+        recipe_id = request.meta.get("recipe_id")
+
+        def done(result):
+            self.manifest.done(path, request.url, recipe_id)
+            return result
+
+        def failed(failure):
+            self.manifest.failed(path, request.url, recipe_id, str(failure.value))
+            # Recent Scrapy versions pass the exception on to media_failed
+            request.meta["image_manifest_recorded"] = True
+            return failure
+
+        # A coroutine in recent Scrapy versions, a plain value in older ones
+        d = defer.maybeDeferred(
+            super().media_downloaded, response, request, info, item=item
+        )
+        return d.addCallbacks(done, failed)
+
+    def media_failed(self, failure, request, info):
+        if not request.meta.get("image_manifest_recorded"):
+            self.manifest.failed(
+                self.file_path(request, info=info),
+                request.url,
+                request.meta.get("recipe_id"),
+                str(failure.value),
+            )
+        return super().media_failed(failure, request, info)
+
     def download_error(self, failure):
-        print(f"Error downloading image: {failure.value}")
+        logger.warning(f"Error downloading image: {failure.value}")
         return None
 
     def file_path(self, request, response=None, info=None, *, item=None):
@@ -82,7 +254,7 @@ class MeishiImagePipeline(ImagesPipeline):
 
             return f"recipe_images/error_{uuid.uuid4()}{ext}"
         except Exception as e:
-            print(f"Error in file_path: {e}")
+            logger.error(f"Error in file_path: {e}")
             return f"recipe_images/error_{uuid.uuid4()}.jpg"
 
     def item_completed(self, results, item, info):
@@ -95,8 +267,8 @@ class MeishiImagePipeline(ImagesPipeline):
             if image_paths:
                 item["image_paths"] = image_paths
             else:
-                print(f"No valid image paths for {item.get('title')}")
+                logger.debug(f"No valid image paths for {item.get('title')}")
         except Exception as e:
-            print(f"Error processing image results: {e}")
+            logger.error(f"Error processing image results: {e}")
 
         return item
@@ -1,11 +1,33 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Optional
-import json
+from typing import List, Literal, Optional
+import asyncio
+import os
+from .executor import SearchExecutor, SearchOverloaded
 from .indexer import RecipeIndexer
 from math import ceil
 
-app = FastAPI()
+# Set once the searchers of this process are open and warm
+ready = False
+
+
+async def warm_up():
+    global ready
+    await asyncio.to_thread(executor.run_on_all_workers, indexer.warm_up)
+    ready = True
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # Warm up in the background, /ready reports when it is done
+    warm_up_task = asyncio.create_task(warm_up())
+    yield
+    warm_up_task.cancel()
+    executor.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -16,13 +38,53 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+RECIPE_DATA_PATH = os.environ.get(
+    "RECIPE_DATA_PATH", "data/recipe_selected_v3_samples.json"
+)
+RECIPE_INDEX_DIR = os.environ.get("RECIPE_INDEX_DIR", "recipe_index")
+# "auto": reuse the index if it was built from the current data, else rebuild
+# "readonly": only open an index built offline with src/build_index.py
+RECIPE_INDEX_MODE = os.environ.get("RECIPE_INDEX_MODE", "auto")
+
+# Search result cache bounds
+SEARCH_CACHE_SIZE = int(os.environ.get("SEARCH_CACHE_SIZE", "1024"))
+SEARCH_CACHE_TTL = float(os.environ.get("SEARCH_CACHE_TTL", "300"))
+SEARCH_CACHE_MAX_MB = float(os.environ.get("SEARCH_CACHE_MAX_MB", "64"))
+
 # Initialize the indexer
-indexer = RecipeIndexer()
+indexer = RecipeIndexer(
+    RECIPE_INDEX_DIR,
+    readonly=RECIPE_INDEX_MODE == "readonly",
+    query_cache_size=SEARCH_CACHE_SIZE,
+    query_cache_ttl=SEARCH_CACHE_TTL,
+    query_cache_max_bytes=int(SEARCH_CACHE_MAX_MB * 1024 * 1024),
+)
+if RECIPE_INDEX_MODE != "readonly":
+    indexer.load_or_build(RECIPE_DATA_PATH)
+
+# Index lookups run on a bounded thread pool instead of the event loop
+executor = SearchExecutor(
+    max_workers=int(os.environ.get("SEARCH_WORKERS", "4")),
+    max_queue=int(os.environ.get("SEARCH_QUEUE_SIZE", "16")),
+    timeout=float(os.environ.get("SEARCH_TIMEOUT", "5")),
+)
 
-# Load initial data
-with open("data/recipe_selected_v3_samples.json", "r", encoding="utf-8") as f:
-    recipes = json.load(f)
-    indexer.index_recipes(recipes)
+
+async def run_search(func, *args, **kwargs):
+    """Run a blocking indexer call on the search executor"""
+    try:
+        return await executor.run(func, *args, **kwargs)
+    except SearchOverloaded:
+        raise HTTPException(status_code=503, detail="Search is overloaded")
+    except asyncio.TimeoutError:
+        raise HTTPException(status_code=504, detail="Search timed out")
+
+
+@app.get("/ready")
+async def get_ready():
+    if not ready:
+        raise HTTPException(status_code=503, detail="Warming up")
+    return {"ready": True}
 
 
 @app.get("/search/")
@@ -31,14 +93,35 @@ async def search(
     fields: Optional[List[str]] = Query(None),
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(10, ge=1, le=50, description="Items per page"),
+    facets: bool = Query(False, description="Include category counts of all hits"),
+    view: Literal["full", "summary"] = Query(
+        "full", description="Full recipes or summaries for result lists"
+    ),
 ):
-    results = indexer.search(q, fields=fields, page=page, per_page=per_page)
+    results = await run_search(
+        indexer.search,
+        q,
+        fields=fields,
+        page=page,
+        per_page=per_page,
+        facets=facets,
+        view=view,
+    )
     return results
 
 
+@app.get("/suggest/")
+async def suggest(
+    q: str = Query(..., description="What was typed so far"),
+    limit: int = Query(8, ge=1, le=10, description="Most suggestions to return"),
+):
+    suggestions = await run_search(indexer.suggest, q, limit=limit)
+    return {"query": q, "suggestions": suggestions}
+
+
 @app.get("/categories/")
 async def get_categories():
-    return {"categories": indexer.get_categories_summary()}
+    return {"categories": await run_search(indexer.get_categories_summary)}
 
 
 @app.get("/recipes/by_category/{category}")
@@ -46,14 +129,66 @@ async def get_recipes_by_category(
     category: str,
     page: int = Query(1, ge=1, description="Page number"),
     per_page: int = Query(10, ge=1, le=50, description="Items per page"),
+    view: Literal["full", "summary"] = Query(
+        "full", description="Full recipes or summaries for result lists"
+    ),
+):
+    results = await run_search(
+        indexer.search_by_category, category, page=page, per_page=per_page, view=view
+    )
+    return results
+
+
+@app.get("/recipes/by_ingredients/")
+async def get_recipes_by_ingredients(
+    q: str = Query(..., description="Ingredients at hand, e.g. 鸡蛋 番茄 葱"),
+    page: int = Query(1, ge=1, description="Page number"),
+    per_page: int = Query(10, ge=1, le=50, description="Items per page"),
+    max_missing: Optional[int] = Query(
+        None, ge=0, description="Most main ingredients a recipe may lack"
+    ),
+    view: Literal["full", "summary"] = Query(
+        "full", description="Full recipes or summaries for result lists"
+    ),
 ):
-    results = indexer.search_by_category(category, page=page, per_page=per_page)
+    results = await run_search(
+        indexer.by_ingredients,
+        q,
+        page=page,
+        per_page=per_page,
+        max_missing=max_missing,
+        view=view,
+    )
     return results
 
 
 @app.get("/recipe/{recipe_id}")
 async def get_recipe(recipe_id: str):
-    results = indexer.search(f"recipe_id:{recipe_id}", per_page=1)
-    if not results:
+    recipe = await run_search(indexer.get_by_id, recipe_id)
+    if recipe is None:
         raise HTTPException(status_code=404, detail="Recipe not found")
-    return {"recipe": results["items"][0]}
+    return {"recipe": recipe}
+
+
+@app.get("/recipe/{recipe_id}/similar")
+async def get_similar_recipes(
+    recipe_id: str,
+    limit: int = Query(10, ge=1, le=50, description="Most recipes to return"),
+):
+    items = await run_search(indexer.similar, recipe_id, limit=limit)
+    if items is None:
+        raise HTTPException(status_code=404, detail="Recipe not found")
+    return {"recipe_id": recipe_id, "items": items}
+
+
+@app.get("/stats/cache")
+async def get_cache_stats():
+    return {
+        "search": indexer.query_cache.stats(),
+        "recipe": indexer.recipe_cache.stats(),
+    }
+
+
+@app.get("/stats/executor")
+async def get_executor_stats():
+    return executor.stats()
@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class LRUCache:
+    """
+    A small thread-safe least-recently-used cache
+
+    Entries are evicted when there are more than maxsize of them, when their
+    total size (as measured by sizeof) exceeds max_bytes, or once they are
+    older than ttl seconds.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        max_bytes: Optional[int] = None,
+        sizeof: Optional[Callable[[Any], int]] = None,
+    ):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        # key -> (value, size, expiry time)
+        self._data = OrderedDict()
+        self._lock = Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self._remove(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any):
+        if self.maxsize <= 0:
+            return
+        size = self.sizeof(value) if self.sizeof else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (value, size, expires)
+            self._bytes += size
+            while len(self._data) > self.maxsize or (
+                self.max_bytes is not None and self._bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Hashable):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._data)
+
+
+class GenerationValue:
+    """
+    A value derived from one generation of the index, e.g. an in-memory
+    lookup structure built from a sidecar file
+
+    The first get() builds it on the calling thread, which warm_up does
+    before serving. Once the index has a newer generation, it is rebuilt on
+    a background thread while get() keeps returning the previous one, so
+    that no request waits for a rebuild.
+    """
+
+    def __init__(self, build: Callable[[], Any], name: str):
+        self.build = build
+        self.name = name
+        # (value, generation), replaced as a whole
+        self._state = None
+        self._lock = Lock()
+        self._executor = None
+        self._pending = None
+
+    def get(self, generation: int) -> Tuple[Any, int]:
+        """Return the value and the generation it was built for"""
+        state = self._state
+        if state is None:
+            with self._lock:
+                if self._state is None:
+                    self._state = (self.build(), generation)
+                state = self._state
+        elif state[1] != generation:
+            self.refresh(generation)
+        return state
+
+    def refresh(self, generation: int):
+        """Rebuild the value in the background, if it was built before"""
+        with self._lock:
+            if self._state is None or self._pending is not None:
+                return
+            if self._executor is None:
+                # Created on first use, so that forked workers get their own
+                self._executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=self.name
+                )
+            self._pending = self._executor.submit(self._rebuild, generation)
+
+    def _rebuild(self, generation: int):
+        try:
+            self._state = (self.build(), generation)
+        except Exception:
+            logger.exception(f"Rebuilding {self.name} failed")
+        finally:
+            with self._lock:
+                self._pending = None
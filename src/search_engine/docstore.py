@@ -0,0 +1,236 @@
+"""
+Compact encoding of the complete recipes stored in the index
+
+A recipe is stored as compact JSON, compressed with a dictionary trained on
+a sample of the recipes. Most of a recipe's bytes are keys, units and
+phrases shared by every recipe, which a compressor that only sees one small
+document at a time cannot exploit otherwise. zstd is used when the
+zstandard package is installed, zlib with a preset dictionary otherwise.
+
+A payload starts with a one byte codec tag and the 4 byte id of its
+dictionary (0 for none). Dictionaries are written once to the index
+directory as docstore/<id>.dict and never deleted: documents encoded with
+an older one stay in the segments an upsert does not rewrite, and readers
+of previous generations still decode with it. They are a few dozen KB each.
+"""
+
+from collections import Counter
+from itertools import islice
+from typing import Dict, Iterable, List
+import json
+import os
+import random
+import struct
+import threading
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+DOCSTORE_DIR = "docstore"
+CURRENT_FILE = "current.json"
+
+# Recipes sampled to train a dictionary, and the fewest worth training on
+SAMPLE_SIZE = 2000
+MIN_SAMPLES = 100
+
+# zlib only looks back 32 KB, zstd makes use of larger dictionaries
+DICT_SIZES = {"zlib": 32 * 1024, "zstd": 64 * 1024}
+
+_HEADER = struct.Struct(">cI")
+_TAGS = {"zstd": b"s", "zlib": b"z"}
+_CODECS = {tag: codec for codec, tag in _TAGS.items()}
+
+
+def default_codec() -> str:
+    return "zstd" if zstandard is not None else "zlib"
+
+
+def dumps(recipe: Dict) -> bytes:
+    return json.dumps(recipe, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def _fragments(value, key=None):
+    """The pieces of compact JSON that recur between recipes"""
+    if key is not None:
+        prefix = json.dumps(key, ensure_ascii=False) + ":"
+        yield prefix
+        if isinstance(value, str) and len(value) <= 40:
+            yield prefix + json.dumps(value, ensure_ascii=False)
+    if isinstance(value, dict):
+        for child_key, child in value.items():
+            yield from _fragments(child, child_key)
+    elif isinstance(value, list):
+        for child in value:
+            yield from _fragments(child)
+    elif isinstance(value, str) and len(value) <= 40:
+        yield json.dumps(value, ensure_ascii=False)
+
+
+def fragment_dictionary(recipes: List[Dict], size: int) -> bytes:
+    """
+    Build a preset dictionary from the JSON fragments found in most recipes,
+    the most common ones last, where the compressor reaches them cheapest
+    """
+    frequency = Counter()
+    for recipe in recipes:
+        frequency.update(set(_fragments(recipe)))
+    chosen = []
+    total = 0
+    # Favour the fragments that save the most bytes over the whole sample
+    for fragment, count in sorted(
+        frequency.items(), key=lambda item: -item[1] * len(item[0].encode("utf-8"))
+    ):
+        if count < 2:
+            break
+        data = fragment.encode("utf-8")
+        if total + len(data) > size:
+            continue
+        chosen.append((count, data))
+        total += len(data)
+    chosen.sort(key=lambda item: item[0])
+    return b"".join(data for _, data in chosen)
+
+
+def sample_dictionary(recipes: List[Dict], size: int) -> bytes:
+    """
+    Build a preset dictionary for zlib: whole sample recipes, for the longer
+    phrases they share, followed by the most common fragments
+    """
+    fragments = fragment_dictionary(recipes, size // 4)
+    # A fixed seed keeps the dictionary, and its id, the same for a sample
+    sample = random.Random(0).sample(recipes, min(len(recipes), 64))
+    documents = b"".join(dumps(recipe) for recipe in sample)
+    return documents[-(size - len(fragments)) :] + fragments
+
+
+class DocStore:
+    """Encode recipes to compressed payloads and decode them back"""
+
+    def __init__(self, index_dir: str):
+        self.directory = os.path.join(index_dir, DOCSTORE_DIR)
+        self.codec = default_codec()
+        self.dict_id = 0
+        self._dictionaries = {}
+        self._local = threading.local()
+        self._load_current()
+
+    def _load_current(self):
+        path = os.path.join(self.directory, CURRENT_FILE)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                current = json.load(f)
+            # A zstd dictionary is of no use once zstandard is gone, the next
+            # indexing trains a zlib one
+            if current["codec"] == "zstd" and zstandard is None:
+                return
+            self.codec, self.dict_id = current["codec"], current["dict_id"]
+
+    @property
+    def trained(self) -> bool:
+        return self.dict_id != 0
+
+    def train(self, recipes: List[Dict]) -> int:
+        """Train a dictionary on sample recipes and use it from now on"""
+        codec = default_codec()
+        dictionary = None
+        if codec == "zstd":
+            try:
+                dictionary = zstandard.train_dictionary(
+                    DICT_SIZES[codec], [dumps(recipe) for recipe in recipes]
+                ).as_bytes()
+            except zstandard.ZstdError:
+                # Too few or too uniform samples, build one like for zlib
+                pass
+        if dictionary is None:
+            dictionary = sample_dictionary(recipes, DICT_SIZES[codec])
+        dict_id = zlib.crc32(codec.encode() + dictionary) or 1
+
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{dict_id:08x}.dict")
+        if not os.path.exists(path):
+            with open(f"{path}.tmp", "wb") as f:
+                f.write(dictionary)
+            os.replace(f"{path}.tmp", path)
+        current = os.path.join(self.directory, CURRENT_FILE)
+        with open(f"{current}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"codec": codec, "dict_id": dict_id}, f)
+        os.replace(f"{current}.tmp", current)
+        self.codec, self.dict_id = codec, dict_id
+        return dict_id
+
+    def prepare(self, recipes: Iterable[Dict], retrain: bool = False):
+        """
+        Train a dictionary on the first recipes of a stream if retrain is set
+        or none was trained yet, and return the whole stream. The caller must
+        hold the index's writer lock, so that writers never train over each
+        other.
+        """
+        recipes = iter(recipes)
+        # Another process may have trained one since this store was opened
+        self._load_current()
+        if self.trained and not retrain:
+            return recipes
+        sample = list(islice(recipes, SAMPLE_SIZE))
+        if len(sample) >= MIN_SAMPLES:
+            self.train(sample)
+        return _chain(sample, recipes)
+
+    def _dictionary(self, dict_id: int) -> bytes:
+        dictionary = self._dictionaries.get(dict_id)
+        if dictionary is None:
+            path = os.path.join(self.directory, f"{dict_id:08x}.dict")
+            with open(path, "rb") as f:
+                dictionary = self._dictionaries[dict_id] = f.read()
+        return dictionary
+
+    def encode(self, recipe: Dict) -> bytes:
+        data = dumps(recipe)
+        if self.codec == "zstd":
+            body = self._zstd(self.dict_id, "compressors").compress(data)
+        else:
+            # Raw deflate: the header already says how to decode, and raw
+            # streams take the dictionary without a checksum of it
+            compressor = zlib.compressobj(
+                9, zlib.DEFLATED, -zlib.MAX_WBITS, **self._zdict(self.dict_id)
+            )
+            body = compressor.compress(data) + compressor.flush()
+        return _HEADER.pack(_TAGS[self.codec], self.dict_id) + body
+
+    def decode(self, payload: bytes) -> Dict:
+        tag, dict_id = _HEADER.unpack_from(payload)
+        body = payload[_HEADER.size :]
+        if _CODECS[tag] == "zstd":
+            data = self._zstd(dict_id, "decompressors").decompress(body)
+        else:
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS, **self._zdict(dict_id))
+            data = decompressor.decompress(body) + decompressor.flush()
+        return json.loads(data.decode("utf-8"))
+
+    def _zdict(self, dict_id: int) -> Dict:
+        return {"zdict": self._dictionary(dict_id)} if dict_id else {}
+
+    def _zstd(self, dict_id: int, kind: str):
+        # zstd contexts are not thread-safe, every search thread gets its own
+        contexts = getattr(self._local, kind, None)
+        if contexts is None:
+            contexts = {}
+            setattr(self._local, kind, contexts)
+        context = contexts.get(dict_id)
+        if context is None:
+            dict_data = None
+            if dict_id:
+                dict_data = zstandard.ZstdCompressionDict(self._dictionary(dict_id))
+            if kind == "compressors":
+                context = zstandard.ZstdCompressor(level=10, dict_data=dict_data)
+            else:
+                context = zstandard.ZstdDecompressor(dict_data=dict_data)
+            contexts[dict_id] = context
+        return context
+
+
+def _chain(sample: List[Dict], rest: Iterable[Dict]):
+    yield from sample
+    yield from rest
@@ -0,0 +1,82 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict
+import asyncio
+import threading
+
+
+class SearchOverloaded(Exception):
+    """Raised when all workers are busy and the wait queue is full"""
+
+
+class SearchExecutor:
+    """
+    Run blocking search calls on a bounded thread pool, so that Whoosh and
+    jieba work never blocks the event loop.
+
+    At most max_workers calls run at once and up to max_queue more may wait
+    for a worker; beyond that calls are rejected right away. Callers stop
+    waiting after timeout seconds. A call that timed out keeps its slot until
+    its thread actually finishes, so slow queries cannot pile up unbounded.
+    """
+
+    def __init__(self, max_workers: int = 4, max_queue: int = 16, timeout=5.0):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="search"
+        )
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    async def run(self, func: Callable, *args, **kwargs):
+        if not self._slots.acquire(blocking=False):
+            self.rejected += 1
+            raise SearchOverloaded()
+        with self._lock:
+            self._in_flight += 1
+        future = self._pool.submit(func, *args, **kwargs)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    def run_on_all_workers(self, func: Callable):
+        """
+        Call func once on every worker thread, e.g. to open their per-thread
+        searchers. Blocks until all calls are done.
+        """
+        # Each call waits for the others, which forces them onto distinct threads
+        barrier = threading.Barrier(self.max_workers)
+
+        def call():
+            try:
+                func()
+            finally:
+                barrier.wait()
+
+        futures = [self._pool.submit(call) for _ in range(self.max_workers)]
+        for future in futures:
+            future.result()
+
+    def _release(self, future):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def stats(self) -> Dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
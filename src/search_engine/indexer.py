@@ -1,91 +1,710 @@
-from whoosh.index import create_in, open_dir
+from whoosh.index import create_in, open_dir, exists_in
 from whoosh.fields import *
 from whoosh.qparser import QueryParser, MultifieldParser
 from whoosh.analysis import StandardAnalyzer
+from whoosh.sorting import Count, FieldFacet
+from whoosh.codec.base import Segment
+from whoosh.writing import CLEAR, MERGE_SMALL, NO_MERGE, OPTIMIZE, SegmentWriter
 from jieba.analyse import ChineseAnalyzer
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+import hashlib
+import jieba
 import json
 import os
-from typing import List, Dict
+from typing import Callable, Iterable, List, Dict, Optional, Set, Tuple
+from .cache import GenerationValue, LRUCache
+from .docstore import DocStore
+from .pantry import (
+    MAIN_SECTION,
+    PantryIndex,
+    ingredient_sets,
+    normalize_ingredient,
+    parse_pantry,
+)
+from .recipe_stream import iter_batches, iter_recipes
+from .sidecar import IndexSidecar
+from .similar import DEFAULT_NEIGHBOURS, SimilarRecipes, build_neighbours
+from .suggest import SuggestIndex
+import threading
+import time
+
+# Bump whenever the schema or the way documents are built changes, so that
+# indexes built by an older version are rebuilt instead of reused
+INDEX_FORMAT_VERSION = 6
+
+# Sidecar file describing the source data the index was built from
+FINGERPRINT_FILE = "fingerprint.json"
+# Sidecar file with the INDEX_FORMAT_VERSION of the last commit
+FORMAT_FILE = "format.json"
+
+# How segments are merged when committing incremental changes:
+# - 'none': never merge, the cheapest commit, segments pile up
+# - 'small': merge small segments only, cost stays close to the change size
+# - 'optimize': merge everything into one segment, the slowest commit
+MERGE_POLICIES = {"none": NO_MERGE, "small": MERGE_SMALL, "optimize": OPTIMIZE}
+
+# Fields searched when the caller does not pick any
+SEARCH_FIELDS = [
+    "title",
+    "ingredients_text",
+    "steps_text",
+    "tips_text",
+    "categories_text",
+]
+
+# Number of main ingredient names kept in the summary of a recipe
+SUMMARY_INGREDIENTS = 5
+
+
+def _index_batch(index_dir: str, documents: List[Dict], limitmb: int) -> Segment:
+    """
+    Index one batch of documents into a new segment of the index, without
+    committing it (runs in a worker process of a parallel build)
+    """
+    # Like the sub-writers of Whoosh's MpWriter, this relies on the parent
+    # process holding the index lock and committing the segments. These are
+    # Whoosh 2.7 internals, which is why requirements.txt pins it
+    writer = SegmentWriter(open_dir(index_dir), _lk=False, limitmb=limitmb)
+    for document in documents:
+        writer.add_document(**document)
+    # The temporary storage is shared with the other workers, the parent
+    # writer removes it when it finishes
+    return writer._finalize_segment()
+
+
+def _field_signature(field) -> Tuple:
+    """What decides how a field indexes, stores and sorts its values"""
+    column = field.column_type
+    return (
+        type(field).__name__,
+        type(field.format).__name__,
+        field.stored,
+        field.unique,
+        field.scorable,
+        type(column).__name__ if column is not None else None,
+    )
+
+
+def same_schema(a: Schema, b: Schema) -> bool:
+    """
+    Compare schemas by their fields' names and types. Schema.__eq__ also
+    compares column objects, which have no equality of their own, so a
+    schema with a sortable field never equals the one read back from disk.
+    """
+    return a.names() == b.names() and all(
+        _field_signature(a[name]) == _field_signature(b[name]) for name in a.names()
+    )
+
+
+def _json_size(value) -> int:
+    """Approximate memory cost of a cached result by its JSON length"""
+    return len(json.dumps(value, ensure_ascii=False))
+
+
+def compute_fingerprint(path: str) -> Dict:
+    """Fingerprint a source data file by size, mtime and content hash"""
+    stat = os.stat(path)
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return {
+        "format_version": INDEX_FORMAT_VERSION,
+        "source": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime,
+        "sha256": digest.hexdigest(),
+    }
 
 
 class RecipeIndexer:
-    def __init__(self, index_dir: str = "recipe_index"):
+    def __init__(
+        self,
+        index_dir: str = "recipe_index",
+        readonly: bool = False,
+        recipe_cache_size: int = 1024,
+        query_cache_size: int = 1024,
+        query_cache_ttl: Optional[float] = 300,
+        query_cache_max_bytes: Optional[int] = 64 * 1024 * 1024,
+        refresh_interval: float = 1.0,
+    ):
         self.index_dir = index_dir
+        self.readonly = readonly
+        # Searchers are long-lived and kept per thread, because refreshing a
+        # Whoosh searcher closes resources another thread may still be using
+        self._local = threading.local()
+        self._searchers_lock = threading.Lock()
+        self._searchers = set()
+        # How often (in seconds) to look for a new index generation on disk
+        self.refresh_interval = refresh_interval
+        self._generation = None
+        self._generation_checked = 0.0
+        # Recently fetched recipes for the detail page, keyed by index
+        # generation and recipe_id
+        self.recipe_cache = LRUCache(recipe_cache_size)
+        # Search results keyed by the normalized query, its options and the
+        # index generation, so a new commit never serves stale pages
+        self.query_cache = LRUCache(
+            query_cache_size,
+            ttl=query_cache_ttl,
+            max_bytes=query_cache_max_bytes,
+            sizeof=_json_size,
+        )
+        # Category counts of the index generation they were computed for
+        self._category_counts = None
+        self._category_generation = None
+        # Suggestion and ingredient indexes, rebuilt in the background for
+        # new index generations
+        self._suggest_index = GenerationValue(self._build_suggest_index, "suggest")
+        self._pantry_index = GenerationValue(self._build_pantry_index, "pantry")
         self.chinese_analyzer = ChineseAnalyzer()
 
         # Define the schema for our search index
         self.schema = Schema(
-            recipe_id=ID(stored=True),
+            recipe_id=ID(stored=True, unique=True),
+            # Hash of the recipe JSON, to skip unchanged recipes on upsert
+            content_hash=ID(stored=True, sortable=True),
             title=TEXT(analyzer=self.chinese_analyzer, stored=True),
-            ingredients_text=TEXT(analyzer=self.chinese_analyzer, stored=True),
-            steps_text=TEXT(analyzer=self.chinese_analyzer, stored=True),
-            tips_text=TEXT(analyzer=self.chinese_analyzer, stored=True),
-            categories_text=TEXT(analyzer=self.chinese_analyzer, stored=True),
-            raw_data=STORED,  # Store the complete JSON for retrieval
+            # Only searched, their text is in raw_data
+            ingredients_text=TEXT(analyzer=self.chinese_analyzer),
+            steps_text=TEXT(analyzer=self.chinese_analyzer),
+            tips_text=TEXT(analyzer=self.chinese_analyzer),
+            categories_text=TEXT(analyzer=self.chinese_analyzer),
+            # Exact category values, used for facet counts
+            categories=KEYWORD(stored=True, commas=True, lowercase=False, vector=True),
+            # Small stored columns used to render result lists
+            image_url=STORED,
+            top_ingredients=STORED,
+            # The complete recipe compressed by the DocStore, only decoded
+            # when the full document is requested
+            raw_data=STORED,
         )
 
-        # Create or open the index
-        if not os.path.exists(index_dir):
-            os.makedirs(index_dir)
-            self.ix = create_in(index_dir, self.schema)
-        else:
+        # Create or open the index. Read-only indexers never create or modify
+        # the index, it has to be built beforehand (see src/build_index.py)
+        if exists_in(index_dir):
             self.ix = open_dir(index_dir)
+        elif readonly:
+            raise FileNotFoundError(f"No index found in {index_dir}")
+        else:
+            os.makedirs(index_dir, exist_ok=True)
+            self.ix = create_in(index_dir, self.schema)
+        self.docstore = DocStore(index_dir)
+        # Category counts, suggestion terms and ingredients of the recipes
+        self.sidecar = IndexSidecar(index_dir)
+        # Neighbours precomputed offline by build_similar()
+        self.similar_recipes = SimilarRecipes(index_dir)
 
-    def index_recipes(self, recipes: List[Dict], mode: str = "rewrite_all"):
+    def index_recipes(
+        self,
+        recipes: Iterable[Dict],
+        mode: str = "rewrite_all",
+        merge_policy: str = "small",
+    ) -> Dict:
         """
         Index recipes with specified mode:
         - 'skip_existing': Skip recipes that already exist in the index
         - 'rewrite_all': Clear existing index and write all recipes
+        - 'upsert': Add new recipes and replace the ones whose content changed,
+          unchanged recipes are skipped without being analyzed again
+        A recipe_id is only indexed once, later duplicates are skipped.
+        merge_policy decides how segments are merged on commit, see
+        MERGE_POLICIES. A batch that adds or updates nothing is not
+        committed. Returns the number of added, updated and skipped recipes.
         """
+        if self.readonly:
+            raise PermissionError(f"Index in {self.index_dir} is opened read-only")
+        if mode not in ("rewrite_all", "skip_existing", "upsert"):
+            raise ValueError(f"Unknown index mode: {mode}")
+
         if mode == "rewrite_all":
-            # Delete existing index and create new one
-            self.ix.close()
-            import shutil
+            self._ensure_schema()
 
-            shutil.rmtree(self.index_dir)
-            os.makedirs(self.index_dir)
-            self.ix = create_in(self.index_dir, self.schema)
+        writer = self.ix.writer()
+        sidecar = None
+        stats = {"added": 0, "updated": 0, "skipped": 0}
+        seen_ids = set()
+        # Existing documents are looked up by their recipe_id term
+        searcher = None
+        content_hashes = None
+        # Changes of the category counts, suggestion terms and ingredients,
+        # written to the sidecar along with the documents
+        category_counts = Counter()
+        term_counts = Counter()
+        pantry_rows = {}
+        try:
+            # Under the writer lock, see DocStore.prepare
+            recipes = self.docstore.prepare(recipes, retrain=mode == "rewrite_all")
+            sidecar = self.sidecar.begin()
+            if mode == "rewrite_all":
+                sidecar.clear()
+            else:
+                searcher = writer.searcher()
+                self._sync_sidecar(sidecar, searcher)
+            for recipe in recipes:
+                recipe_id = str(recipe.get("recipe_id", ""))
+                if recipe_id in seen_ids:
+                    stats["skipped"] += 1
+                    continue
+                seen_ids.add(recipe_id)
+
+                docnum = None
+                if searcher is not None:
+                    docnum = searcher.document_number(recipe_id=recipe_id)
+                # Skip if recipe already exists and in skip mode
+                if docnum is not None and mode == "skip_existing":
+                    stats["skipped"] += 1
+                    continue
+
+                # Unchanged recipes are skipped before their document, and
+                # its compressed copy, are built
+                content_hash = self._content_hash(recipe)
+                if docnum is not None:
+                    if content_hashes is None:
+                        content_hashes = searcher.reader().column_reader("content_hash")
+                    if content_hashes[docnum] == content_hash:
+                        stats["skipped"] += 1
+                        continue
+                document = self._document(recipe, content_hash)
+                if docnum is None:
+                    writer.add_document(**document)
+                    stats["added"] += 1
+                else:
+                    old_document = searcher.stored_fields(docnum)
+                    category_counts.subtract(self._document_categories(old_document))
+                    term_counts.subtract(self._document_terms(old_document))
+                    writer.update_document(**document)
+                    stats["updated"] += 1
+                category_counts.update(self._document_categories(document))
+                term_counts.update(self._suggest_terms(recipe))
+                pantry_rows[recipe_id] = ingredient_sets(recipe.get("ingredients", {}))
+
+            sidecar.count_categories(category_counts)
+            sidecar.count_terms(term_counts)
+            sidecar.set_pantry(pantry_rows)
+        except BaseException:
+            writer.cancel()
+            if sidecar is not None:
+                sidecar.rollback()
+            raise
+        finally:
+            if searcher is not None:
+                searcher.close()
+
+        if mode != "rewrite_all" and not stats["added"] and not stats["updated"]:
+            # Nothing changed: no new generation, readers keep their caches
+            writer.cancel()
+            sidecar.rollback()
+            return stats
+        if mode == "rewrite_all":
+            # Clearing the old segments in the same commit (instead of deleting
+            # the directory) creates a new generation, so readers that still
+            # have the previous one open keep working until they refresh
+            self._commit(writer, sidecar, CLEAR)
+        else:
+            self._commit(writer, sidecar, MERGE_POLICIES[merge_policy])
+            # The index no longer matches a single source file
+            self._remove_fingerprint()
+        return stats
+
+    def delete_recipes(
+        self, recipe_ids: Iterable[str], merge_policy: str = "small"
+    ) -> int:
+        """
+        Delete recipes by id, without committing if none of them exists.
+        Returns the number of deleted recipes.
+        """
+        if self.readonly:
+            raise PermissionError(f"Index in {self.index_dir} is opened read-only")
 
         writer = self.ix.writer()
+        sidecar = None
+        category_counts = Counter()
+        term_counts = Counter()
+        deleted = []
+        searcher = writer.searcher()
+        try:
+            sidecar = self.sidecar.begin()
+            self._sync_sidecar(sidecar, searcher)
+            for recipe_id in set(map(str, recipe_ids)):
+                docnum = searcher.document_number(recipe_id=recipe_id)
+                if docnum is None:
+                    continue
+                old_document = searcher.stored_fields(docnum)
+                category_counts.subtract(self._document_categories(old_document))
+                term_counts.subtract(self._document_terms(old_document))
+                writer.delete_by_term("recipe_id", recipe_id)
+                deleted.append(recipe_id)
 
-        # Get existing recipe IDs if in skip mode
-        existing_ids = set()
-        if mode == "skip_existing":
-            with self.ix.searcher() as searcher:
-                existing_ids = {
-                    doc["recipe_id"] for doc in searcher.all_stored_fields()
-                }
-
-        for recipe in recipes:
-            recipe_id = str(recipe.get("recipe_id", ""))
-            # Skip if recipe already exists and in skip mode
-            if mode == "skip_existing" and recipe_id in existing_ids:
-                continue
+            sidecar.count_categories(category_counts)
+            sidecar.count_terms(term_counts)
+            sidecar.delete_pantry(deleted)
+        except BaseException:
+            writer.cancel()
+            if sidecar is not None:
+                sidecar.rollback()
+            raise
+        finally:
+            searcher.close()
 
-            # Prepare searchable text fields
-            ingredients_text = self._process_ingredients(recipe.get("ingredients", {}))
+        if not deleted:
+            writer.cancel()
+            sidecar.rollback()
+            return 0
 
-            # Extract step text from step dictionaries
-            steps = recipe.get("steps", [])
-            if steps and isinstance(steps[0], dict):
-                steps_text = " ".join(step.get("text", "") for step in steps)
-            else:
-                steps_text = " ".join(str(step) for step in steps)
-
-            tips_text = " ".join(recipe.get("tips", []))
-            categories_text = " ".join(recipe.get("categories", []))
-
-            writer.add_document(
-                recipe_id=str(recipe.get("recipe_id", "")),
-                title=recipe.get("title", ""),
-                ingredients_text=ingredients_text,
-                steps_text=steps_text,
-                tips_text=tips_text,
-                categories_text=categories_text,
-                raw_data=recipe,
-            )
+        self._commit(writer, sidecar, MERGE_POLICIES[merge_policy])
+        self._remove_fingerprint()
+        return len(deleted)
+
+    def build_parallel(
+        self,
+        recipes: Iterable[Dict],
+        procs: Optional[int] = None,
+        limitmb: int = 128,
+        batch_size: int = 5000,
+        progress: Optional[Callable[[int, float], None]] = None,
+    ) -> int:
+        """
+        Rebuild the whole index, tokenizing with several processes.
 
-        writer.commit()
+        Recipes are cut into contiguous batches of batch_size, and each worker
+        process indexes a batch into a new segment using at most limitmb of
+        memory. The segments are committed in input order, so documents get
+        the same numbers and the index the same statistics as in a serial
+        build, and searches return identical results, ties included. Whoosh's
+        own writer(procs=N, multisegment=True) deals documents out to its
+        workers in small batches instead, so it numbers them differently.
+
+        progress is called after every finished batch with the number of
+        indexed recipes and the throughput in recipes per second.
+        Returns the number of indexed recipes.
+        """
+        if self.readonly:
+            raise PermissionError(f"Index in {self.index_dir} is opened read-only")
+
+        self._ensure_schema()
+        procs = procs or os.cpu_count()
+        # Load the dictionary once so forked workers inherit it
+        jieba.initialize()
+
+        writer = self.ix.writer()
+        sidecar = None
+        category_counts = Counter()
+        term_counts = Counter()
+        pantry_rows = {}
+        segments = []
+        seen_ids = set()
+        pending = deque()
+        indexed = 0
+        start = time.time()
+
+        def collect_oldest():
+            nonlocal indexed
+            future, count = pending.popleft()
+            segments.append(future.result())
+            indexed += count
+            if progress:
+                progress(indexed, indexed / max(time.time() - start, 1e-9))
+
+        try:
+            # Under the writer lock, see DocStore.prepare
+            recipes = self.docstore.prepare(recipes, retrain=True)
+            sidecar = self.sidecar.begin()
+            with ProcessPoolExecutor(max_workers=procs) as pool:
+                for batch in iter_batches(recipes, batch_size):
+                    documents = []
+                    for recipe in batch:
+                        # Like in a serial build, only the first recipe with
+                        # a given id is indexed
+                        recipe_id = str(recipe.get("recipe_id", ""))
+                        if recipe_id not in seen_ids:
+                            seen_ids.add(recipe_id)
+                            documents.append(self._document(recipe))
+                            term_counts.update(self._suggest_terms(recipe))
+                            pantry_rows[recipe_id] = ingredient_sets(
+                                recipe.get("ingredients", {})
+                            )
+                    if not documents:
+                        continue
+                    for document in documents:
+                        category_counts.update(self._document_categories(document))
+                    future = pool.submit(
+                        _index_batch, self.index_dir, documents, limitmb
+                    )
+                    pending.append((future, len(documents)))
+                    # Bound the number of batches held in memory
+                    while len(pending) > procs * 2:
+                        collect_oldest()
+                while pending:
+                    collect_oldest()
+            sidecar.clear()
+            sidecar.count_categories(category_counts)
+            sidecar.count_terms(term_counts)
+            sidecar.set_pantry(pantry_rows)
+        except BaseException:
+            writer.cancel()
+            if sidecar is not None:
+                sidecar.rollback()
+            raise
+
+        # Replace all existing segments with the new ones, in input order.
+        # This is SegmentWriter.commit with the worker segments instead of
+        # merged ones, but it releases the lock even if the TOC is not written
+        try:
+            writer._close_segment()
+            writer._commit_toc(segments)
+        except BaseException:
+            sidecar.rollback()
+            raise
+        finally:
+            writer._finish()
+        sidecar.commit(writer.generation)
+        self._committed(writer.generation)
+        return indexed
+
+    def _ensure_schema(self):
+        if not same_schema(self.ix.schema, self.schema):
+            # The schema changed, start over with a fresh index
+            self.ix.close()
+            self.ix = create_in(self.index_dir, self.schema)
+
+    def _sync_sidecar(self, sidecar, searcher):
+        """
+        Rebuild the sidecar from the index if it does not describe the latest
+        generation, e.g. after an interrupted commit. It is read for that
+        generation and from the writer's searcher, never from the cached
+        generation of this indexer, which may lag behind other writers.
+        """
+        if sidecar.generation == self.ix.latest_generation():
+            return
+        sidecar.clear()
+        sidecar.count_categories(self._count_categories(searcher))
+        sidecar.count_terms(self._count_terms(searcher))
+        sidecar.set_pantry(self._collect_pantry_rows(searcher))
+
+    def _commit(self, writer, sidecar, mergetype):
+        """Commit the index, then the sidecar changes made along with it"""
+        try:
+            writer.commit(mergetype=mergetype)
+        except BaseException:
+            sidecar.rollback()
+            raise
+        sidecar.commit(writer.generation)
+        self._committed(writer.generation)
+
+    def _committed(self, generation: int):
+        """Update the cached state after committing generation"""
+        self._generation = generation
+        self._generation_checked = time.monotonic()
+        self.recipe_cache.clear()
+        self.query_cache.clear()
+        self._category_generation = None
+        self._write_json(FORMAT_FILE, {"format_version": INDEX_FORMAT_VERSION})
+        # Rebuilt from the sidecar, if this process serves them
+        self._suggest_index.refresh(generation)
+        self._pantry_index.refresh(generation)
+
+    def _content_hash(self, recipe: Dict) -> str:
+        return hashlib.sha1(
+            json.dumps(recipe, ensure_ascii=False, sort_keys=True).encode("utf-8")
+        ).hexdigest()
+
+    def _document(self, recipe: Dict, content_hash: Optional[str] = None) -> Dict:
+        """Build the fields of the index document for a recipe"""
+        # Prepare searchable text fields
+        ingredients_text = self._process_ingredients(recipe.get("ingredients", {}))
+
+        # Extract step text from step dictionaries
+        steps = recipe.get("steps", [])
+        if steps and isinstance(steps[0], dict):
+            steps_text = " ".join(step.get("text", "") for step in steps)
+        else:
+            steps_text = " ".join(str(step) for step in steps)
+
+        tips_text = " ".join(recipe.get("tips", []))
+        categories = list(dict.fromkeys(recipe.get("categories", [])))
+        categories_text = " ".join(categories)
+
+        if content_hash is None:
+            content_hash = self._content_hash(recipe)
+
+        return dict(
+            recipe_id=str(recipe.get("recipe_id", "")),
+            content_hash=content_hash,
+            title=recipe.get("title", ""),
+            ingredients_text=ingredients_text,
+            steps_text=steps_text,
+            tips_text=tips_text,
+            categories_text=categories_text,
+            categories=",".join(categories),
+            image_url=recipe.get("image_url", ""),
+            top_ingredients=self._top_ingredients(recipe.get("ingredients", {})),
+            raw_data=self.docstore.encode(recipe),
+        )
+
+    def _suggest_terms(self, recipe: Dict) -> Set[Tuple[str, str]]:
+        """The (kind, text) suggestion terms of a recipe"""
+        terms = {("title", recipe.get("title", "").strip())}
+        for items in recipe.get("ingredients", {}).values():
+            terms.update(("ingredient", item["name"].strip()) for item in items)
+        terms.update(
+            ("category", category) for category in recipe.get("categories", [])
+        )
+        return {(kind, text) for kind, text in terms if text}
+
+    def _document_terms(self, document: Dict) -> Set[Tuple[str, str]]:
+        return self._suggest_terms(self._recipe(document["raw_data"]))
+
+    def _document_categories(self, document: Dict) -> List[str]:
+        return [category for category in document["categories"].split(",") if category]
+
+    def generation(self) -> int:
+        """
+        Latest generation of the index. Commits made by other processes are
+        picked up at most refresh_interval seconds later.
+        """
+        now = time.monotonic()
+        if (
+            self._generation is None
+            or now - self._generation_checked >= self.refresh_interval
+        ):
+            self._generation = self.ix.latest_generation()
+            self._generation_checked = now
+        return self._generation
+
+    def searcher(self):
+        """
+        Return the calling thread's searcher, refreshed if the index has a new
+        generation. The searcher is shared by all requests handled on that
+        thread and must not be closed by the caller.
+        """
+        generation = self.generation()
+        searcher = getattr(self._local, "searcher", None)
+
+        if searcher is None or self._local.ix is not self.ix:
+            new_searcher = self.ix.searcher()
+        elif searcher.reader().generation() != generation:
+            # refresh() reuses the segment readers that did not change
+            new_searcher = searcher.refresh()
+        else:
+            return searcher
+
+        with self._searchers_lock:
+            if searcher is not None and searcher is not new_searcher:
+                self._searchers.discard(searcher)
+                if self._local.ix is not self.ix:
+                    searcher.close()
+            self._searchers.add(new_searcher)
+        self._local.searcher = new_searcher
+        self._local.ix = self.ix
+        return new_searcher
+
+    def warm_up(self):
+        """
+        Open the calling thread's searcher and run a query through it, so the
+        term dictionaries, the analyzer, the category counts and the
+        suggestion and ingredient indexes are loaded before the first request
+        arrives.
+        """
+        self.searcher()
+        self.get_categories_summary()
+        self.suggest("菜")
+        self._pantry_index.get(self.generation())
+        self._search("菜谱", SEARCH_FIELDS, 1, 1, False, "summary")
+
+    def close(self):
+        """Close the index and all searchers opened by any thread"""
+        with self._searchers_lock:
+            for searcher in self._searchers:
+                searcher.close()
+            self._searchers.clear()
+        self.ix.close()
+
+    def _read_json(self, name: str) -> Optional[Dict]:
+        path = os.path.join(self.index_dir, name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write_json(self, name: str, data: Dict):
+        """Replace a JSON file of the index directory atomically"""
+        path = os.path.join(self.index_dir, name)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, path)
+
+    def read_fingerprint(self) -> Optional[Dict]:
+        """Return the fingerprint of the data the index was built from"""
+        return self._read_json(FINGERPRINT_FILE)
+
+    def read_format_version(self) -> Optional[int]:
+        """Return the INDEX_FORMAT_VERSION the index was last written with"""
+        stored = self._read_json(FORMAT_FILE)
+        return stored["format_version"] if stored else None
+
+    def _remove_fingerprint(self):
+        path = os.path.join(self.index_dir, FINGERPRINT_FILE)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def is_up_to_date(self, source_path: str) -> bool:
+        """Check whether the index was built from the current source data"""
+        stored = self.read_fingerprint()
+        if not stored or stored.get("format_version") != INDEX_FORMAT_VERSION:
+            return False
+        # Guard against a half-built or externally modified index
+        if self.ix.doc_count() != stored.get("count"):
+            return False
+
+        stat = os.stat(source_path)
+        if (stored.get("size"), stored.get("mtime")) == (stat.st_size, stat.st_mtime):
+            return True
+
+        # The file was touched, only its content decides
+        current = compute_fingerprint(source_path)
+        if current["sha256"] != stored.get("sha256"):
+            return False
+        if not self.readonly:
+            self._write_json(FINGERPRINT_FILE, dict(current, count=stored["count"]))
+        return True
+
+    def build_from_file(self, source_path: str, procs: int = 1, **kwargs) -> int:
+        """
+        Rebuild the index from a JSON or JSON Lines file and record its
+        fingerprint. With procs > 1 the build runs in parallel, see
+        build_parallel for kwargs.
+        """
+        fingerprint = compute_fingerprint(source_path)
+        # Recipes are streamed from the file, it is never loaded as a whole
+        recipes = iter_recipes(source_path)
+        if procs > 1:
+            self.build_parallel(recipes, procs=procs, **kwargs)
+        else:
+            self.index_recipes(recipes, mode="rewrite_all")
+        self._write_json(FINGERPRINT_FILE, dict(fingerprint, count=self.ix.doc_count()))
+        return self.ix.doc_count()
+
+    def load_or_build(self, source_path: str) -> bool:
+        """
+        Reuse the existing index if it matches the source data or is
+        maintained incrementally, otherwise rebuild it. Returns True if the
+        index was rebuilt.
+        """
+        if self.is_up_to_date(source_path):
+            return False
+        if (
+            self.read_fingerprint() is None
+            and not self.ix.is_empty()
+            and self.read_format_version() == INDEX_FORMAT_VERSION
+        ):
+            # The index is maintained incrementally (e.g. by the crawl
+            # pipeline), it was not built from a file and must not be wiped
+            return False
+        self.build_from_file(source_path)
+        return True
 
     def _process_ingredients(self, ingredients: Dict) -> str:
         """Convert ingredients dictionary to searchable text"""
@@ -96,51 +715,314 @@ class RecipeIndexer:
                 text_parts.append(f"{item['name']} {item['amount']}")
         return " ".join(text_parts)
 
-    def search(self, query: str, fields=None, page=1, per_page=10) -> Dict:
+    def _top_ingredients(self, ingredients: Dict) -> List[str]:
+        """
+        Names of the first ingredients, main ingredients (主料) first, each
+        ingredient once and without staples like salt or oil
+        """
+        sections = sorted(ingredients.items(), key=lambda item: item[0] != MAIN_SECTION)
+        names = {}
+        for _, items in sections:
+            for item in items:
+                name = item.get("name", "")
+                key = normalize_ingredient(name)
+                if key and key not in names:
+                    names[key] = name.strip()
+                    if len(names) == SUMMARY_INGREDIENTS:
+                        return list(names.values())
+        return list(names.values())
+
+    def _summary(self, doc: Dict) -> Dict:
+        """Build a recipe summary from the small stored columns only"""
+        return {
+            "recipe_id": doc["recipe_id"],
+            "title": doc["title"],
+            "image_url": doc.get("image_url", ""),
+            "categories": doc["categories"].split(",") if doc["categories"] else [],
+            "top_ingredients": doc.get("top_ingredients", []),
+        }
+
+    def search(
+        self,
+        query: str,
+        fields=None,
+        page=1,
+        per_page=10,
+        facets=False,
+        view="full",
+    ) -> Dict:
         """
         Search with pagination support
+        If facets is True, also count the categories of all matching recipes
+        view is "full" for complete recipes or "summary" for list entries
         Returns: Dict containing results and pagination info
         """
         if fields is None:
-            fields = [
-                "title",
-                "ingredients_text",
-                "steps_text",
-                "tips_text",
-                "categories_text",
-            ]
+            fields = SEARCH_FIELDS
 
-        with self.ix.searcher() as searcher:
-            parser = MultifieldParser(fields, schema=self.ix.schema)
-            q = parser.parse(query)
-
-            # Use search_page instead of search with offset
-            results = searcher.search_page(q, page, pagelen=per_page)
-
-            return {
-                "items": [
-                    dict(score=result.score, **result["raw_data"]) for result in results
-                ],
-                "pagination": {
-                    "total": results.total,  # total available from search_page
-                    "page": results.pagenum,
-                    "per_page": results.pagelen,
-                    "total_pages": results.pagecount,
-                },
+        key = (
+            " ".join(query.split()),
+            tuple(sorted(fields)),
+            page,
+            per_page,
+            facets,
+            view,
+            self.generation(),
+        )
+        response = self.query_cache.get(key)
+        if response is None:
+            response = self._search(query, fields, page, per_page, facets, view)
+            self.query_cache.put(key, response)
+        return response
+
+    def _search(self, query, fields, page, per_page, facets, view) -> Dict:
+        searcher = self.searcher()
+        parser = MultifieldParser(fields, schema=self.ix.schema)
+        q = parser.parse(query)
+
+        groupedby = None
+        if facets:
+            groupedby = {
+                "categories": FieldFacet(
+                    "categories", allow_overlap=True, maptype=Count
+                )
             }
 
-    def search_by_category(self, category: str, page=1, per_page=10) -> Dict:
+        # Use search_page instead of search with offset
+        results = searcher.search_page(q, page, pagelen=per_page, groupedby=groupedby)
+
+        if view == "summary":
+            items = [
+                dict(score=result.score, **self._summary(result.fields()))
+                for result in results
+            ]
+        else:
+            items = [
+                dict(score=result.score, **self._recipe(result["raw_data"]))
+                for result in results
+            ]
+
+        response = {
+            "items": items,
+            "pagination": {
+                "total": results.total,  # total available from search_page
+                "page": results.pagenum,
+                "per_page": results.pagelen,
+                "total_pages": results.pagecount,
+            },
+        }
+        if facets:
+            response["facets"] = {"categories": results.results.groups("categories")}
+        return response
+
+    def get_by_id(self, recipe_id: str) -> Optional[Dict]:
+        """
+        Fetch a single recipe by its id. This is a direct term lookup on the
+        recipe_id field, without query parsing or scoring.
+        """
+        # Keyed by generation like search results, so that readers never
+        # serve recipes another process updated or deleted since
+        key = (self.generation(), recipe_id)
+        recipe = self.recipe_cache.get(key)
+        if recipe is not None:
+            return recipe
+
+        doc = self.searcher().document(recipe_id=recipe_id)
+        if doc is None:
+            return None
+
+        recipe = self._recipe(doc["raw_data"])
+        self.recipe_cache.put(key, recipe)
+        return recipe
+
+    def _recipe(self, raw_data) -> Dict:
+        """Decode the complete recipe stored in a document"""
+        if isinstance(raw_data, str):
+            # Plain JSON, written before the DocStore
+            return json.loads(raw_data)
+        return self.docstore.decode(raw_data)
+
+    def search_by_category(
+        self, category: str, page=1, per_page=10, view="full"
+    ) -> Dict:
         """
         Search by category with pagination support
         """
         query = f"categories_text:{category}"
-        return self.search(query, page=page, per_page=per_page)
+        return self.search(query, page=page, per_page=per_page, view=view)
 
     def get_categories_summary(self) -> Dict:
         """Get a summary of all categories and their recipe counts"""
-        categories_count = {}
-        with self.ix.searcher() as searcher:
-            for doc in searcher.all_stored_fields():
-                for category in doc["raw_data"].get("categories", []):
-                    categories_count[category] = categories_count.get(category, 0) + 1
-        return categories_count
+        generation = self.generation()
+        if self._category_generation != generation:
+            self._category_counts = self._read_sidecar(
+                "categories",
+                generation,
+                lambda: self._count_categories(self.searcher()),
+            )
+            self._category_generation = generation
+        return self._category_counts
+
+    def _read_sidecar(
+        self, name: str, generation: int, rebuild: Callable[[], Dict]
+    ) -> Dict:
+        """
+        The categories, terms or pantry rows kept in the sidecar for
+        generation, or the result of rebuild() if they are missing or out of
+        date
+        """
+        rows = self.sidecar.read(name, generation)
+        return rows if rows is not None else rebuild()
+
+    def _count_categories(self, searcher) -> Dict[str, int]:
+        """
+        Count the postings of the categories field, which avoids loading any
+        stored documents
+        """
+        counts = {}
+        reader = searcher.reader()
+        for category in reader.field_terms("categories"):
+            postings = reader.postings("categories", category)
+            counts[category] = sum(1 for _ in postings.all_ids())
+        return counts
+
+    def suggest(self, prefix: str, limit: int = 10) -> List[Dict]:
+        """
+        Titles, ingredients and categories starting with prefix, or whose
+        pinyin does, the ones in the most recipes first
+        """
+        index, _ = self._suggest_index.get(self.generation())
+        return index.suggest(prefix, limit)
+
+    def _build_suggest_index(self) -> SuggestIndex:
+        counts = self._read_sidecar(
+            "terms", self.generation(), lambda: self._count_terms(self.searcher())
+        )
+        return SuggestIndex(
+            (kind, text, count) for (kind, text), count in counts.items()
+        )
+
+    def _count_terms(self, searcher) -> Counter:
+        counts = Counter()
+        for document in searcher.reader().all_stored_fields():
+            counts.update(self._document_terms(document))
+        return counts
+
+    def by_ingredients(
+        self, query: str, page=1, per_page=10, max_missing=None, view="full"
+    ) -> Dict:
+        """
+        Recipes to cook with the ingredients listed in query, separated by
+        spaces or commas. Recipes using any of them as a main ingredient are
+        ranked by the number of main ingredients still missing, then by the
+        share covered. Every item lists the matched and missing main
+        ingredients. Staples like salt or oil are assumed to be at hand.
+        """
+        pantry = parse_pantry(query)
+        # Keyed by the generation the ingredients were loaded from, which
+        # lags behind the index while they are rebuilt
+        index, generation = self._pantry_index.get(self.generation())
+        key = (
+            "by_ingredients",
+            tuple(sorted(pantry)),
+            page,
+            per_page,
+            max_missing,
+            view,
+            generation,
+        )
+        response = self.query_cache.get(key)
+        if response is None:
+            response = self._by_ingredients(
+                index, pantry, page, per_page, max_missing, view
+            )
+            self.query_cache.put(key, response)
+        return response
+
+    def _by_ingredients(self, index, pantry, page, per_page, max_missing, view) -> Dict:
+        rows = index.match(pantry, max_missing)
+        owned = set(pantry)
+        start = (page - 1) * per_page
+        searcher = self.searcher()
+
+        items = []
+        for row in rows[start : start + per_page].tolist():
+            doc = searcher.document(recipe_id=index.recipe_ids[row])
+            if doc is None:
+                continue
+            if view == "summary":
+                item = self._summary(doc)
+            else:
+                item = self._recipe(doc["raw_data"])
+            main = index.main_ingredients(row)
+            matched = [name for name in main if name in owned]
+            item["pantry"] = {
+                "coverage": len(matched) / len(main),
+                "matched": matched,
+                "missing": [name for name in main if name not in owned],
+            }
+            items.append(item)
+
+        total = len(rows)
+        return {
+            "pantry": pantry,
+            "items": items,
+            "pagination": {
+                "total": total,
+                "page": page,
+                "per_page": per_page,
+                "total_pages": -(-total // per_page),
+            },
+        }
+
+    def _build_pantry_index(self) -> PantryIndex:
+        return PantryIndex(
+            self._read_sidecar(
+                "pantry",
+                self.generation(),
+                lambda: self._collect_pantry_rows(self.searcher()),
+            )
+        )
+
+    def _collect_pantry_rows(self, searcher) -> Dict[str, Dict[str, List[str]]]:
+        return {
+            document["recipe_id"]: ingredient_sets(
+                self._recipe(document["raw_data"]).get("ingredients", {})
+            )
+            for document in searcher.reader().all_stored_fields()
+        }
+
+    def build_similar(self, k: int = DEFAULT_NEIGHBOURS) -> int:
+        """
+        Precompute the k most similar recipes of every recipe in the index,
+        see similar.py. Returns the number of recipes.
+        """
+        if self.readonly:
+            raise PermissionError(f"Index in {self.index_dir} is opened read-only")
+        reader = self.searcher().reader()
+        return build_neighbours(
+            self.index_dir,
+            (
+                (document["recipe_id"], self._recipe(document["raw_data"]))
+                for document in reader.all_stored_fields()
+            ),
+            k=k,
+            generation=self.generation(),
+        )
+
+    def similar(self, recipe_id: str, limit: int = 10) -> Optional[List[Dict]]:
+        """
+        Summaries of the recipes most similar to one, from the neighbours
+        precomputed by build_similar(), or None if the recipe does not exist.
+        Recipes deleted since are left out, recipes added since have none.
+        """
+        searcher = self.searcher()
+        if searcher.document_number(recipe_id=recipe_id) is None:
+            return None
+        self.similar_recipes.refresh()
+        items = []
+        for neighbour, similarity in self.similar_recipes.neighbours(recipe_id, limit):
+            doc = searcher.document(recipe_id=neighbour)
+            if doc is not None:
+                items.append(dict(similarity=similarity, **self._summary(doc)))
+        return items
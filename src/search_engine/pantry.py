@@ -0,0 +1,187 @@
+"""
+"Cook with what I have": recipes ranked by how much of them a pantry covers
+
+Every recipe is reduced to two sets of normalized ingredient names: its main
+ingredients (the 主料 section) and the others. Seasonings everybody has,
+like salt or oil, are left out of both. PantryIndex keeps the sets as
+sparse NumPy arrays: the recipes of every ingredient, and the main
+ingredients of every recipe. Matching a pantry counts the recipes of its
+ingredients with one bincount, in time and memory proportional to those
+recipes rather than to the whole recipe x ingredient matrix.
+"""
+
+from typing import Dict, Iterable, List, Optional, Tuple
+import re
+import numpy as np
+
+MAIN_SECTION = "主料"
+
+# Assumed to be in every pantry, they never count as missing
+STAPLES = {
+    "盐",
+    "食盐",
+    "糖",
+    "白糖",
+    "白砂糖",
+    "水",
+    "清水",
+    "温水",
+    "油",
+    "食用油",
+    "植物油",
+    "花生油",
+    "生抽",
+    "老抽",
+    "酱油",
+    "料酒",
+    "醋",
+    "鸡精",
+    "味精",
+    "胡椒粉",
+}
+
+# Different names of the same ingredient
+SYNONYMS = {
+    "西红柿": "番茄",
+    "马铃薯": "土豆",
+    "洋芋": "土豆",
+    "土鸡蛋": "鸡蛋",
+    "鸡蛋液": "鸡蛋",
+    "小葱": "葱",
+    "香葱": "葱",
+    "大葱": "葱",
+    "葱花": "葱",
+    "蒜": "大蒜",
+    "蒜头": "大蒜",
+    "蒜瓣": "大蒜",
+    "姜": "生姜",
+    "老姜": "生姜",
+    "姜片": "生姜",
+}
+
+# Notes in brackets, e.g. 猪肉（五花）
+_NOTES = re.compile(r"[(（\[【].*?[)）\]】]")
+# Separators between the ingredients of a pantry query
+_SEPARATORS = re.compile(r"[\s,，、;；]+")
+
+
+def normalize_ingredient(name: str) -> Optional[str]:
+    """The ingredient id of a name, or None for staples and empty names"""
+    name = _NOTES.sub("", name).strip().lower()
+    name = SYNONYMS.get(name, name)
+    if not name or name in STAPLES:
+        return None
+    return name
+
+
+def parse_pantry(query: str) -> List[str]:
+    names = (normalize_ingredient(name) for name in _SEPARATORS.split(query))
+    return list(dict.fromkeys(name for name in names if name))
+
+
+def ingredient_sets(ingredients: Dict) -> Dict[str, List[str]]:
+    """
+    The main and other ingredient ids of a recipe's ingredient sections.
+    Without a 主料 section, the first section holds the main ingredients.
+    """
+    sections = list(ingredients.items())
+    main_section = MAIN_SECTION if MAIN_SECTION in ingredients else None
+    if main_section is None and sections:
+        main_section = sections[0][0]
+    main, other = {}, {}
+    for section, items in sections:
+        target = main if section == main_section else other
+        for item in items:
+            name = normalize_ingredient(item.get("name", ""))
+            if name:
+                target[name] = True
+    return {
+        "main": list(main),
+        "other": [name for name in other if name not in main],
+    }
+
+
+def _postings(sets: List[List[int]], n_columns: int) -> Tuple[np.ndarray, ...]:
+    """
+    The rows holding every column of a sparse boolean matrix given by the
+    column sets of its rows, as offsets by column and concatenated rows
+    """
+    lengths = np.fromiter((len(columns) for columns in sets), np.int64, len(sets))
+    rows = np.repeat(np.arange(len(sets), dtype=np.int32), lengths)
+    columns = np.fromiter(
+        (column for row in sets for column in row), np.int32, int(lengths.sum())
+    )
+    order = np.argsort(columns, kind="stable")
+    offsets = np.zeros(n_columns + 1, dtype=np.int64)
+    np.cumsum(np.bincount(columns, minlength=n_columns), out=offsets[1:])
+    return offsets, rows[order]
+
+
+class PantryIndex:
+    """Sparse recipe x ingredient incidence of main and other ingredients"""
+
+    def __init__(self, rows: Dict[str, Dict[str, List[str]]]):
+        self.recipe_ids = sorted(rows)
+        names = sorted(
+            {name for row in rows.values() for kind in row.values() for name in kind}
+        )
+        self.vocabulary = {name: column for column, name in enumerate(names)}
+        self.names = names
+        main = [[self.vocabulary[n] for n in rows[r]["main"]] for r in self.recipe_ids]
+        other = [
+            [self.vocabulary[n] for n in rows[r]["other"]] for r in self.recipe_ids
+        ]
+        self.main = _postings(main, len(names))
+        self.other = _postings(other, len(names))
+        # The main ingredients of every recipe, as offsets by recipe and
+        # concatenated columns
+        self.main_counts = np.fromiter(map(len, main), np.int32, len(main))
+        self.main_offsets = np.zeros(len(main) + 1, dtype=np.int64)
+        np.cumsum(self.main_counts, out=self.main_offsets[1:])
+        self.main_columns = np.fromiter(
+            (column for row in main for column in row),
+            np.int32,
+            int(self.main_offsets[-1]),
+        )
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    def _count(self, postings: Tuple[np.ndarray, ...], columns: List[int]):
+        """How many of columns every recipe has"""
+        offsets, rows = postings
+        hits = np.concatenate(
+            [rows[offsets[column] : offsets[column + 1]] for column in columns]
+        )
+        return np.bincount(hits, minlength=len(self.recipe_ids))
+
+    def match(
+        self, pantry: Iterable[str], max_missing: Optional[int] = None
+    ) -> np.ndarray:
+        """
+        Rows of the recipes using at least one pantry ingredient as a main
+        ingredient, with no more than max_missing main ingredients missing.
+        Returns the rows best first: fewest missing main ingredients, then
+        highest share of main ingredients covered, then most other
+        ingredients covered.
+        """
+        columns = [self.vocabulary[n] for n in pantry if n in self.vocabulary]
+        if not columns:
+            return np.zeros(0, dtype=np.int64)
+        covered = self._count(self.main, columns)
+        candidates = covered > 0
+        missing = self.main_counts - covered
+        if max_missing is not None:
+            candidates &= missing <= max_missing
+        rows = np.flatnonzero(candidates)
+        covered, missing = covered[rows], missing[rows]
+        coverage = covered / self.main_counts[rows]
+        extra = self._count(self.other, columns)[rows]
+        # lexsort sorts by the last key first, and is stable: ties stay in
+        # recipe_id order
+        order = np.lexsort((-extra, -coverage, missing))
+        return rows[order]
+
+    def main_ingredients(self, row: int) -> List[str]:
+        start, end = self.main_offsets[row], self.main_offsets[row + 1]
+        return [self.names[column] for column in self.main_columns[start:end]]
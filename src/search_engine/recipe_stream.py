@@ -0,0 +1,98 @@
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, TextIO
+import json
+
+# Extensions of JSON Lines files, as written by Scrapy's jsonlines feed exporter
+JSON_LINES_EXTENSIONS = (".jsonl", ".jl")
+
+_WHITESPACE = " \t\r\n"
+# Characters a number may go on with
+_NUMBER_CHARS = "0123456789.eE+-"
+
+
+def iter_recipes(path: str, chunk_size: int = 1 << 16) -> Iterator[Dict]:
+    """
+    Stream recipes from a JSON Lines file or from a file holding one JSON
+    array of recipes, without loading the whole file into memory
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(JSON_LINES_EXTENSIONS) or _first_char(f) != "[":
+            yield from _iter_json_lines(f)
+        else:
+            yield from _iter_json_array(f, chunk_size)
+
+
+def iter_batches(items: Iterable, size: int) -> Iterator[List]:
+    """Split an iterable into lists of at most size items"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _first_char(f: TextIO) -> str:
+    """Peek at the first non-whitespace character of a file"""
+    char = f.read(1)
+    while char and char in _WHITESPACE:
+        char = f.read(1)
+    f.seek(0)
+    return char
+
+
+def _iter_json_lines(f: TextIO) -> Iterator[Dict]:
+    for line in f:
+        line = line.strip()
+        if line:
+            yield json.loads(line)
+
+
+def _iter_json_array(f: TextIO, chunk_size: int) -> Iterator[Dict]:
+    """Decode the values of a JSON array one by one, reading chunk by chunk"""
+    decoder = json.JSONDecoder()
+    buffer, pos = "", 0
+    # What comes next: the "[" opening the array, then the first value or
+    # "]", then a "," or "]" after every value, and a value after a ","
+    expect = "["
+    while True:
+        while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+            pos += 1
+        if pos == len(buffer):
+            buffer, pos = f.read(chunk_size), 0
+            if not buffer:
+                raise ValueError("Unexpected end of file in JSON array")
+            continue
+
+        char = buffer[pos]
+        if expect == "[":
+            if char != "[":
+                raise ValueError("Expected a JSON array")
+            expect, pos = "first", pos + 1
+            continue
+        if char == "]" and expect in ("first", "separator"):
+            return
+        if expect == "separator":
+            if char != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            expect, pos = "value", pos + 1
+            continue
+
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            # The value continues in the next chunk
+            chunk = f.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, pos = buffer[pos:] + chunk, 0
+            continue
+        if end == len(buffer) or buffer[end] in _NUMBER_CHARS:
+            # So may a number that decoded, up to the end of the chunk or up
+            # to its unfinished fraction or exponent
+            chunk = f.read(chunk_size)
+            if chunk:
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+        yield value
+        expect, pos = "separator", end
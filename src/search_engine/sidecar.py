@@ -0,0 +1,200 @@
+"""
+State derived from the recipes of the index, kept in a SQLite file next to it
+
+Readers need the recipe counts of every category and suggestion term, and
+the ingredients of every recipe, without scanning the stored documents. The
+indexer keeps them in sidecar.db in the index directory, together with the
+index generation they describe, and a commit only writes the rows its
+recipes change.
+
+A writer opens its transaction on the file once it holds the index lock,
+and commits it right after the index. The next writer waits for that
+transaction before reading the file, so it always starts from the state of
+the latest generation. A file left behind by an interrupted commit
+describes an older generation: readers then scan the index instead, and the
+next writer rebuilds the file.
+"""
+
+from typing import Dict, Iterable, Optional, Tuple
+import json
+import os
+import sqlite3
+
+SIDECAR_FILE = "sidecar.db"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS generation (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    value INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS categories (
+    category TEXT PRIMARY KEY,
+    recipes INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS terms (
+    kind TEXT NOT NULL,
+    text TEXT NOT NULL,
+    recipes INTEGER NOT NULL,
+    PRIMARY KEY (kind, text)
+);
+CREATE TABLE IF NOT EXISTS pantry (
+    recipe_id TEXT PRIMARY KEY,
+    main TEXT NOT NULL,
+    other TEXT NOT NULL
+);
+"""
+
+
+def _read_categories(db) -> Dict[str, int]:
+    return dict(db.execute("SELECT category, recipes FROM categories"))
+
+
+def _read_terms(db) -> Dict[Tuple[str, str], int]:
+    return {
+        (kind, text): recipes
+        for kind, text, recipes in db.execute("SELECT kind, text, recipes FROM terms")
+    }
+
+
+def _read_pantry(db) -> Dict[str, Dict]:
+    return {
+        recipe_id: {"main": json.loads(main), "other": json.loads(other)}
+        for recipe_id, main, other in db.execute(
+            "SELECT recipe_id, main, other FROM pantry"
+        )
+    }
+
+
+_READERS = {
+    "categories": _read_categories,
+    "terms": _read_terms,
+    "pantry": _read_pantry,
+}
+
+
+class IndexSidecar:
+    """The sidecar.db file of an index directory"""
+
+    def __init__(self, index_dir: str):
+        self.path = os.path.join(index_dir, SIDECAR_FILE)
+
+    def _connect(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.execute("PRAGMA synchronous=NORMAL")
+        return db
+
+    def read(self, name: str, generation: int) -> Optional[Dict]:
+        """
+        The categories, terms or pantry rows of generation, or None if the
+        file is missing or describes another generation
+        """
+        if not os.path.exists(self.path):
+            return None
+        db = self._connect()
+        try:
+            # The generation and the rows come from the same snapshot
+            db.execute("BEGIN")
+            try:
+                row = db.execute("SELECT value FROM generation").fetchone()
+            except sqlite3.OperationalError:
+                # Created by a writer that did not add the tables yet
+                return None
+            if row is None or row[0] != generation:
+                return None
+            return _READERS[name](db)
+        finally:
+            db.close()
+
+    def begin(self) -> "SidecarUpdate":
+        """Start the update of a writer holding the index lock"""
+        db = self._connect()
+        try:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(_SCHEMA)
+            # Waits for the previous writer to commit its update
+            db.execute("BEGIN IMMEDIATE")
+        except BaseException:
+            db.close()
+            raise
+        return SidecarUpdate(db)
+
+
+class SidecarUpdate:
+    """
+    The changes of one index commit, applied in a single transaction that
+    is only committed along with the index
+    """
+
+    def __init__(self, db: sqlite3.Connection):
+        self.db = db
+        row = db.execute("SELECT value FROM generation").fetchone()
+        # The index generation the file describes
+        self.generation = row[0] if row else None
+
+    def clear(self):
+        for table in _READERS:
+            self.db.execute(f"DELETE FROM {table}")
+
+    def count_categories(self, changes: Dict[str, int]):
+        """Add the changes of recipe counts by category"""
+        self._count(
+            "categories", ("category",), [((c,), n) for c, n in changes.items()]
+        )
+
+    def count_terms(self, changes: Dict[Tuple[str, str], int]):
+        """Add the changes of recipe counts by (kind, text) term"""
+        self._count("terms", ("kind", "text"), list(changes.items()))
+
+    def _count(self, table: str, key: Tuple[str, ...], changes: Iterable):
+        changes = [(*values, n) for values, n in changes if n]
+        columns = ", ".join(key)
+        self.db.executemany(
+            f"INSERT INTO {table} ({columns}, recipes) "
+            f"VALUES ({', '.join('?' * (len(key) + 1))}) "
+            f"ON CONFLICT({columns}) DO UPDATE SET "
+            "recipes = recipes + excluded.recipes",
+            changes,
+        )
+        # Keys no recipe has anymore
+        where = " AND ".join(f"{column} = ?" for column in key)
+        self.db.executemany(
+            f"DELETE FROM {table} WHERE {where} AND recipes <= 0",
+            [change[:-1] for change in changes if change[-1] < 0],
+        )
+
+    def set_pantry(self, rows: Dict[str, Dict]):
+        """Insert or replace the ingredients of recipes"""
+        self.db.executemany(
+            "INSERT OR REPLACE INTO pantry (recipe_id, main, other) VALUES (?, ?, ?)",
+            [
+                (
+                    recipe_id,
+                    json.dumps(row["main"], ensure_ascii=False),
+                    json.dumps(row["other"], ensure_ascii=False),
+                )
+                for recipe_id, row in rows.items()
+            ],
+        )
+
+    def delete_pantry(self, recipe_ids: Iterable[str]):
+        self.db.executemany(
+            "DELETE FROM pantry WHERE recipe_id = ?",
+            [(recipe_id,) for recipe_id in recipe_ids],
+        )
+
+    def commit(self, generation: int):
+        """Record the generation the index was committed as, and commit"""
+        try:
+            self.db.execute(
+                "INSERT OR REPLACE INTO generation (id, value) VALUES (0, ?)",
+                (generation,),
+            )
+            self.db.execute("COMMIT")
+        finally:
+            self.db.close()
+
+    def rollback(self):
+        try:
+            self.db.execute("ROLLBACK")
+        finally:
+            self.db.close()
@@ -0,0 +1,242 @@
+"""
+Precomputed "similar recipes" of every recipe in the index
+
+An offline stage (src/build_similar.py) turns every recipe into a TF-IDF
+vector over the jieba tokens of its title, its normalized ingredient names
+and its categories, and finds the nearest neighbours of all recipes by
+cosine similarity. The vectors are sparse rows, multiplied against an
+inverted copy of themselves one batch of recipes at a time. Every batch
+holds a dense row of scores against all recipes for each of its recipes, so
+batches get fewer recipes as the corpus grows: memory stays under
+MAX_POSTINGS and MAX_SCORES, or one row of scores for corpora larger than
+MAX_SCORES recipes.
+
+The neighbours are written to the index directory as .npy files, under
+similar/<stamp>/, and named by similar/current.json. Readers memory-map
+them, a lookup is a binary search in the sorted recipe ids and a slice of
+one row.
+"""
+
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import json
+import os
+import re
+import shutil
+import time
+import jieba
+import numpy as np
+from .pantry import normalize_ingredient
+
+SIMILAR_DIR = "similar"
+CURRENT_FILE = "current.json"
+
+# Neighbours kept per recipe
+DEFAULT_NEIGHBOURS = 20
+
+# Bounds of one batch: recipes scored at once, term postings visited, and
+# scores held, recipes of the batch x recipes of the corpus
+BATCH_SIZE = 128
+MAX_POSTINGS = 1 << 22
+MAX_SCORES = 1 << 22
+
+_WORD = re.compile(r"\w")
+
+
+def recipe_tokens(recipe: Dict) -> List[str]:
+    """The terms of a recipe's vector, prefixed by the field they come from"""
+    tokens = [
+        f"t:{word}" for word in jieba.cut(recipe.get("title", "")) if _WORD.match(word)
+    ]
+    for items in recipe.get("ingredients", {}).values():
+        for item in items:
+            name = normalize_ingredient(item.get("name", ""))
+            if name:
+                tokens.append(f"i:{name}")
+    tokens.extend(f"c:{category}" for category in recipe.get("categories", []))
+    return tokens
+
+
+def tfidf(documents: Sequence[List[str]]) -> Tuple[np.ndarray, ...]:
+    """
+    L2-normalized TF-IDF rows of tokenized documents, as the indptr,
+    indices and weights arrays of a compressed sparse row matrix
+    """
+    vocabulary = {}
+    indptr = [0]
+    indices = []
+    counts = []
+    for tokens in documents:
+        frequency = {}
+        for token in tokens:
+            column = vocabulary.setdefault(token, len(vocabulary))
+            frequency[column] = frequency.get(column, 0) + 1
+        indices.extend(frequency)
+        counts.extend(frequency.values())
+        indptr.append(len(indices))
+
+    indptr = np.array(indptr, dtype=np.int64)
+    indices = np.array(indices, dtype=np.int64)
+    weights = np.array(counts, dtype=np.float64)
+    df = np.bincount(indices, minlength=len(vocabulary))
+    weights *= np.log((1 + len(documents)) / (1 + df[indices])) + 1
+    rows = np.repeat(np.arange(len(documents)), np.diff(indptr))
+    norms = np.sqrt(np.bincount(rows, weights**2, minlength=len(documents)))
+    weights /= np.maximum(norms, 1e-12)[rows]
+    return indptr, indices, weights
+
+
+def _expand(starts: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """The positions start, ..., start + length - 1 of every range, concatenated"""
+    ends = np.cumsum(lengths)
+    return np.arange(ends[-1] if len(ends) else 0) - np.repeat(
+        ends - lengths - starts, lengths
+    )
+
+
+def nearest_neighbours(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    weights: np.ndarray,
+    k: int = DEFAULT_NEIGHBOURS,
+    batch_size: int = BATCH_SIZE,
+    max_postings: int = MAX_POSTINGS,
+    max_scores: int = MAX_SCORES,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k rows most similar to every row of a normalized CSR matrix, and
+    their cosine similarities, best first. Rows with fewer than k similar
+    rows are padded with -1 and a similarity of 0.
+    """
+    n = len(indptr) - 1
+    k = min(k, max(n - 1, 0))
+    neighbours = np.full((n, k), -1, dtype=np.int32)
+    similarities = np.zeros((n, k), dtype=np.float32)
+    if k == 0:
+        return neighbours, similarities
+
+    # Inverted copy of the matrix: the rows and weights of every column
+    rows_of_entries = np.repeat(np.arange(n), np.diff(indptr))
+    order = np.argsort(indices, kind="stable")
+    posting_rows = rows_of_entries[order]
+    posting_weights = weights[order]
+    df = np.bincount(indices)
+    col_ptr = np.concatenate(([0], np.cumsum(df)))
+
+    # Postings visited before every row, to cut batches that would visit
+    # too many of them
+    visited = np.concatenate(([0], np.cumsum(df[indices])))[indptr]
+    batch_size = max(1, min(batch_size, max_scores // n))
+    start = 0
+    while start < n:
+        end = int(np.searchsorted(visited, visited[start] + max_postings, "right"))
+        end = min(max(end - 1, start + 1), start + batch_size, n)
+
+        # Every (row of the batch, term) entry spreads its weight over the
+        # postings of the term, which bincount sums up per pair of rows
+        entries = np.arange(indptr[start], indptr[end])
+        terms = indices[entries]
+        lengths = df[terms]
+        postings = _expand(col_ptr[terms], lengths)
+        targets = (
+            np.repeat(rows_of_entries[entries] - start, lengths) * n
+            + posting_rows[postings]
+        )
+        products = np.repeat(weights[entries], lengths) * posting_weights[postings]
+        scores = np.bincount(targets, products, minlength=(end - start) * n)
+        scores = scores.reshape(end - start, n)
+        scores[np.arange(end - start), np.arange(start, end)] = 0
+
+        best = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        best_scores = np.take_along_axis(scores, best, axis=1)
+        ranked = np.argsort(-best_scores, axis=1, kind="stable")
+        best = np.take_along_axis(best, ranked, axis=1)
+        best_scores = np.take_along_axis(best_scores, ranked, axis=1)
+        found = best_scores > 0
+        neighbours[start:end] = np.where(found, best, -1)
+        similarities[start:end] = np.where(found, best_scores, 0)
+        start = end
+    return neighbours, similarities
+
+
+def build_neighbours(
+    index_dir: str,
+    recipes: Iterable[Tuple[str, Dict]],
+    k: int = DEFAULT_NEIGHBOURS,
+    generation: Optional[int] = None,
+) -> int:
+    """
+    Compute the neighbours of (recipe_id, recipe) pairs and write them to the
+    index directory, replacing the previous ones. Returns the number of
+    recipes.
+    """
+    tokens = {recipe_id: recipe_tokens(recipe) for recipe_id, recipe in recipes}
+    # Rows are kept in recipe_id order, so readers find a row by bisection
+    recipe_ids = sorted(tokens)
+    matrix = tfidf([tokens[recipe_id] for recipe_id in recipe_ids])
+    neighbours, similarities = nearest_neighbours(*matrix, k=k)
+
+    directory = os.path.join(index_dir, SIMILAR_DIR)
+    stamp = f"{time.time_ns():x}"
+    os.makedirs(os.path.join(directory, stamp))
+    np.save(os.path.join(directory, stamp, "ids.npy"), np.array(recipe_ids, dtype=str))
+    np.save(os.path.join(directory, stamp, "neighbours.npy"), neighbours)
+    np.save(os.path.join(directory, stamp, "similarities.npy"), similarities)
+
+    current = os.path.join(directory, CURRENT_FILE)
+    previous = None
+    if os.path.exists(current):
+        with open(current, "r", encoding="utf-8") as f:
+            previous = json.load(f)["stamp"]
+    with open(f"{current}.tmp", "w", encoding="utf-8") as f:
+        json.dump({"stamp": stamp, "generation": generation, "k": k}, f)
+    os.replace(f"{current}.tmp", current)
+
+    # Keep the previous neighbours for readers that still have them open
+    for name in os.listdir(directory):
+        path = os.path.join(directory, name)
+        if os.path.isdir(path) and name not in (stamp, previous):
+            shutil.rmtree(path, ignore_errors=True)
+    return len(recipe_ids)
+
+
+class SimilarRecipes:
+    """Memory-mapped neighbours of the recipes, as written by build_neighbours()"""
+
+    def __init__(self, index_dir: str):
+        self.directory = os.path.join(index_dir, SIMILAR_DIR)
+        self._mtime = None
+        self._arrays = None
+
+    def refresh(self):
+        """Map the current neighbours, if they changed since the last call"""
+        try:
+            mtime = os.stat(os.path.join(self.directory, CURRENT_FILE)).st_mtime_ns
+        except FileNotFoundError:
+            self._mtime, self._arrays = None, None
+            return
+        if mtime == self._mtime:
+            return
+        with open(os.path.join(self.directory, CURRENT_FILE), encoding="utf-8") as f:
+            stamp = json.load(f)["stamp"]
+        self._arrays = tuple(
+            np.load(os.path.join(self.directory, stamp, name), mmap_mode="r")
+            for name in ("ids.npy", "neighbours.npy", "similarities.npy")
+        )
+        self._mtime = mtime
+
+    def neighbours(self, recipe_id: str, limit: int) -> List[Tuple[str, float]]:
+        """The (recipe_id, similarity) pairs of the recipes most like one"""
+        arrays = self._arrays
+        if arrays is None:
+            return []
+        ids, neighbours, similarities = arrays
+        row = int(np.searchsorted(ids, recipe_id))
+        if row == len(ids) or ids[row] != recipe_id:
+            return []
+        return [
+            (str(ids[neighbour]), float(similarity))
+            for neighbour, similarity in zip(
+                neighbours[row, :limit].tolist(), similarities[row, :limit].tolist()
+            )
+            if neighbour >= 0
+        ]
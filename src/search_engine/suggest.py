@@ -0,0 +1,89 @@
+"""
+Search-as-you-type suggestions over recipe titles, ingredients and categories
+
+The terms and the number of recipes they appear in are kept by the indexer
+in a sidecar file. SuggestIndex turns them into a sorted array of lookup
+keys, searched with bisect: every term is found by a prefix of its own
+characters and, when pypinyin is installed, of its pinyin and of its
+pinyin initials, so "xihong" and "xhs" both find 西红柿. The best terms of
+every short prefix, which match the most keys, are computed up front.
+"""
+
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+import heapq
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:
+    lazy_pinyin = None
+
+# Kinds of terms, in the order they are preferred on equal counts
+KINDS = ("category", "ingredient", "title")
+
+# Most suggestions returned for one prefix
+MAX_SUGGESTIONS = 10
+
+# Prefixes up to this length have their suggestions computed up front
+PRECOMPUTED_PREFIX = 3
+
+
+def normalize(text: str) -> str:
+    return "".join(text.split()).lower()
+
+
+def lookup_keys(text: str) -> List[str]:
+    """The keys a term is found by: its text, pinyin and pinyin initials"""
+    keys = [normalize(text)]
+    if lazy_pinyin is not None:
+        syllables = lazy_pinyin(keys[0], errors="ignore")
+        if syllables:
+            keys.append("".join(syllables))
+            initials = lazy_pinyin(keys[0], style=Style.FIRST_LETTER, errors="ignore")
+            keys.append("".join(initials))
+    return list(dict.fromkeys(key for key in keys if key))
+
+
+class SuggestIndex:
+    """Prefix lookups of weighted terms in a sorted array of keys"""
+
+    def __init__(self, terms: Iterable[Tuple[str, str, int]]):
+        # Best terms first, so that lower ids rank higher
+        self.terms = sorted(
+            (term for term in terms if term[2] > 0),
+            key=lambda term: (-term[2], KINDS.index(term[0]), len(term[1]), term[1]),
+        )
+        entries = sorted(
+            (key, term_id)
+            for term_id, (_, text, _) in enumerate(self.terms)
+            for key in lookup_keys(text)
+        )
+        self.keys = [key for key, _ in entries]
+        self.term_ids = [term_id for _, term_id in entries]
+
+        matches = {}
+        for key, term_id in entries:
+            for length in range(1, min(len(key), PRECOMPUTED_PREFIX) + 1):
+                matches.setdefault(key[:length], set()).add(term_id)
+        self.precomputed = {
+            prefix: heapq.nsmallest(MAX_SUGGESTIONS, term_ids)
+            for prefix, term_ids in matches.items()
+        }
+
+    def __len__(self):
+        return len(self.terms)
+
+    def suggest(self, prefix: str, limit: int = MAX_SUGGESTIONS) -> List[Dict]:
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        if len(prefix) <= PRECOMPUTED_PREFIX:
+            term_ids = self.precomputed.get(prefix, [])[:limit]
+        else:
+            start = bisect_left(self.keys, prefix)
+            end = bisect_left(self.keys, prefix + "\uffff", start)
+            term_ids = heapq.nsmallest(limit, set(self.term_ids[start:end]))
+        return [
+            {"text": text, "kind": kind, "count": count}
+            for kind, text, count in (self.terms[term_id] for term_id in term_ids)
+        ]
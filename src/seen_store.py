@@ -0,0 +1,96 @@
+from typing import Dict, Iterable, Optional, Set
+import time
+
+from src.sqlite_util import connect
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recipes (
+    recipe_id TEXT PRIMARY KEY,
+    url TEXT NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    content_hash TEXT,
+    first_seen REAL NOT NULL,
+    last_checked REAL NOT NULL
+)
+"""
+
+_COLUMNS = (
+    "recipe_id",
+    "url",
+    "etag",
+    "last_modified",
+    "content_hash",
+    "first_seen",
+    "last_checked",
+)
+
+
+class SeenRecipeStore:
+    """
+    Persistent record of the recipe detail pages crawled so far, keyed by
+    recipe_id, with the validators needed to re-check them cheaply: the
+    ETag and Last-Modified headers and a hash of the page body, shared by
+    the shards of a crawl
+    """
+
+    def __init__(self, path: str = "seen_recipes.db"):
+        self.path = path
+        self._db = connect(path)
+        self._db.execute(_SCHEMA)
+
+    def get(self, recipe_id: str) -> Optional[Dict]:
+        row = self._db.execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM recipes WHERE recipe_id = ?",
+            (recipe_id,),
+        ).fetchone()
+        return dict(zip(_COLUMNS, row)) if row else None
+
+    def known(self, recipe_ids: Iterable[str]) -> Set[str]:
+        """Return which of the given recipe_ids have been seen"""
+        ids = list(set(recipe_ids))
+        known = set()
+        # Stay below SQLite's limit on the number of bound parameters
+        for start in range(0, len(ids), 500):
+            chunk = ids[start : start + 500]
+            rows = self._db.execute(
+                "SELECT recipe_id FROM recipes WHERE recipe_id IN "
+                f"({', '.join('?' * len(chunk))})",
+                chunk,
+            )
+            known.update(row[0] for row in rows)
+        return known
+
+    def record(
+        self,
+        recipe_id: str,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        content_hash: Optional[str] = None,
+    ):
+        """Insert or refresh a recipe after its page was fetched"""
+        now = time.time()
+        self._db.execute(
+            "INSERT INTO recipes (recipe_id, url, etag, last_modified, "
+            "content_hash, first_seen, last_checked) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(recipe_id) DO UPDATE SET url = excluded.url, "
+            "etag = excluded.etag, last_modified = excluded.last_modified, "
+            "content_hash = excluded.content_hash, "
+            "last_checked = excluded.last_checked",
+            (recipe_id, url, etag, last_modified, content_hash, now, now),
+        )
+
+    def touch(self, recipe_id: str):
+        """Mark a recipe as checked and found unchanged"""
+        self._db.execute(
+            "UPDATE recipes SET last_checked = ? WHERE recipe_id = ?",
+            (time.time(), recipe_id),
+        )
+
+    def close(self):
+        self._db.close()
+
+    def __len__(self):
+        return self._db.execute("SELECT COUNT(*) FROM recipes").fetchone()[0]
@@ -15,24 +15,73 @@ DOWNLOADER_MIDDLEWARES = {
     "scrapy.downloadermiddlewares.useragent.UserAgentMiddleware": None,
     "scrapy.downloadermiddlewares.retry.RetryMiddleware": 543,
     "scrapy.downloadermiddlewares.httpcompression.HttpCompressionMiddleware": 810,
+    "src.middlewares.SeenRecipeMiddleware": 560,
+    "src.frontier.FrontierMiddleware": 10,
+    # After RetryMiddleware, to see download exceptions before retries
+    "src.middlewares.AdaptiveThrottle": 545,
 }
 
+# Crawl frontier: set FRONTIER_DB to a file to share the pending requests
+# and the seen fingerprints between the processes of a crawl and to resume
+# it after a restart. Use a new file for every crawl, the fingerprints of
+# an old one would filter out everything. Without it the frontier is in
+# memory, as with Scrapy's own scheduler.
+SCHEDULER = "src.frontier.SQLiteScheduler"
+DUPEFILTER_CLASS = "src.frontier.SQLiteDupeFilter"
+FRONTIER_DB = None
+
 # Configure item pipelines
 ITEM_PIPELINES = {
     "src.pipelines.MeishiImagePipeline": 1,
     # "src.pipelines.MeishiPipeline": 300,
+    "src.pipelines.MeishiIndexPipeline": 800,
 }
 
+# Search index pipeline settings: scraped recipes are upserted into the
+# index in batches, serve it with RECIPE_INDEX_MODE=readonly meanwhile
+RECIPE_INDEX_DIR = "recipe_index"
+RECIPE_INDEX_BATCH_SIZE = 200
+RECIPE_INDEX_FLUSH_INTERVAL = 60  # seconds
+RECIPE_INDEX_MERGE_POLICY = "small"
+
 # Enable and configure HTTP caching
 HTTPCACHE_ENABLED = True
 HTTPCACHE_EXPIRATION_SECS = 0
 HTTPCACHE_DIR = "httpcache"
+# One compressed SQLite file per spider instead of a directory per response
+HTTPCACHE_STORAGE = "src.httpcache.SQLiteCacheStorage"
+HTTPCACHE_COMPRESSION = "auto"  # zstd if installed, else zlib
+# (URL regex, seconds) pairs, the first match wins, 0 never expires; recipe
+# pages fall back to HTTPCACHE_EXPIRATION_SECS
+HTTPCACHE_EXPIRATION_RULES = [
+    (r"/recipe/(?:all|category)/", 24 * 3600),  # list pages, daily
+]
+
+# Incremental re-crawl: recipes already crawled are skipped for
+# SEEN_RECIPES_RECHECK_SECS, then re-checked with conditional requests that
+# bypass the HTTP cache, and list pagination stops at pages with only known
+# recipes. Delete SEEN_RECIPES_DB for a full crawl.
+SEEN_RECIPES_ENABLED = True
+SEEN_RECIPES_DB = "seen_recipes.db"
+SEEN_RECIPES_RECHECK_SECS = 7 * 24 * 3600
 
 # Add meishichina specific settings
 CONCURRENT_REQUESTS_PER_DOMAIN = 10
 DOWNLOAD_DELAY = 2  # Be polite with the server
 RANDOMIZE_DOWNLOAD_DELAY = True
 
+# Adaptive throttle (a downloader middleware, see DOWNLOADER_MIDDLEWARES):
+# starting from the values above, the concurrency and delay of every host
+# are tuned to its latency, error statuses and download failures, within the
+# budgets of src.middlewares.DEFAULT_BUDGETS. CONCURRENT_REQUESTS only caps
+# the total across hosts.
+CONCURRENT_REQUESTS = 64
+ADAPTIVE_THROTTLE_ENABLED = True
+ADAPTIVE_THROTTLE_IMAGE_SLOTS = ["images"]  # IMAGES_DOWNLOAD_SLOT
+# Overrides of the html and image budgets, e.g. {"html": {"max_concurrency": 8}}
+ADAPTIVE_THROTTLE_BUDGETS = {}
+ADAPTIVE_THROTTLE_LOG_INTERVAL = 60  # seconds
+
 # Export feed in utf-8 encoding
 FEED_EXPORT_ENCODING = "utf-8"
 
@@ -40,6 +89,14 @@ FEED_EXPORT_ENCODING = "utf-8"
 IMAGES_STORE = "images_steps"
 IMAGES_URLS_FIELD = "image_urls"
 IMAGES_RESULT_FIELD = "image_paths"
+# Step images are only downloaded by meishi_image_spider, which enables this
+IMAGES_STEPS_ENABLED = False
+# All image requests share one downloader slot, with its own parallelism
+IMAGES_DOWNLOAD_SLOT = "images"
+DOWNLOAD_SLOTS = {"images": {"concurrency": 16, "delay": 0}}
+# Downloads done and failed, to resume a backfill and skip broken images
+IMAGES_MANIFEST = "images_manifest.db"
+IMAGES_MAX_ATTEMPTS = 3
 
 # Download settings
 DOWNLOAD_TIMEOUT = 180
@@ -49,7 +106,21 @@ DOWNLOAD_FAIL_ON_DATALOSS = False
 IMAGES_DOMAINS = ["meishichina.com"]
 
 # Disable the offsite middleware for image domains
-SPIDER_MIDDLEWARES = {"scrapy.spidermiddlewares.offsite.OffsiteMiddleware": None}
+SPIDER_MIDDLEWARES = {
+    "scrapy.spidermiddlewares.offsite.OffsiteMiddleware": None,
+    # Closest to the spiders, so that it times only the callbacks
+    "src.telemetry.TelemetryMiddleware": 1000,
+}
+
+# Crawl telemetry: callback timings, bytes, items and errors as JSON Lines,
+# buffered and written off the reactor thread, with a periodic summary
+TELEMETRY_ENABLED = True
+TELEMETRY_FILE = "telemetry/crawl.jsonl"
+TELEMETRY_BUFFER_SIZE = 500
+TELEMETRY_FLUSH_INTERVAL = 5  # seconds
+TELEMETRY_MAX_BYTES = 64 * 1024 * 1024
+TELEMETRY_BACKUP_COUNT = 5
+TELEMETRY_SUMMARY_INTERVAL = 60  # seconds
 
 # Add custom headers for image requests
 DEFAULT_REQUEST_HEADERS = {
@@ -0,0 +1,170 @@
+from math import ceil
+from typing import Dict, Iterable, List, Tuple
+
+
+class ListPlan:
+    """Progress of one recipe list, e.g. a category, towards its quota"""
+
+    # Saved with the planner, the quota is always read from the quota file
+    STATE = (
+        "claimed",
+        "duplicates",
+        "last_requested",
+        "pages_done",
+        "outstanding",
+        "exhausted",
+    )
+
+    def __init__(self, key: str, quota: int):
+        self.key = key
+        self.quota = quota
+        self.claimed = 0
+        self.duplicates = 0
+        self.last_requested = 0
+        self.pages_done = 0
+        self.outstanding = 0
+        self.exhausted = False
+
+    @property
+    def remaining(self) -> int:
+        return max(0, self.quota - self.claimed)
+
+    def report(self) -> Dict:
+        return {
+            "list": self.key,
+            "quota": self.quota,
+            "recipes": self.claimed,
+            "fill_rate": self.claimed / self.quota if self.quota else 1.0,
+            "pages": self.pages_done,
+            "duplicates": self.duplicates,
+        }
+
+
+class CrawlPlanner:
+    """
+    Plan the list pages and recipe requests of a quota-driven crawl
+
+    Quotas are recipe counts per list, keyed like meishi_quota.json
+    ("category.<name>", "all.hot", "all.pop"). Once the first page of a list
+    shows how many recipes a page holds, all the pages expected to fill the
+    quota are requested at once. A recipe is requested only for the first
+    list it appears in, and only while that list is under quota. When the
+    planned pages have arrived and the list is still short, because of
+    recipes shared with other lists, more pages are planned from the number
+    of new recipes per page seen so far.
+    """
+
+    def __init__(
+        self,
+        quotas: Dict[str, int],
+        default_quota: int = 5,
+        max_fanout: int = 10,
+    ):
+        self.quotas = quotas
+        self.default_quota = quotas.get("category._default", default_quota)
+        self.max_fanout = max_fanout
+        self.lists: Dict[str, ListPlan] = {}
+        self.recipes = set()
+
+    def plan(self, key: str) -> ListPlan:
+        if key not in self.lists:
+            default = self.default_quota if key.startswith("category.") else 0
+            quota = self.quotas.get(key, default)
+            self.lists[key] = ListPlan(key, quota)
+        return self.lists[key]
+
+    def start(self, key: str) -> List[int]:
+        """Pages to request first for a list: only page 1, to learn its size"""
+        plan = self.plan(key)
+        if plan.quota < 1 or plan.last_requested:
+            return []
+        return self._request(plan, 1)
+
+    def list_page(
+        self,
+        key: str,
+        page: int,
+        recipe_ids: Iterable[str],
+        stop: bool = False,
+    ) -> Tuple[List[int], List[str]]:
+        """
+        Account for a list page that arrived, or failed with no recipe_ids
+
+        Returns the further pages of the list and the recipe_ids to request.
+        stop ends the pagination of the list, e.g. when all its recipes are
+        already known.
+        """
+        plan = self.plan(key)
+        plan.outstanding -= 1
+        plan.pages_done += 1
+        recipe_ids = list(dict.fromkeys(recipe_ids))
+        if not recipe_ids or stop:
+            plan.exhausted = True
+
+        new_recipes = []
+        for recipe_id in recipe_ids:
+            if not plan.remaining:
+                break
+            if recipe_id in self.recipes:
+                plan.duplicates += 1
+                continue
+            self.recipes.add(recipe_id)
+            plan.claimed += 1
+            new_recipes.append(recipe_id)
+
+        if page == 1 and recipe_ids and plan.remaining and not plan.exhausted:
+            # Fan out to every page the quota needs at this page size
+            pages = self._request(plan, ceil(plan.remaining / len(recipe_ids)), first=2)
+        else:
+            pages = self._top_up(plan)
+        return pages, new_recipes
+
+    def page_dropped(self, key: str) -> List[int]:
+        """
+        Account for a list page that was never downloaded, e.g. filtered
+        as a duplicate when a crawl resumes. Returns the further pages of
+        the list.
+        """
+        plan = self.plan(key)
+        plan.outstanding -= 1
+        return self._top_up(plan)
+
+    def _top_up(self, plan: ListPlan) -> List[int]:
+        """Once the planned pages are back, plan more for a short list"""
+        if not plan.remaining or plan.exhausted or plan.outstanding > 0:
+            return []
+        # The yield of new recipes per page so far
+        per_page = max(1.0, plan.claimed / max(plan.pages_done, 1))
+        return self._request(
+            plan, ceil(plan.remaining / per_page), first=plan.last_requested + 1
+        )
+
+    def _request(self, plan: ListPlan, count: int, first: int = 1) -> List[int]:
+        pages = list(range(first, first + min(count, self.max_fanout)))
+        if pages:
+            plan.last_requested = pages[-1]
+            plan.outstanding += len(pages)
+        return pages
+
+    def state(self) -> Dict:
+        """
+        The progress of every list, to resume the crawl with restore().
+        The requested recipes are left out, they only grow and are saved
+        as list_page() returns them.
+        """
+        return {
+            "lists": {
+                key: {name: getattr(plan, name) for name in ListPlan.STATE}
+                for key, plan in self.lists.items()
+            },
+        }
+
+    def restore(self, state: Dict, recipes: Iterable[str] = ()):
+        for key, values in state["lists"].items():
+            plan = self.plan(key)
+            for name in ListPlan.STATE:
+                setattr(plan, name, values[name])
+        self.recipes.update(recipes)
+
+    def report(self) -> List[Dict]:
+        return [plan.report() for _, plan in sorted(self.lists.items()) if plan.quota]
@@ -1,20 +1,34 @@
-import json
 import scrapy
+from src.frontier import in_shard
+from src.search_engine.recipe_stream import iter_batches, iter_recipes
 
 
 class MeishiImageDownloaderSpider(scrapy.Spider):
     name = "meishi_image_spider"
     start_urls = ["https://m.meishichina.com/"]
     allowed_domains = ["meishichina.com", "!i8.meishichina.com"]
-    
-    def parse(self, response):
-        with open('data/recipe_selected_v3.json', 'r', encoding='utf-8') as f:
-            recipes = json.load(f)
-            
-        for recipe in recipes:
-            yield {
-                "recipe_id": recipe.get("recipe_id", "unknown"),
-                "steps": recipe.get("steps", [])[:10],
-                "detail_url": recipe.get("detail_url", "")
-            }
 
+    # Crawl output to read, either a JSON array or JSON Lines
+    recipes_path = "data/recipe_selected_v3.json"
+    batch_size = 500
+    # Run several processes with -a shard=N -a num_shards=M to split the
+    # recipes between them
+    shard = 0
+    num_shards = 1
+
+    custom_settings = {"IMAGES_STEPS_ENABLED": True}
+
+    def parse(self, response):
+        # Recipes are streamed in batches, the file is never loaded as a whole
+        for batch in iter_batches(
+            iter_recipes(self.recipes_path), int(self.batch_size)
+        ):
+            for recipe in batch:
+                recipe_id = str(recipe.get("recipe_id", "unknown"))
+                if not in_shard(recipe_id, self.shard, self.num_shards):
+                    continue
+                yield {
+                    "recipe_id": recipe.get("recipe_id", "unknown"),
+                    "steps": recipe.get("steps", [])[:10],
+                    "detail_url": recipe.get("detail_url", ""),
+                }
@@ -1,198 +1,174 @@
 import json
 import scrapy
+from scrapy import signals
+from .crawl_planner import CrawlPlanner
+from .recipe_extractor import extract_recipe
+from src.frontier import FrontierState, in_shard
 from typing import Dict, List, Iterator
 from urllib.parse import urljoin
 import re
-from datetime import datetime
 
 
 class MeishiSelectedSpider(scrapy.Spider):
     name = "meishi_selected_spider"
     allowed_domains = ["meishichina.com", "!i8.meishichina.com"]
 
+    # Run several processes sharing a FRONTIER_DB with -a shard=N -a
+    # num_shards=M, each crawls its share of the categories and quotas
+    shard = 0
+    num_shards = 1
+    planner = None
+    # Where the planner is saved, the FRONTIER_DB of a resumable crawl
+    planner_state = None
+
+    @classmethod
+    def from_crawler(cls, crawler, *args, **kwargs):
+        spider = super().from_crawler(crawler, *args, **kwargs)
+        crawler.signals.connect(spider.request_dropped, signals.request_dropped)
+        return spider
+
     def start_requests(self):
         """Generate initial request for the main recipe page"""
+        # Every shard has to read the categories, even if another one did
         yield scrapy.Request(
-            "https://m.meishichina.com/recipe/", callback=self.parse_categories
+            "https://m.meishichina.com/recipe/",
+            callback=self.parse_categories,
+            dont_filter=True,
         )
 
     def parse_categories(self, response):
         """Parse the main recipe page to extract categories"""
-        # Load quota configuration
-        with open("meishi_quota.json") as f:
-            quotas = json.load(f)
-
-        # Handle "all" type URLs (hot and popular)
-        hot_quota = quotas.get("all.hot", 0)
-        pop_quota = quotas.get("all.pop", 0)
+        planner = self._get_planner()
 
         # Parse categories directly from the page
         category_links = response.css(
             'a[href*="/recipe/category/"]::attr(href)'
         ).getall()
-        for link in category_links:
-            cat_key = link.split("/category/")[-1].strip("/")
-
-            quota = quotas.get(
-                f"category.{cat_key}", quotas.get("category._default", 5)
-            )
-            if quota < 1:
-                continue
-
-            yield scrapy.Request(
-                f"https://m.meishichina.com/recipe/category/{cat_key}/1/",
-                callback=self.parse_recipe_list,
-                meta={
-                    "category": cat_key,
-                    "current_page": 1,
-                    "quota": quota,
-                    "page_type": "category",
-                },
-            )
-
+        lists = [
+            ("category", link.split("/category/")[-1].strip("/"))
+            for link in category_links
+        ]
         # Handle both hot and popular pages
-        for page_type, quota in [("hot", hot_quota), ("pop", pop_quota)]:
-            if quota < 1:
+        lists += [("hot", None), ("pop", None)]
+
+        for page_type, category in lists:
+            key = self._list_key(page_type, category)
+            if not in_shard(key, self.shard, self.num_shards):
                 continue
-            yield scrapy.Request(
-                f"https://m.meishichina.com/recipe/all/{page_type}/1/",
-                callback=self.parse_recipe_list,
-                meta={"page_type": page_type, "current_page": 1, "quota": quota},
-            )
+            for page in planner.start(key):
+                yield self._list_request(page_type, category, page)
+        self._save_planner()
 
     def parse_recipe_list(self, response):
         """Parse the recipe list pages (both category and all types)"""
-        # Log the URL with additional context
-        with open("recipe_list_urls.log", "a", encoding="utf-8") as f:
-            timestamp = datetime.now().isoformat()
-            f.write(f"{timestamp}\t{response.url}\n")
-
-        recipe_links = response.css('a[href*="/recipe/"]::attr(href)').getall()
-
-        # Check if we have any recipes on this page
-        has_recipes = any(
-            "/category/" not in link and re.match(r".*/recipe/\d+/?$", link)
-            for link in recipe_links
-        )
+        # Recipe URLs of this page by recipe_id, in page order
+        recipe_urls = {}
+        for link in response.css('a[href*="/recipe/"]::attr(href)').getall():
+            if "/category/" not in link and re.match(r".*/recipe/\d+/?$", link):
+                recipe_id = link.rstrip("/").split("/")[-1]
+                recipe_urls.setdefault(recipe_id, response.urljoin(link))
 
-        # Get pagination metadata
         page_type = response.meta.get("page_type")
         category = response.meta.get("category")
         current_page = response.meta.get("current_page", 1)
-        quota = response.meta.get("quota", 0)
-
-        # If we have recipes and haven't reached quota, request next page
-        if has_recipes and current_page < quota:
-            next_page = current_page + 1
-            if page_type != "category":  # For hot/pop pages
-                next_url = (
-                    f"https://m.meishichina.com/recipe/all/{page_type}/{next_page}/"
-                )
-            else:  # For category pages
-                next_url = (
-                    f"https://m.meishichina.com/recipe/category/{category}/{next_page}/"
-                )
-
-            yield scrapy.Request(
-                next_url,
-                callback=self.parse_recipe_list,
-                meta={
-                    "page_type": page_type,
-                    "category": category,
-                    "current_page": next_page,
-                    "quota": quota,
-                },
-            )
 
-        # Process current page recipes
-        for link in recipe_links:
-            if "/category/" not in link and re.match(r".*/recipe/\d+/?$", link):
-                full_url = response.urljoin(link)
-                yield scrapy.Request(full_url, callback=self.parse_recipe)
-
-    def parse_recipe(self, response) -> Iterator[Dict]:
-        # Extract recipe_id from URL
-        recipe_id = response.url.split("/recipe/")[-1].rstrip("/")
-
-        # Get title - check both direct text and anchor text within h1
-        title = (
-            response.xpath("//h1/a/text()").get() or response.xpath("//h1/text()").get()
+        # The planner fans out the next pages while the list is short of
+        # its quota, unless every recipe on this page was crawled before,
+        # and picks the recipes not requested for another list yet
+        pages, recipe_ids = self._get_planner().list_page(
+            self._list_key(page_type, category),
+            current_page,
+            recipe_urls,
+            stop=response.meta.get("all_recipes_seen", False),
         )
+        self._save_planner(recipe_ids)
+        for page in pages:
+            yield self._list_request(page_type, category, page)
 
-        ingredients_data = {}
-
-        # Find all ingredient sections (主料, 辅料, 配料 etc.)
-        ingredient_sections = response.xpath('//div[@class="rbox"]//h5')
-
-        for section in ingredient_sections:
-            # Get section name (e.g., "主料", "辅料", "配料")
-            section_name = section.xpath("./text()").get()
-            if not section_name:
-                continue
+        # Process current page recipes
+        for recipe_id in recipe_ids:
+            yield scrapy.Request(recipe_urls[recipe_id], callback=self.parse_recipe)
+
+    def list_page_failed(self, failure):
+        """Count a list page that could not be downloaded as the last one"""
+        meta = failure.request.meta
+        key = self._list_key(meta.get("page_type"), meta.get("category"))
+        self._get_planner().list_page(key, meta.get("current_page", 1), [])
+        self._save_planner()
+
+    def request_dropped(self, request, spider=None):
+        """
+        Account for a list page the scheduler filtered out, e.g. as already
+        seen when a crawl resumes, which no callback will ever see
+        """
+        meta = request.meta
+        if "current_page" not in meta:
+            return
+        page_type, category = meta.get("page_type"), meta.get("category")
+        pages = self._get_planner().page_dropped(self._list_key(page_type, category))
+        self._save_planner()
+        for page in pages:
+            self.crawler.engine.crawl(self._list_request(page_type, category, page))
+
+    def _list_key(self, page_type, category):
+        # Keys of meishi_quota.json
+        if page_type == "category":
+            return f"category.{category}"
+        return f"all.{page_type}"
+
+    def _list_request(self, page_type, category, page):
+        if page_type != "category":  # For hot/pop pages
+            url = f"https://m.meishichina.com/recipe/all/{page_type}/{page}/"
+        else:  # For category pages
+            url = f"https://m.meishichina.com/recipe/category/{category}/{page}/"
+        return scrapy.Request(
+            url,
+            callback=self.parse_recipe_list,
+            errback=self.list_page_failed,
+            meta={"page_type": page_type, "category": category, "current_page": page},
+        )
 
-            # Get ingredients under this section - more generic approach
-            ingredients = []
-            # Just target li elements and find spans within them
-            ingredient_elements = section.xpath("./following-sibling::ul[1]/li")
-
-            for ingredient in ingredient_elements:
-                # Get all spans within the li element, regardless of parent structure
-                spans = ingredient.xpath(".//span/text()").getall()
-                if len(spans) >= 2:
-                    name, amount = spans[0], spans[1]
-                    ingredients.append({"name": name.strip(), "amount": amount.strip()})
-
-            if ingredients:
-                ingredients_data[section_name] = ingredients
-
-        # Get cooking steps with images - updated parsing logic
-        steps = []
-        step_elements = response.xpath('//ul[@class="steplist"]/li')
-        for step in step_elements:
-            step_text = step.xpath("./div/text()").get().strip()
-            # Remove the step number (e.g., "1.", "2.", etc.)
-            step_text = (
-                ".".join(step_text.split(".")[1:]).strip()
-                if "." in step_text
-                else step_text
+    def _get_planner(self):
+        if self.planner is None:
+            # Load quota configuration, in recipes per list
+            with open("meishi_quota.json") as f:
+                self.planner = CrawlPlanner(json.load(f))
+            crawler = getattr(self, "crawler", None)
+            path = crawler.settings.get("FRONTIER_DB") if crawler else None
+            if path:
+                # Resume the planner along with the pending requests
+                self.planner_state = FrontierState(path, self.shard)
+                state = self.planner_state.load("planner")
+                if state:
+                    self.planner.restore(
+                        state, self.planner_state.load_items("planner.recipes")
+                    )
+        return self.planner
+
+    def _save_planner(self, recipe_ids=()):
+        """Save the progress of the lists and the newly requested recipes"""
+        if self.planner_state is not None:
+            self.planner_state.add_items("planner.recipes", recipe_ids)
+            self.planner_state.save("planner", self.planner.state())
+
+    def closed(self, reason):
+        """Report how far every list got towards its quota"""
+        if self.planner is None:
+            return
+        if self.planner_state is not None:
+            self._save_planner()
+            self.planner_state.close()
+        for row in self.planner.report():
+            prefix = f"planner/{row['list']}"
+            self.crawler.stats.set_value(f"{prefix}/recipes", row["recipes"])
+            self.crawler.stats.set_value(
+                f"{prefix}/fill_rate", round(row["fill_rate"], 3)
+            )
+            self.logger.info(
+                f"{row['list']}: {row['recipes']}/{row['quota']} recipes "
+                f"({row['fill_rate']:.0%}) from {row['pages']} pages, "
+                f"{row['duplicates']} already requested for other lists"
             )
 
-            # Get the image URL from data-src attribute
-            image_url = step.xpath("./img/@data-src").get()
-
-            if step_text:
-                steps.append({"text": step_text, "image": image_url})
-
-        # Get tips (小窍门 & 温馨提示)
-        tips_container = response.xpath(
-            '//div[contains(@class, "textbox")][.//h3[contains(text(), "窍门") or contains(text(), "提示")]]//div/text()'
-        ).getall()
-        tips = []
-        for tip in tips_container:
-            # Split by line breaks and process each tip
-            tip_lines = tip.strip().split("\n")
-            tips.extend([t.strip() for t in tip_lines if t.strip()])
-
-        # Get categories
-        categories = response.xpath(
-            '//div[contains(@class, "textbox")][contains(text(), "分类：")]//a/text()'
-        ).getall()
-        categories = [cat.strip() for cat in categories if cat.strip()]
-
-        # Get full size image with validation
-        image_url = (
-            response.css("div.row.mb20 img::attr(src)").get() or ""
-        )  # Default to empty string
-
-        # Combine all data with validated fields
-        item = {
-            "title": title or "",  # Defensive programming for other fields too
-            "recipe_id": recipe_id,
-            "ingredients": ingredients_data or {},
-            "steps": steps or [],
-            "tips": tips or [],
-            "categories": categories or [],
-            "detail_url": response.url,
-            "image_url": image_url,
-        }
-        yield item
+    def parse_recipe(self, response) -> Iterator[Dict]:
+        yield extract_recipe(response)
@@ -0,0 +1,114 @@
+from typing import Dict, List, Optional
+from lxml import etree
+
+# XPath expressions are compiled once at import time instead of being parsed
+# again for every response and every ingredient section
+
+_TITLE_LINK = etree.XPath("//h1/a/text()")
+_TITLE = etree.XPath("//h1/text()")
+
+# Ingredient sections (主料, 辅料, 配料 etc.) and their items
+_INGREDIENT_SECTIONS = etree.XPath('//div[@class="rbox"]//h5')
+_SECTION_NAME = etree.XPath("./text()")
+_SECTION_ITEMS = etree.XPath("./following-sibling::ul[1]/li")
+_ITEM_SPANS = etree.XPath(".//span/text()")
+
+_STEPS = etree.XPath('//ul[@class="steplist"]/li')
+_STEP_TEXT = etree.XPath("./div/text()")
+_STEP_IMAGE = etree.XPath("./img/@data-src")
+
+# Tips (小窍门 & 温馨提示) and categories both live in "textbox" divs, which
+# are visited once and told apart by their content
+_TEXTBOXES = etree.XPath('//div[contains(@class, "textbox")]')
+_IS_TIPS_BOX = etree.XPath(
+    'boolean(.//h3[contains(text(), "窍门") or contains(text(), "提示")])'
+)
+_IS_CATEGORIES_BOX = etree.XPath('contains(text(), "分类：")')
+_BOX_TIPS = etree.XPath(".//div/text()")
+_BOX_CATEGORIES = etree.XPath(".//a/text()")
+
+# Same as the CSS selector "div.row.mb20 img::attr(src)"
+_MAIN_IMAGE = etree.XPath(
+    "//div[contains(concat(' ', normalize-space(@class), ' '), ' row ')"
+    " and contains(concat(' ', normalize-space(@class), ' '), ' mb20 ')]"
+    "//img/@src"
+)
+
+
+def _first(results: List) -> Optional[str]:
+    return str(results[0]) if results else None
+
+
+def extract_recipe(response) -> Dict:
+    """Extract a recipe item from a meishichina recipe detail page"""
+    root = response.selector.root
+
+    # Extract recipe_id from URL
+    recipe_id = response.url.split("/recipe/")[-1].rstrip("/")
+
+    # Get title - check both direct text and anchor text within h1
+    title = _first(_TITLE_LINK(root)) or _first(_TITLE(root))
+
+    ingredients_data = {}
+    for section in _INGREDIENT_SECTIONS(root):
+        section_name = _first(_SECTION_NAME(section))
+        if not section_name:
+            continue
+
+        ingredients = []
+        for ingredient in _SECTION_ITEMS(section):
+            spans = _ITEM_SPANS(ingredient)
+            if len(spans) >= 2:
+                name, amount = spans[0], spans[1]
+                ingredients.append({"name": name.strip(), "amount": amount.strip()})
+
+        if ingredients:
+            ingredients_data[section_name] = ingredients
+
+    steps = []
+    for step in _STEPS(root):
+        step_text = (_first(_STEP_TEXT(step)) or "").strip()
+        # Remove the step number (e.g., "1.", "2.", etc.)
+        step_text = (
+            ".".join(step_text.split(".")[1:]).strip()
+            if "." in step_text
+            else step_text
+        )
+
+        # Get the image URL from data-src attribute
+        image_url = _first(_STEP_IMAGE(step))
+
+        if step_text:
+            steps.append({"text": step_text, "image": image_url})
+
+    tips = []
+    categories = []
+    tips_boxes = set()
+    categories_boxes = set()
+    for box in _TEXTBOXES(root):
+        # A box nested in a matching box was already covered by its ancestor
+        ancestors = set(box.iterancestors())
+        if _IS_TIPS_BOX(box) and not ancestors & tips_boxes:
+            tips_boxes.add(box)
+            for tip in _BOX_TIPS(box):
+                # Split by line breaks and process each tip
+                tips.extend(t.strip() for t in tip.strip().split("\n") if t.strip())
+        if _IS_CATEGORIES_BOX(box) and not ancestors & categories_boxes:
+            categories_boxes.add(box)
+            categories.extend(
+                cat.strip() for cat in _BOX_CATEGORIES(box) if cat.strip()
+            )
+
+    # Get full size image, default to empty string
+    image_url = _first(_MAIN_IMAGE(root)) or ""
+
+    return {
+        "title": title or "",
+        "recipe_id": recipe_id,
+        "ingredients": ingredients_data or {},
+        "steps": steps or [],
+        "tips": tips or [],
+        "categories": categories or [],
+        "detail_url": response.url,
+        "image_url": image_url,
+    }
@@ -0,0 +1,19 @@
+"""SQLite files shared by the processes of a crawl"""
+
+import sqlite3
+
+
+def connect(path, autocommit=True):
+    """
+    Open a database in WAL mode, where readers never wait for the writer.
+    In autocommit mode every write commits on its own, so processes sharing
+    the file only hold its write lock for one statement. Without a path the
+    database is in memory.
+    """
+    db = sqlite3.connect(
+        path or ":memory:", timeout=30, isolation_level=None if autocommit else ""
+    )
+    if path:
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")
+    return db
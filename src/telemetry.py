@@ -0,0 +1,287 @@
+from collections import Counter, defaultdict
+from scrapy import signals
+from scrapy.exceptions import NotConfigured
+from scrapy.http import Request
+from twisted.internet import defer, task, threads
+import json
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class TelemetrySink:
+    """
+    Buffered JSON Lines event log
+
+    Events are kept in memory and appended to the file on a thread, when the
+    buffer is full or flush() is called, so the reactor never waits on disk.
+    The file is rotated like logging's RotatingFileHandler once it would
+    grow past max_bytes: path.1 is the newest backup, path.<backup_count>
+    the oldest kept.
+    """
+
+    def __init__(self, path, buffer_size=500, max_bytes=64 << 20, backup_count=5):
+        self.path = path
+        self.buffer_size = buffer_size
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self.buffer = []
+        # Only one write runs at a time, so lines are never interleaved
+        self.lock = defer.DeferredLock()
+
+    def emit(self, event):
+        event.setdefault("ts", round(time.time(), 3))
+        self.buffer.append(event)
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        batch, self.buffer = self.buffer, []
+        if not batch:
+            return self.lock.run(defer.succeed, None)
+        d = self.lock.run(threads.deferToThread, self._write, batch)
+        d.addErrback(
+            lambda failure: logger.error(f"Error writing telemetry: {failure.value}")
+        )
+        return d
+
+    def _write(self, batch):
+        data = "".join(
+            json.dumps(event, ensure_ascii=False) + "\n" for event in batch
+        ).encode("utf-8")
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if (
+            self.max_bytes
+            and os.path.exists(self.path)
+            and os.path.getsize(self.path) + len(data) > self.max_bytes
+        ):
+            self._rotate()
+        with open(self.path, "ab") as f:
+            f.write(data)
+
+    def _rotate(self):
+        if self.backup_count < 1:
+            os.remove(self.path)
+            return
+        for number in range(self.backup_count - 1, 0, -1):
+            source = f"{self.path}.{number}"
+            if os.path.exists(source):
+                os.replace(source, f"{self.path}.{number + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+
+class CallbackStats:
+    """Timings and output of one spider callback"""
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.requests = 0
+        # Durations since the last summary, for its percentiles
+        self.recent = []
+
+    def summary(self):
+        recent = sorted(self.recent)
+        self.recent = []
+        return {
+            "calls": self.calls,
+            "total_ms": round(self.seconds * 1000, 1),
+            "items": self.items,
+            "requests": self.requests,
+            "p50_ms": _percentile_ms(recent, 50),
+            "p95_ms": _percentile_ms(recent, 95),
+        }
+
+
+class CallbackTiming:
+    """Run time and output of one callback invocation"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.items = 0
+        self.requests = 0
+
+    def count(self, output):
+        if isinstance(output, Request):
+            self.requests += 1
+        else:
+            self.items += 1
+
+
+class TelemetryMiddleware:
+    """
+    Spider middleware recording crawl telemetry to a TelemetrySink
+
+    It writes one "callback" event per response: URL, status, size, the
+    callback's run time and how many items and requests it produced. It
+    also writes one "error" event per exception class raised by a callback
+    or an item pipeline. Every TELEMETRY_SUMMARY_INTERVAL seconds, and when
+    the spider closes, it writes a "summary" event with per-callback
+    percentiles, bytes downloaded and error counts, and logs it in one line.
+    Keep it closest to the spider, so the timings cover only the callbacks.
+    """
+
+    def __init__(self, crawler, sink, summary_interval, flush_interval):
+        self.crawler = crawler
+        self.sink = sink
+        self.summary_interval = summary_interval
+        self.flush_interval = flush_interval
+        self.callbacks = defaultdict(CallbackStats)
+        self.errors = Counter()
+        self.responses = 0
+        self.bytes = 0
+        self.started = time.time()
+
+    @classmethod
+    def from_crawler(cls, crawler):
+        settings = crawler.settings
+        if not settings.getbool("TELEMETRY_ENABLED"):
+            raise NotConfigured
+        sink = TelemetrySink(
+            settings.get("TELEMETRY_FILE", "telemetry/crawl.jsonl"),
+            buffer_size=settings.getint("TELEMETRY_BUFFER_SIZE", 500),
+            max_bytes=settings.getint("TELEMETRY_MAX_BYTES", 64 << 20),
+            backup_count=settings.getint("TELEMETRY_BACKUP_COUNT", 5),
+        )
+        middleware = cls(
+            crawler,
+            sink,
+            summary_interval=settings.getfloat("TELEMETRY_SUMMARY_INTERVAL", 60),
+            flush_interval=settings.getfloat("TELEMETRY_FLUSH_INTERVAL", 5),
+        )
+        crawler.signals.connect(middleware.spider_opened, signals.spider_opened)
+        crawler.signals.connect(middleware.spider_closed, signals.spider_closed)
+        crawler.signals.connect(middleware.response_received, signals.response_received)
+        crawler.signals.connect(middleware.spider_error, signals.spider_error)
+        crawler.signals.connect(middleware.item_error, signals.item_error)
+        return middleware
+
+    def spider_opened(self, spider):
+        self.started = time.time()
+        self.sink.emit({"event": "start", "spider": spider.name})
+        self.flush_loop = task.LoopingCall(self.sink.flush)
+        self.flush_loop.start(self.flush_interval, now=False)
+        self.summary_loop = task.LoopingCall(self.summarize, spider)
+        if self.summary_interval > 0:
+            self.summary_loop.start(self.summary_interval, now=False)
+
+    def spider_closed(self, spider, reason):
+        for loop in (self.flush_loop, self.summary_loop):
+            if loop.running:
+                loop.stop()
+        self.summarize(spider, reason=reason)
+        return self.sink.flush()
+
+    def response_received(self, response, request, spider):
+        self.responses += 1
+        self.bytes += len(response.body)
+
+    def spider_error(self, failure, response, spider):
+        self._error("callback", failure, response.url)
+
+    def item_error(self, item, response, spider, failure):
+        self._error("pipeline", failure, response.url if response else None)
+
+    def _error(self, stage, failure, url):
+        name = failure.type.__name__
+        self.errors[f"{stage}/{name}"] += 1
+        self.sink.emit({"event": "error", "stage": stage, "class": name, "url": url})
+
+    def process_spider_output(self, response, result, spider=None):
+        timing = CallbackTiming()
+        iterator = iter(result)
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    output = next(iterator)
+                finally:
+                    timing.seconds += time.perf_counter() - start
+                timing.count(output)
+                yield output
+        except StopIteration:
+            pass
+        finally:
+            self._record(response, timing)
+
+    async def process_spider_output_async(self, response, result, spider=None):
+        timing = CallbackTiming()
+        iterator = result.__aiter__()
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    output = await iterator.__anext__()
+                finally:
+                    timing.seconds += time.perf_counter() - start
+                timing.count(output)
+                yield output
+        except StopAsyncIteration:
+            pass
+        finally:
+            self._record(response, timing)
+
+    def _record(self, response, timing):
+        callback = _callback_name(response)
+        stats = self.callbacks[callback]
+        stats.calls += 1
+        stats.seconds += timing.seconds
+        stats.items += timing.items
+        stats.requests += timing.requests
+        stats.recent.append(timing.seconds)
+        self.sink.emit(
+            {
+                "event": "callback",
+                "callback": callback,
+                "url": response.url,
+                "status": response.status,
+                "bytes": len(response.body),
+                "ms": round(timing.seconds * 1000, 3),
+                "items": timing.items,
+                "requests": timing.requests,
+            }
+        )
+
+    def summarize(self, spider, reason=None):
+        elapsed = time.time() - self.started
+        callbacks = {name: stats.summary() for name, stats in self.callbacks.items()}
+        items = sum(stats["items"] for stats in callbacks.values())
+        event = {
+            "event": "summary",
+            "spider": spider.name,
+            "elapsed": round(elapsed, 1),
+            "responses": self.responses,
+            "bytes": self.bytes,
+            "items": items,
+            "callbacks": callbacks,
+            "errors": dict(self.errors),
+        }
+        if reason is not None:
+            event["reason"] = reason
+        self.sink.emit(event)
+        spider.logger.info(
+            f"Telemetry: {self.responses} responses, {self.bytes / 1e6:.1f} MB, "
+            f"{items} items ({items / max(elapsed, 1e-9):.1f}/s), "
+            f"{sum(self.errors.values())} errors; "
+            + ", ".join(
+                f"{name} p50 {stats['p50_ms']} ms p95 {stats['p95_ms']} ms"
+                for name, stats in sorted(callbacks.items())
+            )
+        )
+
+
+def _callback_name(response):
+    callback = response.request.callback if response.request else None
+    return getattr(callback, "__name__", None) or "parse"
+
+
+def _percentile_ms(ordered, pct):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index] * 1000, 3)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The search engine is imported as a package of src, like in the benchmarks
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
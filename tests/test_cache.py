@@ -0,0 +1,77 @@
+from src.search_engine import cache
+from src.search_engine.cache import GenerationValue, LRUCache
+import threading
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    lru = LRUCache(ttl=10)
+    lru.put("a", 1)
+    clock.now += 9
+    assert lru.get("a") == 1
+    clock.now += 2
+    assert lru.get("a") is None
+    assert len(lru) == 0
+    assert lru.stats()["hits"] == 1 and lru.stats()["misses"] == 1
+
+
+def test_least_recently_used_is_evicted_first():
+    lru = LRUCache(maxsize=2)
+    lru.put("a", 1)
+    lru.put("b", 2)
+    lru.get("a")
+    lru.put("c", 3)
+    assert lru.get("b") is None
+    assert (lru.get("a"), lru.get("c")) == (1, 3)
+    assert lru.stats()["evictions"] == 1
+
+
+def test_byte_limit():
+    lru = LRUCache(max_bytes=10, sizeof=len)
+    lru.put("a", "x" * 4)
+    lru.put("b", "x" * 4)
+    lru.put("c", "x" * 4)
+    assert lru.get("a") is None
+    assert lru.stats()["bytes"] == 8
+    # Replacing an entry counts its new size only
+    lru.put("b", "x" * 6)
+    assert lru.stats()["bytes"] == 10
+    # Larger than the whole cache, never stored
+    lru.put("d", "x" * 11)
+    assert lru.get("d") is None
+    assert len(lru) == 2
+    lru.clear()
+    assert lru.stats()["bytes"] == 0
+
+
+def test_generation_value_is_rebuilt_in_background():
+    started, release = threading.Event(), threading.Event()
+    builds = []
+
+    def build():
+        builds.append(len(builds))
+        if len(builds) > 1:
+            started.set()
+            release.wait(5)
+        return len(builds)
+
+    value = GenerationValue(build, "test")
+    assert value.get(1) == (1, 1)
+    # A newer generation keeps the previous value until the rebuild is done
+    assert value.get(2) == (1, 1)
+    assert started.wait(5)
+    assert value.get(2) == (1, 1)
+    pending = value._pending
+    release.set()
+    pending.result(5)
+    assert value.get(2) == (2, 2)
+    assert len(builds) == 2
@@ -0,0 +1,74 @@
+from src.frontier import FrontierState
+from src.spiders.crawl_planner import CrawlPlanner
+
+
+def ids(prefix, count):
+    return [f"{prefix}{n}" for n in range(count)]
+
+
+def test_fan_out_is_capped_at_max_fanout():
+    planner = CrawlPlanner({"category.a": 100}, max_fanout=4)
+    assert planner.start("category.a") == [1]
+    # 95 recipes to go at 5 a page would take 19 more pages
+    pages, recipes = planner.list_page("category.a", 1, ids("a", 5))
+    assert pages == [2, 3, 4, 5]
+    assert recipes == ids("a", 5)
+    assert planner.start("category.a") == []
+
+
+def test_short_list_is_topped_up_after_shared_recipes():
+    planner = CrawlPlanner({"category.a": 4, "category.b": 6})
+    planner.start("category.a")
+    planner.list_page("category.a", 1, ids("x", 4))
+    assert planner.start("category.b") == [1]
+    # Half of the first page was requested for the other list
+    pages, recipes = planner.list_page("category.b", 1, ids("x", 2) + ids("b", 2))
+    assert recipes == ids("b", 2)
+    assert pages == [2]
+    pages, recipes = planner.list_page("category.b", 2, ["x2", "x3", "b2", "b3"])
+    assert recipes == ["b2", "b3"]
+    # 2 new recipes a page so far, 1 more page for the last 2
+    assert pages == [3]
+    assert planner.lists["category.b"].duplicates == 4
+
+
+def test_no_top_up_while_pages_are_outstanding_or_list_ended():
+    planner = CrawlPlanner({"category.a": 20})
+    planner.start("category.a")
+    assert planner.list_page("category.a", 1, ids("a", 5))[0] == [2, 3, 4]
+    assert planner.list_page("category.a", 2, ids("b", 5))[0] == []
+    assert planner.list_page("category.a", 3, [])[0] == []
+    assert planner.list_page("category.a", 4, ids("c", 5))[0] == []
+    assert planner.lists["category.a"].exhausted
+
+
+def test_dropped_page_tops_up_the_list():
+    planner = CrawlPlanner({"category.a": 10})
+    planner.start("category.a")
+    assert planner.list_page("category.a", 1, ids("a", 5))[0] == [2]
+    # Page 2 was filtered as seen when the crawl resumed
+    assert planner.page_dropped("category.a") == [3]
+    assert planner.lists["category.a"].outstanding == 1
+
+
+def test_state_round_trip(tmp_path):
+    quotas = {"category.a": 10, "all.hot": 3}
+    planner = CrawlPlanner(quotas)
+    planner.start("category.a")
+    planner.start("all.hot")
+    _, recipes = planner.list_page("category.a", 1, ids("a", 5))
+    state = FrontierState(str(tmp_path / "frontier.db"), shard=1)
+    state.add_items("planner.recipes", recipes)
+    state.save("planner", planner.state())
+    state.close()
+
+    state = FrontierState(str(tmp_path / "frontier.db"), shard=1)
+    resumed = CrawlPlanner(quotas)
+    resumed.restore(state.load("planner"), state.load_items("planner.recipes"))
+    assert resumed.state() == planner.state()
+    assert resumed.recipes == planner.recipes
+    assert resumed.list_page("all.hot", 1, ["a0", "h0"]) == planner.list_page(
+        "all.hot", 1, ["a0", "h0"]
+    )
+    # Another shard keeps its own state
+    assert FrontierState(str(tmp_path / "frontier.db")).load("planner") is None
@@ -0,0 +1,69 @@
+from src.search_engine.docstore import DOCSTORE_DIR, MIN_SAMPLES, DocStore
+from src.search_engine.indexer import RecipeIndexer
+import os
+
+
+def recipe(n: int, dish: str = "番茄炒蛋") -> dict:
+    return {
+        "recipe_id": str(n),
+        "title": f"{dish}{n}",
+        "ingredients": {
+            "主料": [{"name": "番茄", "amount": f"{n % 5 + 1}个"}],
+            "调料": [{"name": "盐", "amount": "适量"}],
+        },
+        "steps": [{"text": f"第{step}步，{dish}翻炒均匀"} for step in range(n % 4 + 1)],
+        "categories": ["家常菜"],
+    }
+
+
+def test_round_trip(tmp_path):
+    store = DocStore(str(tmp_path))
+    recipes = [recipe(n) for n in range(MIN_SAMPLES)]
+    assert list(store.prepare(recipes)) == recipes
+    assert store.trained
+
+    for item in recipes[:5]:
+        payload = store.encode(item)
+        assert store.decode(payload) == item
+    # A store opened afterwards decodes with the trained dictionary
+    assert DocStore(str(tmp_path)).decode(store.encode(recipes[0])) == recipes[0]
+
+
+def test_too_few_recipes_are_not_trained_on(tmp_path):
+    store = DocStore(str(tmp_path))
+    recipes = [recipe(n) for n in range(MIN_SAMPLES - 1)]
+    assert list(store.prepare(recipes)) == recipes
+    assert not store.trained
+    assert store.decode(store.encode(recipes[0])) == recipes[0]
+
+
+def test_writers_opened_on_fresh_index_share_dictionary(tmp_path):
+    index_dir = str(tmp_path / "index")
+    # Two pipeline shards, both opened before anything was indexed
+    first = RecipeIndexer(index_dir)
+    second = RecipeIndexer(index_dir)
+    first.index_recipes([recipe(n) for n in range(150)], mode="upsert")
+    second.index_recipes(
+        [recipe(n, "红烧肉") for n in range(1000, 1150)], mode="upsert"
+    )
+
+    assert len(os.listdir(os.path.join(index_dir, DOCSTORE_DIR))) == 2
+    reader = RecipeIndexer(index_dir, readonly=True)
+    assert reader.get_by_id("0")["title"] == "番茄炒蛋0"
+    assert reader.get_by_id("1000")["title"] == "红烧肉1000"
+
+
+def test_retraining_keeps_older_dictionaries(tmp_path):
+    index_dir = str(tmp_path / "index")
+    indexer = RecipeIndexer(index_dir)
+    indexer.index_recipes([recipe(n) for n in range(150)], mode="upsert")
+    # Retrained on different recipes, the first ones stay encoded with the
+    # first dictionary
+    store = DocStore(index_dir)
+    store.train([recipe(n, "红烧肉") for n in range(150)])
+    store.train([recipe(n, "清蒸鱼") for n in range(150)])
+
+    indexer.index_recipes([recipe(n, "清蒸鱼") for n in range(150, 300)], "upsert")
+    reader = RecipeIndexer(index_dir, readonly=True)
+    assert reader.get_by_id("0")["title"] == "番茄炒蛋0"
+    assert reader.get_by_id("150")["title"] == "清蒸鱼150"
@@ -0,0 +1,85 @@
+from fastapi.testclient import TestClient
+from src.search_engine.executor import SearchExecutor, SearchOverloaded
+from src.search_engine.indexer import RecipeIndexer
+import asyncio
+import importlib
+import os
+import pytest
+import threading
+import time
+
+
+@pytest.fixture(scope="module")
+def api(tmp_path_factory):
+    index_dir = str(tmp_path_factory.mktemp("api") / "index")
+    RecipeIndexer(index_dir).index_recipes(
+        [{"recipe_id": "1", "title": "番茄炒蛋", "ingredients": {}, "steps": []}],
+        mode="upsert",
+    )
+    env = {"RECIPE_INDEX_DIR": index_dir, "RECIPE_INDEX_MODE": "readonly"}
+    saved = {name: os.environ.get(name) for name in env}
+    os.environ.update(env)
+    try:
+        yield importlib.import_module("src.search_engine.api")
+    finally:
+        for name, value in saved.items():
+            if value is None:
+                os.environ.pop(name, None)
+            else:
+                os.environ[name] = value
+
+
+def wait_idle(executor):
+    deadline = time.monotonic() + 5
+    while executor.stats()["in_flight"] and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_calls_beyond_the_queue_are_rejected():
+    executor = SearchExecutor(max_workers=1, max_queue=1, timeout=5)
+    release = threading.Event()
+
+    async def main():
+        waiting = [
+            asyncio.ensure_future(executor.run(release.wait, 5)) for _ in range(2)
+        ]
+        await asyncio.sleep(0)
+        with pytest.raises(SearchOverloaded):
+            await executor.run(release.wait, 5)
+        release.set()
+        await asyncio.gather(*waiting)
+        return await executor.run(lambda: "done")
+
+    try:
+        assert asyncio.run(main()) == "done"
+        wait_idle(executor)
+        assert executor.stats()["rejected"] == 1
+        assert executor.stats()["in_flight"] == 0
+    finally:
+        executor.shutdown()
+
+
+def test_api_answers_504_on_timeout_and_503_when_overloaded(api, monkeypatch):
+    release = threading.Event()
+
+    def slow_search(*args, **kwargs):
+        release.wait(5)
+        return {"items": [], "pagination": {}}
+
+    executor = SearchExecutor(max_workers=1, max_queue=0, timeout=0.05)
+    monkeypatch.setattr(api, "executor", executor)
+    monkeypatch.setattr(api.indexer, "search", slow_search)
+    # Not entered, so the lifespan does not warm up the real executor
+    client = TestClient(api.app)
+    try:
+        assert client.get("/search/", params={"q": "番茄"}).status_code == 504
+        # The call that timed out keeps its worker until it returns
+        assert client.get("/search/", params={"q": "番茄"}).status_code == 503
+        release.set()
+        wait_idle(executor)
+        assert client.get("/search/", params={"q": "番茄"}).status_code == 200
+        assert executor.stats()["timeouts"] == 1
+        assert executor.stats()["rejected"] == 1
+    finally:
+        release.set()
+        executor.shutdown()
@@ -0,0 +1,86 @@
+from scrapy import Spider
+from scrapy.http import Request, Response
+from scrapy.utils.test import get_crawler
+from src.httpcache import ExpirationRules, SQLiteCacheStorage, compact, compress
+from w3lib.http import headers_dict_to_raw
+import gzip
+import pytest
+
+PAGE = "<html><body>" + "<li>番茄炒蛋</li>" * 200 + "</body></html>"
+
+
+@pytest.fixture
+def storage(tmp_path):
+    crawler = get_crawler(
+        Spider, {"HTTPCACHE_DIR": str(tmp_path), "HTTPCACHE_COMPRESSION": "zlib"}
+    )
+    spider = Spider.from_crawler(crawler, name="test")
+    storage = SQLiteCacheStorage(crawler.settings)
+    storage.open_spider(spider)
+    yield storage, spider
+    storage.close_spider(spider)
+
+
+def stored(storage, request):
+    return storage.db.execute(
+        "SELECT codec, LENGTH(body) FROM responses WHERE fingerprint = ?",
+        (storage._fingerprint(request),),
+    ).fetchone()
+
+
+def test_encoded_body_is_stored_decoded(storage):
+    storage, spider = storage
+    request = Request("https://home.meishichina.com/recipe/1/")
+    body = gzip.compress(PAGE.encode("utf-8"))
+    response = Response(
+        request.url,
+        headers={"Content-Encoding": "gzip", "Content-Type": "text/html"},
+        body=body,
+    )
+    storage.store_response(spider, request, response)
+
+    assert stored(storage, request)[0] == "zlib"
+    cached = storage.retrieve_response(spider, request)
+    assert b"Content-Encoding" not in cached.headers
+    assert cached.body == PAGE.encode("utf-8")
+
+
+def test_images_and_unknown_encodings_are_not_recompressed(storage):
+    storage, spider = storage
+    image = Request("https://i3.meishichina.com/atta/recipe/1.jpg")
+    storage.store_response(
+        spider,
+        image,
+        Response(image.url, headers={"Content-Type": "image/jpeg"}, body=b"\xff" * 64),
+    )
+    encoded = Request("https://home.meishichina.com/recipe/2/")
+    storage.store_response(
+        spider,
+        encoded,
+        Response(encoded.url, headers={"Content-Encoding": "xz"}, body=b"xz data"),
+    )
+
+    assert stored(storage, image) == ("none", 64)
+    assert stored(storage, encoded) == ("none", 7)
+    cached = storage.retrieve_response(spider, encoded)
+    assert cached.headers[b"Content-Encoding"] == b"xz"
+    assert cached.body == b"xz data"
+
+
+def test_compact_decodes_bodies_stored_encoded(storage):
+    storage, spider = storage
+    request = Request("https://home.meishichina.com/recipe/3/")
+    storage.store_response(spider, request, Response(request.url, body=b""))
+    # As stored before bodies were decoded
+    storage.db.execute(
+        "UPDATE responses SET headers = ?, body = ?",
+        (
+            headers_dict_to_raw({b"Content-Encoding": [b"gzip"]}),
+            compress(gzip.compress(PAGE.encode("utf-8")), "zlib"),
+        ),
+    )
+
+    assert compact(storage.path, ExpirationRules([]), "zlib") == (0, 1)
+    cached = storage.retrieve_response(spider, request)
+    assert b"Content-Encoding" not in cached.headers
+    assert cached.body == PAGE.encode("utf-8")
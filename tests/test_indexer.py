@@ -0,0 +1,206 @@
+from whoosh.writing import SegmentWriter
+from src.search_engine.indexer import RecipeIndexer
+import json
+import os
+import pytest
+
+
+def recipe(n: int) -> dict:
+    return {
+        "recipe_id": str(n),
+        "title": f"番茄炒蛋{n}",
+        "ingredients": {"主料": [{"name": "番茄", "amount": "2个"}]},
+        "steps": [{"text": "炒熟"}],
+        "categories": ["家常菜"],
+    }
+
+
+def write_recipes(path, count: int):
+    with open(path, "w", encoding="utf-8") as f:
+        for n in range(count):
+            f.write(json.dumps(recipe(n), ensure_ascii=False) + "\n")
+
+
+def test_top_ingredients_skip_staples_and_repeats(tmp_path):
+    sections = {
+        "辅料": ["葱花", "盐", "油"],
+        "主料": ["番茄", "鸡蛋", "西红柿"],
+        "调料": ["小葱", "生姜", "大蒜", "醋"],
+    }
+    item = recipe(1)
+    item["ingredients"] = {
+        section: [{"name": name, "amount": "适量"} for name in names]
+        for section, names in sections.items()
+    }
+    indexer = RecipeIndexer(str(tmp_path / "index"))
+    indexer.index_recipes([item], mode="upsert")
+    summary = indexer.search("番茄", view="summary")["items"][0]
+    assert summary["top_ingredients"] == ["番茄", "鸡蛋", "葱花", "生姜", "大蒜"]
+
+
+def test_rebuild_creates_new_generation(tmp_path):
+    index_dir = str(tmp_path / "index")
+    source = tmp_path / "recipes.jsonl"
+    write_recipes(source, 12)
+    writer = RecipeIndexer(index_dir)
+    writer.build_from_file(str(source))
+    generation = writer.ix.latest_generation()
+
+    reader = RecipeIndexer(index_dir, readonly=True, refresh_interval=0)
+    assert reader.search("番茄", view="summary")["pagination"]["total"] == 12
+
+    # A rebuild from another indexer, as src/build_index.py does offline
+    write_recipes(source, 10)
+    RecipeIndexer(index_dir).build_from_file(str(source))
+    assert writer.ix.latest_generation() > generation
+    assert reader.search("番茄", view="summary")["pagination"]["total"] == 10
+    assert reader.get_categories_summary() == {"家常菜": 10}
+
+
+def test_load_or_build_keeps_incremental_index(tmp_path):
+    index_dir = str(tmp_path / "index")
+    source = tmp_path / "recipes.jsonl"
+    write_recipes(source, 12)
+    indexer = RecipeIndexer(index_dir)
+    indexer.index_recipes([recipe(100), recipe(101)], mode="upsert")
+
+    # Maintained with upserts and no fingerprint: reopened, not rebuilt
+    assert RecipeIndexer(index_dir).load_or_build(str(source)) is False
+    assert indexer.get_by_id("100") is not None
+
+
+def test_reader_does_not_serve_deleted_recipe(tmp_path):
+    index_dir = str(tmp_path / "index")
+    writer = RecipeIndexer(index_dir)
+    writer.index_recipes([recipe(1), recipe(2)])
+
+    reader = RecipeIndexer(index_dir, readonly=True, refresh_interval=0)
+    assert reader.get_by_id("1")["title"] == "番茄炒蛋1"
+    writer.delete_recipes(["1"])
+    assert reader.get_by_id("1") is None
+
+
+def test_writers_keep_each_others_counts(tmp_path):
+    index_dir = str(tmp_path / "index")
+    first = RecipeIndexer(index_dir)
+    second = RecipeIndexer(index_dir)
+    # Within one refresh interval, so first never refreshes its generation
+    first.index_recipes([dict(recipe(1), categories=["甲"])], mode="upsert")
+    second.index_recipes([dict(recipe(2), categories=["乙"])], mode="upsert")
+    first.index_recipes([dict(recipe(3), categories=["丙"])], mode="upsert")
+
+    reader = RecipeIndexer(index_dir, readonly=True)
+    assert reader.get_categories_summary() == {"甲": 1, "乙": 1, "丙": 1}
+    assert [item["text"] for item in reader.suggest("番茄炒蛋")] == [
+        "番茄炒蛋1",
+        "番茄炒蛋2",
+        "番茄炒蛋3",
+    ]
+    assert reader.by_ingredients("番茄")["pagination"]["total"] == 3
+
+
+def test_sidecar_matches_index_after_changes(tmp_path):
+    index_dir = str(tmp_path / "index")
+    indexer = RecipeIndexer(index_dir)
+    indexer.index_recipes([recipe(n) for n in range(5)])
+    changed = dict(recipe(1), categories=["快手菜"])
+    changed["ingredients"] = {"主料": [{"name": "鸡蛋", "amount": "3个"}]}
+    indexer.index_recipes([changed, recipe(5)], mode="upsert")
+    indexer.delete_recipes(["2", "404"])
+
+    generation = indexer.ix.latest_generation()
+    searcher = indexer.ix.searcher()
+    assert indexer.sidecar.read("categories", generation) == {
+        "家常菜": 4,
+        "快手菜": 1,
+    }
+    assert indexer.sidecar.read("terms", generation) == dict(
+        indexer._count_terms(searcher)
+    )
+    assert indexer.sidecar.read("pantry", generation) == (
+        indexer._collect_pantry_rows(searcher)
+    )
+    assert ("title", "番茄炒蛋2") not in indexer.sidecar.read("terms", generation)
+    searcher.close()
+
+
+def test_writer_rebuilds_stale_sidecar(tmp_path):
+    index_dir = str(tmp_path / "index")
+    indexer = RecipeIndexer(index_dir)
+    indexer.index_recipes([recipe(n) for n in range(3)])
+    # As left by a writer interrupted between the index and sidecar commits
+    os.remove(indexer.sidecar.path)
+
+    reader = RecipeIndexer(index_dir, readonly=True)
+    assert reader.get_categories_summary() == {"家常菜": 3}
+    indexer.index_recipes([recipe(3)], mode="upsert")
+    assert indexer.sidecar.read("categories", indexer.ix.latest_generation()) == {
+        "家常菜": 4
+    }
+
+
+def test_upsert_stats_and_skipped_recipes(tmp_path):
+    indexer = RecipeIndexer(str(tmp_path / "index"))
+    assert indexer.index_recipes([recipe(1), recipe(2)], mode="upsert") == {
+        "added": 2,
+        "updated": 0,
+        "skipped": 0,
+    }
+    changed = dict(recipe(2), title="番茄炒蛋盖饭")
+    stats = indexer.index_recipes([recipe(1), changed, changed, recipe(3)], "upsert")
+    assert stats == {"added": 1, "updated": 1, "skipped": 2}
+    assert indexer.get_by_id("2")["title"] == "番茄炒蛋盖饭"
+
+    stats = indexer.index_recipes([dict(recipe(1), title="x")], "skip_existing")
+    assert stats == {"added": 0, "updated": 0, "skipped": 1}
+    assert indexer.get_by_id("1")["title"] == "番茄炒蛋1"
+
+
+def test_unchanged_batch_does_not_commit(tmp_path, monkeypatch):
+    indexer = RecipeIndexer(str(tmp_path / "index"))
+    indexer.index_recipes([recipe(n) for n in range(3)], mode="upsert")
+    generation = indexer.ix.latest_generation()
+
+    built = []
+    document = indexer._document
+    monkeypatch.setattr(
+        indexer, "_document", lambda *args: built.append(args) or document(*args)
+    )
+    stats = indexer.index_recipes([recipe(n) for n in range(3)], mode="upsert")
+    assert stats == {"added": 0, "updated": 0, "skipped": 3}
+    # Unchanged recipes are skipped before their document is built
+    assert built == []
+    assert indexer.delete_recipes(["404"]) == 0
+    assert indexer.ix.latest_generation() == generation
+
+    assert indexer.delete_recipes(["1", "404"]) == 1
+    assert indexer.ix.latest_generation() > generation
+    assert indexer.get_by_id("1") is None
+
+
+def test_parallel_build_matches_serial_build(tmp_path):
+    recipes = [recipe(n) for n in range(30)]
+    serial = RecipeIndexer(str(tmp_path / "serial"))
+    serial.index_recipes(recipes)
+    parallel = RecipeIndexer(str(tmp_path / "parallel"))
+    assert parallel.build_parallel(recipes, procs=2, batch_size=7) == 30
+
+    def hits(indexer):
+        items = indexer.search("番茄", per_page=30, view="summary")["items"]
+        return [(item["recipe_id"], item["score"]) for item in items]
+
+    assert hits(parallel) == hits(serial)
+    assert parallel.get_categories_summary() == {"家常菜": 30}
+
+
+def test_failed_parallel_commit_releases_lock(tmp_path, monkeypatch):
+    indexer = RecipeIndexer(str(tmp_path / "index"))
+
+    def fail(self, segments):
+        raise OSError("disk full")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(SegmentWriter, "_commit_toc", fail)
+        with pytest.raises(OSError):
+            indexer.build_parallel([recipe(n) for n in range(10)], procs=2)
+    assert indexer.index_recipes([recipe(1)], mode="upsert")["added"] == 1
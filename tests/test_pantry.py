@@ -0,0 +1,64 @@
+from src.search_engine.pantry import (
+    PantryIndex,
+    ingredient_sets,
+    normalize_ingredient,
+    parse_pantry,
+)
+
+
+def rows(recipes):
+    return {
+        recipe_id: {"main": main, "other": other}
+        for recipe_id, (main, other) in recipes.items()
+    }
+
+
+def test_names_are_normalized():
+    assert normalize_ingredient(" 西红柿（去皮） ") == "番茄"
+    assert normalize_ingredient("盐") is None
+    assert parse_pantry("鸡蛋，西红柿、番茄 盐;葱花") == ["鸡蛋", "番茄", "葱"]
+
+
+def test_ingredient_sets_without_main_section():
+    sets = ingredient_sets(
+        {
+            "食材": [{"name": "鸡蛋"}, {"name": "油"}],
+            "调料": [{"name": "小葱"}, {"name": "土鸡蛋"}],
+        }
+    )
+    # The first section holds the main ingredients, the others skip them
+    assert sets == {"main": ["鸡蛋"], "other": ["葱"]}
+
+
+def test_ranking_by_missing_then_coverage_then_others():
+    index = PantryIndex(
+        rows(
+            {
+                "a": (["鸡蛋", "番茄"], []),
+                "b": (["鸡蛋"], []),
+                "c": (["鸡蛋", "番茄", "牛肉"], ["葱"]),
+                "d": (["鸡蛋", "牛肉"], []),
+                "e": (["鸡蛋", "牛肉"], ["葱"]),
+                "f": (["牛肉"], ["鸡蛋"]),
+            }
+        )
+    )
+    ranked = [index.recipe_ids[row] for row in index.match(["鸡蛋", "番茄", "葱"])]
+    # a and b miss nothing, then c covers 2 of 3, e and d 1 of 2 and only e
+    # has the 葱; f uses 鸡蛋 as another ingredient only
+    assert ranked == ["a", "b", "c", "e", "d"]
+    assert index.main_ingredients(index.recipe_ids.index("c")) == [
+        "鸡蛋",
+        "番茄",
+        "牛肉",
+    ]
+
+
+def test_max_missing_and_unknown_ingredients():
+    index = PantryIndex(
+        rows({"a": (["鸡蛋"], []), "b": (["鸡蛋", "番茄", "牛肉"], [])})
+    )
+    assert [index.recipe_ids[row] for row in index.match(["鸡蛋"], 1)] == ["a"]
+    assert len(index.match(["鸡蛋"], 2)) == 2
+    assert len(index.match(["榴莲"])) == 0
+    assert len(PantryIndex({}).match(["鸡蛋"])) == 0
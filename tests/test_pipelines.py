@@ -0,0 +1,79 @@
+from scrapy import Spider
+from src import pipelines
+from src.pipelines import MeishiIndexPipeline
+from src.search_engine.indexer import RecipeIndexer
+from twisted.internet import defer
+from whoosh.index import LockError
+import pytest
+
+
+def recipe(n: int) -> dict:
+    return {
+        "recipe_id": str(n),
+        "title": f"番茄炒蛋{n}",
+        "ingredients": {"主料": [{"name": "番茄", "amount": "2个"}]},
+        "steps": [{"text": "炒熟"}],
+        "categories": ["家常菜"],
+    }
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    # Commit on the calling thread, without a running reactor
+    monkeypatch.setattr(pipelines.threads, "deferToThread", defer.maybeDeferred)
+    pipeline = MeishiIndexPipeline(
+        str(tmp_path / "index"), batch_size=2, flush_interval=60, merge_policy="small"
+    )
+    pipeline.indexer = RecipeIndexer(pipeline.index_dir)
+    return pipeline
+
+
+def indexed(pipeline):
+    reader = RecipeIndexer(pipeline.index_dir, readonly=True)
+    return reader.search("番茄", view="summary")["pagination"]["total"]
+
+
+def test_full_batch_is_committed(pipeline):
+    spider = Spider(name="test")
+    pipeline.process_item({"title": "列表页，没有 recipe_id"}, spider)
+    pipeline.process_item(recipe(1), spider)
+    assert pipeline.buffer == [recipe(1)]
+    pipeline.process_item(recipe(2), spider)
+    assert pipeline.buffer == []
+    assert indexed(pipeline) == 2
+    # An interval flush with nothing buffered does not commit
+    assert pipeline.flush(spider) is None
+
+
+def test_failed_batch_is_retried_by_next_flush(pipeline, monkeypatch):
+    spider = Spider(name="test")
+    index_recipes = pipeline.indexer.index_recipes
+
+    def locked(*args, **kwargs):
+        raise LockError("held by another process")
+
+    monkeypatch.setattr(pipeline.indexer, "index_recipes", locked)
+    pipeline.process_item(recipe(1), spider)
+    pipeline.process_item(recipe(2), spider)
+    # The batch goes back to the buffer, ahead of newer recipes
+    pipeline.process_item(recipe(3), spider)
+    assert [item["recipe_id"] for item in pipeline.buffer] == ["1", "2", "3"]
+
+    monkeypatch.setattr(pipeline.indexer, "index_recipes", index_recipes)
+    pipeline.flush(spider)
+    assert pipeline.buffer == []
+    assert indexed(pipeline) == 3
+
+
+def test_last_flush_fails_when_commit_fails(pipeline, monkeypatch):
+    spider = Spider(name="test")
+    pipeline.process_item(recipe(1), spider)
+
+    def broken(*args, **kwargs):
+        raise ValueError("disk full")
+
+    monkeypatch.setattr(pipeline.indexer, "index_recipes", broken)
+    failures = []
+    pipeline.flush(spider, force=True).addErrback(failures.append)
+    assert failures and failures[0].check(ValueError)
+    assert pipeline.buffer == [recipe(1)]
@@ -0,0 +1,48 @@
+from src.search_engine.recipe_stream import iter_batches, iter_recipes
+import json
+import pytest
+
+VALUES = [
+    1,
+    23,
+    456,
+    -7.5e3,
+    {"recipe_id": "1", "title": "番茄炒蛋, 简单]", "steps": [{"text": "炒"}]},
+    "鸡蛋",
+    True,
+    None,
+    [1, 2],
+    {},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 5, 8, 13, 1 << 16])
+def test_array_is_decoded_whatever_the_chunk_size(tmp_path, chunk_size):
+    path = tmp_path / "recipes.json"
+    path.write_text(
+        " [ " + " ,\n".join(json.dumps(v, ensure_ascii=False) for v in VALUES) + "] ",
+        encoding="utf-8",
+    )
+    assert list(iter_recipes(str(path), chunk_size)) == VALUES
+
+
+@pytest.mark.parametrize(
+    "text", ["[1 2]", "[1,, 2]", "[1, 2", "[1, 2,]", '[{"a": 1}{"a": 2}]', "[12"]
+)
+def test_malformed_array_raises(tmp_path, text):
+    path = tmp_path / "recipes.json"
+    path.write_text(text, encoding="utf-8")
+    for chunk_size in (1, 2, 1 << 16):
+        with pytest.raises(ValueError):
+            list(iter_recipes(str(path), chunk_size))
+
+
+def test_json_lines_and_batches(tmp_path):
+    path = tmp_path / "recipes.jsonl"
+    path.write_text(
+        "\n".join(json.dumps({"recipe_id": str(n)}) for n in range(5)) + "\n\n",
+        encoding="utf-8",
+    )
+    batches = list(iter_batches(iter_recipes(str(path)), 2))
+    assert [len(batch) for batch in batches] == [2, 2, 1]
+    assert batches[-1] == [{"recipe_id": "4"}]
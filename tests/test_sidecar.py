@@ -0,0 +1,43 @@
+from src.search_engine.sidecar import IndexSidecar
+
+
+def test_counts_are_applied_as_changes(tmp_path):
+    sidecar = IndexSidecar(str(tmp_path))
+    update = sidecar.begin()
+    assert update.generation is None
+    update.count_categories({"家常菜": 2, "快手菜": 1})
+    update.count_terms({("ingredient", "番茄"): 2})
+    update.commit(1)
+
+    update = sidecar.begin()
+    assert update.generation == 1
+    update.count_categories({"家常菜": -1, "快手菜": -1, "汤": 1})
+    update.count_terms({("ingredient", "番茄"): -2, ("title", "番茄汤"): 1})
+    update.commit(2)
+
+    assert sidecar.read("categories", 2) == {"家常菜": 1, "汤": 1}
+    assert sidecar.read("terms", 2) == {("title", "番茄汤"): 1}
+
+
+def test_read_only_serves_its_generation(tmp_path):
+    sidecar = IndexSidecar(str(tmp_path))
+    assert sidecar.read("categories", 1) is None
+    update = sidecar.begin()
+    update.set_pantry({"1": {"main": ["番茄"], "other": ["鸡蛋"]}})
+    update.commit(1)
+
+    assert sidecar.read("pantry", 1) == {"1": {"main": ["番茄"], "other": ["鸡蛋"]}}
+    assert sidecar.read("pantry", 2) is None
+
+
+def test_rollback_keeps_previous_state(tmp_path):
+    sidecar = IndexSidecar(str(tmp_path))
+    update = sidecar.begin()
+    update.set_pantry({"1": {"main": ["番茄"], "other": []}})
+    update.commit(1)
+
+    update = sidecar.begin()
+    update.delete_pantry(["1"])
+    update.clear()
+    update.rollback()
+    assert sidecar.read("pantry", 1) == {"1": {"main": ["番茄"], "other": []}}
@@ -0,0 +1,41 @@
+from src.search_engine.similar import nearest_neighbours, tfidf
+import numpy as np
+import random
+
+
+def documents(count):
+    rng = random.Random(7)
+    words = [f"w{n}" for n in range(40)]
+    return [rng.choices(words, k=rng.randint(1, 8)) for _ in range(count)]
+
+
+def brute_force(indptr, indices, weights, k):
+    n = len(indptr) - 1
+    dense = np.zeros((n, indices.max() + 1))
+    for row in range(n):
+        dense[row, indices[indptr[row] : indptr[row + 1]]] = weights[
+            indptr[row] : indptr[row + 1]
+        ]
+    scores = dense @ dense.T
+    np.fill_diagonal(scores, 0)
+    return -np.sort(-scores, axis=1)[:, :k]
+
+
+def test_batches_bounded_by_scores_find_the_same_neighbours():
+    matrix = tfidf(documents(60))
+    expected = brute_force(*matrix, k=5)
+    reference = nearest_neighbours(*matrix, k=5)
+    assert np.allclose(reference[1], expected, atol=1e-6)
+    for max_scores in (1, 100):
+        neighbours, similarities = nearest_neighbours(
+            *matrix, k=5, max_scores=max_scores
+        )
+        assert np.array_equal(neighbours, reference[0])
+        assert np.array_equal(similarities, reference[1])
+
+
+def test_rows_without_neighbours_are_padded():
+    matrix = tfidf([["a"], ["b"], ["a"]])
+    neighbours, similarities = nearest_neighbours(*matrix, k=2)
+    assert neighbours.tolist() == [[2, -1], [-1, -1], [0, -1]]
+    assert similarities[1].tolist() == [0, 0]
@@ -0,0 +1,47 @@
+from src.search_engine.suggest import PRECOMPUTED_PREFIX, SuggestIndex
+import pytest
+
+TERMS = [
+    ("ingredient", "西红柿", 30),
+    ("title", "西红柿炒鸡蛋", 12),
+    ("title", "西红柿牛腩", 12),
+    ("category", "西餐", 12),
+    ("ingredient", "鸡蛋", 80),
+    ("title", "消失的菜", 0),
+]
+
+
+def texts(results):
+    return [result["text"] for result in results]
+
+
+def test_prefixes_rank_by_count_then_kind():
+    index = SuggestIndex(TERMS)
+    assert len(index) == 5
+    # Equal counts: categories, then shorter texts first
+    assert texts(index.suggest("西")) == [
+        "西红柿",
+        "西餐",
+        "西红柿牛腩",
+        "西红柿炒鸡蛋",
+    ]
+    assert index.suggest("鸡") == [{"text": "鸡蛋", "kind": "ingredient", "count": 80}]
+    assert texts(index.suggest(" 西红 ", limit=2)) == ["西红柿", "西红柿牛腩"]
+    assert index.suggest("消失") == []
+    assert index.suggest("  ") == []
+
+
+def test_long_prefixes_match_like_precomputed_ones():
+    index = SuggestIndex(TERMS)
+    prefix = "西红柿炒鸡"
+    assert len(prefix) > PRECOMPUTED_PREFIX
+    assert texts(index.suggest(prefix)) == ["西红柿炒鸡蛋"]
+    assert texts(index.suggest("西红柿")) == texts(index.suggest("西红柿 "))
+
+
+def test_pinyin_and_initials_prefixes():
+    pytest.importorskip("pypinyin")
+    index = SuggestIndex(TERMS)
+    assert texts(index.suggest("xhs")) == ["西红柿", "西红柿牛腩", "西红柿炒鸡蛋"]
+    assert texts(index.suggest("xihongshic")) == ["西红柿炒鸡蛋"]
+    assert texts(index.suggest("JiDan")) == ["鸡蛋"]